@@ -1 +1,7 @@
-from .factories import StreamEngine, create_engine  # noqa: F401
+from .db import DatabaseExecutor  # noqa: F401
+from .engine import Record  # noqa: F401
+from .factories import (  # noqa: F401
+    StreamEngine,
+    create_engine,
+    create_engine_from_settings,
+)
@@ -1,5 +1,82 @@
+import asyncio
+import logging
+import os
+import sys
+from typing import List, Optional, Sequence
+
 from django.apps import AppConfig
 
+logger = logging.getLogger(__name__)
+
+# management commands that serve requests, with any other command, like
+# `migrate` or `shell`, the producer is not started when django starts
+SERVING_COMMANDS = {"runserver"}
+
+
+def is_serving(argv: Optional[List[str]] = None) -> bool:
+    """
+    Whether the process serves requests: it runs a server, like gunicorn
+    or uvicorn, or one of the `SERVING_COMMANDS` management commands
+    """
+    argv = sys.argv if argv is None else argv
+    if not argv:
+        return True
+
+    # `python manage.py`, `django-admin` or `python -m django`
+    *_, package, program = ["", *os.path.normpath(argv[0]).split(os.sep)]
+    is_command = program in ("manage.py", "django-admin") or (
+        package == "django" and program == "__main__.py"
+    )
+    if not is_command:
+        return True
+    return len(argv) > 1 and argv[1] in SERVING_COMMANDS
+
+
+async def prewarm_producer(engine, topics: Sequence[str]) -> None:
+    try:
+        await engine._prewarm_producer(topics)
+    except Exception as exc:
+        # the producer is started again on the first `send`
+        logger.warning(f"Producer could not be prewarmed: {exc!r}")
+    else:
+        logger.info(f"Producer prewarmed for topics {list(topics)}")
+
 
 class DjangoStreams(AppConfig):
     name = "django_streams"
+    default_auto_field = "django.db.models.BigAutoField"
+
+    prewarm_task: Optional[asyncio.Task] = None
+
+    def ready(self):
+        from . import conf
+        from .factories import create_engine_from_settings
+
+        if not conf.is_configured():
+            return None
+
+        streams_settings = conf.get_settings()
+        engine = create_engine_from_settings()
+
+        if not is_serving():
+            return None
+
+        try:
+            if streams_settings["PRODUCER_THREAD"]:
+                engine.start_producer_thread()
+            if streams_settings["PREWARM_PRODUCER"]:
+                self.prewarm_producer(engine, streams_settings["TOPICS"])
+        except Exception as exc:
+            # the producer is started again on the first `sync_send`
+            logger.warning(f"Producer could not be prewarmed: {exc!r}")
+
+    def prewarm_producer(self, engine, topics: Sequence[str]) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            engine.prewarm_producer(topics)
+        else:
+            # under ASGI django can start inside the server loop, where the
+            # sync methods can not be called, then the producer of the loop
+            # is prewarmed in the background
+            self.prewarm_task = loop.create_task(prewarm_producer(engine, topics))
@@ -0,0 +1,188 @@
+import itertools
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Type
+
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+
+from .engine import Record, StreamEngine
+from .model_events import ModelEventSerializer
+
+SAVE = "save"
+DELETE = "delete"
+
+
+class ModelChanges:
+    """
+    Produce the changes of a model to a topic, after the transaction commits.
+
+    Every change is an event with the key of the instance and the value
+    `{"op": "save" | "delete", "data": {...}}`, where `data` is built with a
+    `ModelEventSerializer`. The changes of the same instance inside a transaction
+    are coalesced: only the last one is produced, when the transaction commits.
+
+    `post_save` and `post_delete` are not sent by `bulk_create`, `bulk_update`
+    and `QuerySet.update`, use a `StreamedQuerySet` as manager of the model
+    so they produce the changes of all the rows as one batch.
+
+    Attributes:
+        engine StreamEngine: engine to produce the changes
+        serializer ModelEventSerializer: serializer of the instances
+    """
+
+    def __init__(self, engine: StreamEngine, serializer: ModelEventSerializer) -> None:
+        self.engine = engine
+        self.serializer = serializer
+        self.model = serializer.model
+
+    def __str__(self) -> str:
+        return (
+            f"ModelChanges(model={self.model.__name__}, topic={self.serializer.topic})"
+        )
+
+    def connect(self) -> None:
+        dispatch_uid = f"django_streams.cdc.{self.model._meta.label}"
+        post_save.connect(
+            self.on_save, sender=self.model, weak=False, dispatch_uid=dispatch_uid
+        )
+        post_delete.connect(
+            self.on_delete, sender=self.model, weak=False, dispatch_uid=dispatch_uid
+        )
+
+    def disconnect(self) -> None:
+        dispatch_uid = f"django_streams.cdc.{self.model._meta.label}"
+        post_save.disconnect(sender=self.model, dispatch_uid=dispatch_uid)
+        post_delete.disconnect(sender=self.model, dispatch_uid=dispatch_uid)
+
+    def on_save(
+        self, sender: Type[models.Model], instance: models.Model, raw: bool, **kwargs
+    ) -> None:
+        # fixtures loaded with `loaddata` are not changes
+        if not raw:
+            self.publish([instance], using=kwargs.get("using"))
+
+    def on_delete(
+        self, sender: Type[models.Model], instance: models.Model, **kwargs
+    ) -> None:
+        self.publish([instance], op=DELETE, using=kwargs.get("using"))
+
+    def publish(
+        self,
+        instances: Iterable[models.Model],
+        *,
+        op: str = SAVE,
+        using: Optional[str] = None,
+    ) -> None:
+        self.engine.send_many_on_commit(
+            (self._to_change(self.serializer.to_record(obj), op) for obj in instances),
+            coalesce=True,
+            using=using,
+        )
+
+    def publish_queryset(self, queryset: models.QuerySet) -> None:
+        """
+        Produce the changes of the rows of the queryset without creating
+        the model instances.
+        """
+        self.engine.send_many_on_commit(
+            (self._to_change(record) for record in self.serializer.records(queryset)),
+            coalesce=True,
+            using=queryset.db,
+        )
+
+    @staticmethod
+    def _to_change(record: Record, op: str = SAVE) -> Record:
+        return record._replace(value={"op": op, "data": record.value})
+
+
+# the models whose changes are produced
+registry: Dict[Type[models.Model], ModelChanges] = {}
+
+
+def register(
+    engine: StreamEngine,
+    model: Type[models.Model],
+    topic: str,
+    *,
+    fields: Optional[Sequence[str]] = None,
+    key_field: str = "pk",
+    headers: Optional[Dict] = None,
+) -> ModelChanges:
+    """
+    Produce the changes of the model to the topic. The arguments are the ones
+    of `ModelEventSerializer`.
+
+    !!! Example
+        ```python
+        from django_streams import cdc
+
+        from .engine import stream_engine
+
+
+        class OrdersConfig(AppConfig):
+            def ready(self):
+                cdc.register(stream_engine, Order, "local--orders")
+        ```
+    """
+    unregister(model)
+    changes = ModelChanges(
+        engine,
+        ModelEventSerializer(
+            model, topic, fields=fields, key_field=key_field, headers=headers
+        ),
+    )
+    changes.connect()
+    registry[model] = changes
+    return changes
+
+
+def unregister(model: Type[models.Model]) -> None:
+    changes = registry.pop(model, None)
+    if changes is not None:
+        changes.disconnect()
+
+
+def _batches(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+class StreamedQuerySet(models.QuerySet):
+    """
+    QuerySet that produces the changes of the bulk operations, which do not send
+    signals, when its model is registered. `bulk_update` calls `update`, which
+    produces the rows as they are after the update. `delete` sends `post_delete`
+    for every row, so it is produced by the signals.
+
+    !!! Example
+        ```python
+        class Order(models.Model):
+            ...
+
+            objects = StreamedQuerySet.as_manager()
+        ```
+    """
+
+    # primary keys per query when the updated rows are fetched again
+    PK_BATCH_SIZE = 500
+
+    def bulk_create(self, objs: Iterable[models.Model], *args, **kwargs) -> List:
+        created = super().bulk_create(objs, *args, **kwargs)
+        changes = registry.get(self.model)
+        if changes is not None:
+            changes.publish(created, using=self.db)
+        return created
+
+    def update(self, **kwargs) -> int:
+        changes = registry.get(self.model)
+        if changes is None:
+            return super().update(**kwargs)
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            # the rows might not match the filters after the update
+            pks = list(self.values_list("pk", flat=True))
+            rows = super().update(**kwargs)
+            manager = self.model._base_manager.using(self.db)
+            for batch in _batches(pks, self.PK_BATCH_SIZE):
+                changes.publish_queryset(manager.filter(pk__in=batch).order_by("pk"))
+        return rows
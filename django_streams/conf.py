@@ -0,0 +1,62 @@
+from typing import Any, Dict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+DEFAULTS: Dict[str, Any] = {
+    # title of the engine
+    "TITLE": None,
+    # `kstreams.backends.Kafka` instance or the arguments to create it
+    "BACKEND": None,
+    # instances or dotted paths of the classes
+    "SERIALIZER": None,
+    "DESERIALIZER": None,
+    "MONITOR": "kstreams.PrometheusMonitor",
+    # extra arguments of the producer, like `linger_ms` or `acks`
+    "PRODUCER_CONFIG": {},
+    # start the producer thread when django starts
+    "PRODUCER_THREAD": False,
+    # start the producer and fetch the metadata of `TOPICS` when django starts
+    "PREWARM_PRODUCER": False,
+    "TOPICS": [],
+    # event loop of the worker and the producer thread, `asyncio` or `uvloop`
+    "EVENT_LOOP": "asyncio",
+    # static members of the consumer groups named after the pod or the hostname
+    "STATIC_MEMBERSHIP": False,
+    # `roundrobin`, `range` or `sticky`, default `roundrobin`
+    "PARTITION_ASSIGNOR": None,
+}
+
+
+def get_settings() -> Dict[str, Any]:
+    """
+    Returns the `DJANGO_STREAMS` setting with the defaults.
+
+    Raises:
+        ImproperlyConfigured: if there are unknown keys
+    """
+    user_settings = getattr(settings, "DJANGO_STREAMS", {})
+    unknown = set(user_settings).difference(DEFAULTS)
+    if unknown:
+        raise ImproperlyConfigured(
+            f"Unknown DJANGO_STREAMS settings {sorted(unknown)}. "
+            f"Available settings: {list(DEFAULTS)}"
+        )
+    return {**DEFAULTS, **user_settings}
+
+
+def is_configured() -> bool:
+    return hasattr(settings, "DJANGO_STREAMS")
+
+
+def load(value: Any) -> Any:
+    """
+    Import the dotted path and create an instance if it is a class,
+    any other value is returned as it is.
+    """
+    if isinstance(value, str):
+        value = import_string(value)
+    if isinstance(value, type):
+        value = value()
+    return value
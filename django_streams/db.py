@@ -0,0 +1,161 @@
+import asyncio
+import contextvars
+import functools
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, List, Optional, TypeVar
+
+import django
+from django.db import close_old_connections, connections, models, transaction
+from prometheus_client import Gauge, Histogram
+
+T = TypeVar("T")
+
+
+def bulk_upsert(
+    queryset: models.QuerySet,
+    objs: List[models.Model],
+    *,
+    unique_field: str,
+    update_fields: List[str],
+) -> None:
+    """
+    Create the rows, or update the `update_fields` of the ones whose
+    `unique_field` exists, with one query when the database supports it:
+    `INSERT ... ON CONFLICT (unique_field) DO UPDATE` in PostgreSQL and SQLite,
+    and `INSERT ... ON DUPLICATE KEY UPDATE` in MySQL and MariaDB, which do
+    not accept the unique fields. With django < 4.1 and the other databases
+    the existing rows are updated one by one and the others created in bulk.
+    """
+    features = connections[queryset.db].features
+    if django.VERSION >= (4, 1) and features.supports_update_conflicts:
+        queryset.bulk_create(
+            objs,
+            update_conflicts=True,
+            unique_fields=(
+                [unique_field]
+                if features.supports_update_conflicts_with_target
+                else None
+            ),
+            update_fields=update_fields,
+        )
+        return None
+
+    with transaction.atomic(using=queryset.db):
+        missing = [
+            obj
+            for obj in objs
+            if not queryset.filter(**{unique_field: getattr(obj, unique_field)}).update(
+                **{field: getattr(obj, field) for field in update_fields}
+            )
+        ]
+        queryset.bulk_create(missing)
+
+
+class DatabaseExecutor(ThreadPoolExecutor):
+    """
+    Thread pool to run the django ORM from the streams.
+
+    `sync_to_async` runs every function in the same thread by default
+    (`thread_sensitive=True`), so all the streams of a worker use the database
+    one after the other. A `DatabaseExecutor` runs them in `max_workers` threads,
+    each one with its own database connection.
+
+    Like django does for every request, `close_old_connections` is called before
+    and after each function, so connections that are broken or older than
+    `CONN_MAX_AGE` are closed and never reused.
+
+    Attributes:
+        max_workers int | None: amount of threads
+        name str: name of the executor, used as thread name prefix and
+            as label of the metrics
+    """
+
+    # seconds that the functions are waiting for a free thread
+    MET_WAIT_TIME = Histogram(
+        "django_streams_db_executor_wait_seconds",
+        "help seconds waiting for a database thread",
+        ["executor"],
+    )
+    # functions waiting for a free thread
+    MET_QUEUE_DEPTH = Gauge(
+        "django_streams_db_executor_queue_depth",
+        "help functions waiting for a database thread",
+        ["executor"],
+        multiprocess_mode="livesum",
+    )
+
+    def __init__(self, max_workers: Optional[int] = None, *, name: str = "default"):
+        super().__init__(
+            max_workers=max_workers, thread_name_prefix=f"django-streams-db-{name}"
+        )
+        self.name = name
+        self._wait_time = self.MET_WAIT_TIME.labels(executor=name)
+        self._queue_depth = self.MET_QUEUE_DEPTH.labels(executor=name)
+
+    def __str__(self) -> str:
+        return f"DatabaseExecutor(name={self.name}, max_workers={self._max_workers})"
+
+    def submit(self, fn: Callable[..., T], /, *args, **kwargs) -> "Future[T]":
+        self._queue_depth.inc()
+        try:
+            future = super().submit(self._call, time.monotonic(), fn, *args, **kwargs)
+        except BaseException:
+            # the executor is shut down
+            self._queue_depth.dec()
+            raise
+        future.add_done_callback(self._on_cancelled)
+        return future
+
+    def _on_cancelled(self, future: "Future") -> None:
+        # `shutdown(cancel_futures=True)` cancels the functions
+        # that are waiting, so `_call` is never called
+        if future.cancelled():
+            self._queue_depth.dec()
+
+    def _call(self, submitted_at: float, fn: Callable[..., T], *args, **kwargs) -> T:
+        self._queue_depth.dec()
+        self._wait_time.observe(time.monotonic() - submitted_at)
+
+        close_old_connections()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Run a `sync` function in the executor and wait for its result.
+        The context variables are copied to the thread, like with `sync_to_async`.
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self, functools.partial(context.run, fn, *args, **kwargs)
+        )
+
+    def sync_to_async(self, fn: Callable[..., T]) -> Callable[..., Awaitable[T]]:
+        """
+        Decorator to call a `sync` function from a coroutine using the executor.
+
+        !!! Example
+            ```python
+            db_executor = DatabaseExecutor(max_workers=4)
+
+
+            @db_executor.sync_to_async
+            def increase(pk: int):
+                HelloWorld.objects.filter(pk=pk).update(total=F("total") + 1)
+
+
+            @stream_engine.stream("local--hello-world", group_id="my-group")
+            async def consume(cr: ConsumerRecord):
+                await increase(int(cr.key))
+            ```
+        """
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs) -> Any:
+            return await self.run(fn, *args, **kwargs)
+
+        return wrapper
@@ -1,13 +1,55 @@
 import asyncio
+import concurrent.futures
 import logging
-from threading import Lock
-from typing import Any, Dict, Optional
+import os
+import re
+import time
+from functools import partial, update_wrapper
+from threading import Lock, Thread, local
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
 
 from aiokafka.structs import RecordMetadata
+from django.db import models, transaction
+from kstreams import Stream
+from kstreams.clients import Producer
+from kstreams.consts import StreamErrorPolicy, UDFType
 from kstreams.engine import StreamEngine as Base
+from kstreams.middleware import ExceptionMiddleware, Middleware
+from kstreams.middleware.udf_middleware import UdfHandler
+from kstreams.rebalance_listener import MetricsRebalanceListener, RebalanceListener
+from kstreams.serializers import Serializer
+from kstreams.streams import StreamFunc
+from kstreams.structs import TopicPartitionOffset
+from kstreams.types import Headers
+from kstreams.utils import encode_headers
+
+from . import loops, membership, metrics
+from .db import DatabaseExecutor
+from .lag import LagExporter
+from .loop_monitor import LoopMonitor
+from .retries import RetryDelayMiddleware, RetryMiddleware, RetryPolicy
+from .streams import BatchFunc, BatchStream, ConcurrentStream
+from .tables import Table, TablesRebalanceListener
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 
 class Singleton(type):
     _instances: Dict = {}
@@ -18,24 +60,388 @@ class Singleton(type):
         return cls._instances[cls]
 
 
+class Record(NamedTuple):
+    """
+    A record to produce with `send_many` or `sync_send_many`.
+    Plain tuples with the same order are accepted as well.
+    """
+
+    topic: str
+    value: Any = None
+    key: Optional[str] = None
+    headers: Optional[Dict] = None
+    partition: Optional[int] = None
+    timestamp_ms: Optional[int] = None
+
+
+class LoopProducer(NamedTuple):
+    loop: asyncio.AbstractEventLoop
+    producer: Producer
+    # task that stops the producer when the loop shuts down
+    watcher: asyncio.Task
+
+
+class OnCommitSegment:
+    """
+    Records added to an `OnCommitBuffer` inside the same savepoint. The segment
+    is registered with `transaction.on_commit`, so django discards it when the
+    savepoint is rolled back and calls it after the commit otherwise.
+    """
+
+    def __init__(self, savepoints: Tuple) -> None:
+        self.savepoints = savepoints
+        self.records: List[Tuple[Record, bool]] = []
+        self.committed = False
+
+    def __call__(self) -> None:
+        self.committed = True
+
+
+def _has_commit_hooks(connection) -> bool:
+    """
+    Whether the commit hooks of the connection, which are private to django,
+    are as the `OnCommitBuffer` expects them: a list of `(savepoint ids, func,
+    ...)` from django 3.2 to 5.x.
+    """
+    callbacks = getattr(connection, "run_on_commit", None)
+    return isinstance(callbacks, list) and all(
+        isinstance(callback, tuple)
+        and len(callback) >= 2
+        and isinstance(callback[0], set)
+        for callback in callbacks
+    )
+
+
+class OnCommitBuffer:
+    """
+    Records produced with `send_on_commit` inside the same transaction. The
+    records are kept in segments, a new one after a savepoint starts or ends,
+    and when the transaction commits the records of the segments that were not
+    rolled back are produced as one batch, in the order they were added.
+
+    The buffer moves its own commit hook to the end, so the connection
+    must have the commit hooks of django, see `_has_commit_hooks`.
+    """
+
+    def __init__(self, engine: "StreamEngine", connection) -> None:
+        self.engine = engine
+        self.connection = connection
+        self.segments: List[OnCommitSegment] = []
+        self.produced = False
+
+    def _is_registered(self, func: Callable) -> bool:
+        return any(callback[1] is func for callback in self.connection.run_on_commit)
+
+    def is_active(self) -> bool:
+        """
+        Whether the transaction of the buffer is still open
+        """
+        return not self.produced and self._is_registered(self)
+
+    def add(self, record: Record, coalesce: bool = False) -> None:
+        """
+        Add a record to the segment of the current savepoint.
+        """
+        # `atomic(savepoint=False)` blocks add `None`, they are rolled back
+        # with the block that contains them
+        savepoints = tuple(
+            sid for sid in self.connection.savepoint_ids if sid is not None
+        )
+        if (
+            not self.segments
+            or self.segments[-1].savepoints != savepoints
+            or not self._is_registered(self.segments[-1])
+        ):
+            segment = OnCommitSegment(savepoints)
+            self.segments.append(segment)
+            transaction.on_commit(segment, using=self.connection.alias)
+            self._register()
+        self.segments[-1].records.append((record, coalesce))
+
+    def _register(self) -> None:
+        # the buffer is called after its segments, so they are marked as
+        # committed, and when the outermost transaction commits, even if it
+        # was registered inside a savepoint that is rolled back afterwards
+        connection = self.connection
+        connection.run_on_commit = [
+            callback for callback in connection.run_on_commit if callback[1] is not self
+        ]
+        transaction.on_commit(self, using=connection.alias)
+        savepoints, func, *_ = connection.run_on_commit[-1]
+        assert func is self, "The commit hook of the buffer was not registered"
+        savepoints.clear()
+
+    def __call__(self) -> None:
+        self.produced = True
+        produce_coalesced(
+            self.engine,
+            [
+                record
+                for segment in self.segments
+                if segment.committed
+                for record in segment.records
+            ],
+        )
+
+
+def produce_coalesced(
+    engine: "StreamEngine", records: List[Tuple[Record, bool]]
+) -> None:
+    """
+    Produce the records as one batch. If a record is coalesced and there is
+    already a coalesced record with the same topic and key, it replaces it,
+    so only the last one is produced in the position of the first one.
+    Records without key are never coalesced.
+    """
+    batch: List[Record] = []
+    # position of the coalesced records by (topic, key)
+    positions: Dict[Tuple[str, str], int] = {}
+    for record, coalesce in records:
+        if not coalesce or record.key is None:
+            batch.append(record)
+            continue
+
+        position = positions.setdefault((record.topic, record.key), len(batch))
+        if position == len(batch):
+            batch.append(record)
+        else:
+            batch[position] = record
+
+    results = engine.sync_send_many(batch)
+    for record, result in zip(batch, results):
+        if isinstance(result, Exception):
+            logger.error(
+                f"Event to topic {record.topic} with key {record.key} "
+                f"could not be produced after commit: {result!r}"
+            )
+
+
 class StreamEngine(Base, metaclass=Singleton):
-    def __init__(self, *args, **kwargs) -> None:
+    def __init__(
+        self,
+        *args,
+        db_executor: Optional[DatabaseExecutor] = None,
+        producer_config: Optional[Dict[str, Any]] = None,
+        loop_monitor: Optional[LoopMonitor] = None,
+        loop_factory: Optional[loops.LoopFactory] = None,
+        lag_exporter: Optional[LagExporter] = None,
+        drain_timeout: Optional[float] = None,
+        group_instance_id: Optional[str] = None,
+        partition_assignor: Optional[str] = None,
+        **kwargs,
+    ) -> None:
         # we need the event loop to stop the consumers when the signal
         # is given from the main Thread (django command)
         super().__init__(*args, **kwargs)
+        self.db_executor = db_executor
+        self.producer_config = producer_config or {}
+        self.loop_monitor = loop_monitor
+        self.lag_exporter = lag_exporter
+        # creates the loop of `sync_send` and the loop of the worker
+        self.loop_factory = loop_factory or asyncio.new_event_loop
+        # seconds to drain the streams on `sync_stop`, otherwise they are cancelled
+        self.drain_timeout = drain_timeout
+        # static membership and partition assignment strategy of the consumers
+        self.group_instance_id = group_instance_id
+        self.partition_assignor = partition_assignor
         self._stream_task: Optional[asyncio.Future] = None
+        self._draining = False
+        self._drain_task: Optional[asyncio.Task] = None
         self._loop: Optional[asyncio.AbstractEventLoop] = None
         self._lock = Lock()
+        self._producer_thread: Optional[Thread] = None
+        # coroutines handed over to the producer thread that are not done yet
+        self._handoffs: Set[concurrent.futures.Future] = set()
+        self._on_commit_buffers = local()
+        self._tables: Dict[str, Table] = {}
+        # retry stream of each stream with `retry_policy`, by the stream name
+        self._retry_streams: Dict[str, Stream] = {}
+
+        # event loop where `_producer` was started, other loops have their own
+        # producer, for example the loop of an ASGI server
+        self._producer_loop: Optional[asyncio.AbstractEventLoop] = None
+        # by `id(loop)`, the producers keep their loop alive, so they are removed
+        # when the loop shuts down or is found closed instead of on collection
+        self._loop_producers: Dict[int, LoopProducer] = {}
+        self._loop_locks: Dict[int, Tuple[asyncio.AbstractEventLoop, asyncio.Lock]] = {}
+        self._loop_locks_lock = Lock()
+
+        # the producer thread and its connections do not survive a fork
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self) -> None:
+        self._loop = None
+        self._lock = Lock()
+        self._producer_thread = None
+        self._handoffs = set()
+        self._producer = None
+        self._producer_loop = None
+        self._loop_producers = {}
+        self._loop_locks = {}
+        self._loop_locks_lock = Lock()
 
     @property
     def loop(self) -> asyncio.AbstractEventLoop:
         if self._loop is None:
-            self._loop = asyncio.new_event_loop()
+            self._loop = self.loop_factory()
         return self._loop
 
+    async def start_producer(self, **kwargs) -> None:
+        try:
+            await super().start_producer(**{**self.producer_config, **kwargs})
+        except Exception:
+            # do not keep a producer that could not connect
+            self._producer = None
+            raise
+        self._producer_loop = asyncio.get_running_loop()
+
+    async def stop_producer(self) -> None:
+        loop = asyncio.get_running_loop()
+        loop_producer = self._pop_loop_producer(loop)
+        if loop_producer is not None:
+            loop_producer.watcher.cancel()
+            await loop_producer.producer.stop()
+            logger.info("Event loop producer has STOPPED....")
+
+        if self._producer_loop in (None, loop):
+            await super().stop_producer()
+            self._producer_loop = None
+
+    async def get_producer(self) -> Producer:
+        """
+        Returns the producer of the running event loop and starts it if needed.
+
+        The engine producer is used in the event loop that started it (the engine
+        `loop`, the producer thread or the worker). Any other loop, like the loop
+        of an ASGI server, gets its own producer, so `await send(...)` from
+        an async view runs in the server loop without handing over to a thread.
+        """
+        loop = asyncio.get_running_loop()
+        producer = self._get_loop_producer(loop)
+        if producer is not None:
+            return producer
+
+        async with self._get_loop_lock(loop):
+            producer = self._get_loop_producer(loop)
+            if producer is not None:
+                return producer
+
+            if self._producer is None:
+                await self.start_producer()
+                return self._producer  # type: ignore
+
+            config = {**self.backend.model_dump(), **self.producer_config}
+            producer = self.producer_class(**config)
+            await producer.start()
+            watcher = loop.create_task(self._stop_loop_producer_on_shutdown())
+            with self._loop_locks_lock:
+                self._loop_producers[id(loop)] = LoopProducer(loop, producer, watcher)
+            logger.info("Event loop producer has STARTED....")
+            return producer
+
+    async def _stop_loop_producer_on_shutdown(self) -> None:
+        """
+        Wait until the loop shuts down, `asyncio.run` and the ASGI servers
+        cancel the pending tasks before closing it, then stop its producer.
+        """
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            loop_producer = self._pop_loop_producer(asyncio.get_running_loop())
+            if loop_producer is not None:
+                await loop_producer.producer.stop()
+                logger.info("Event loop producer has STOPPED....")
+            raise
+
+    def _get_loop_producer(self, loop: asyncio.AbstractEventLoop) -> Optional[Producer]:
+        if self._producer is not None and self._producer_loop in (None, loop):
+            return self._producer  # type: ignore
+
+        loop_producer = self._loop_producers.get(id(loop))
+        if loop_producer is not None and loop_producer.loop is loop:
+            return loop_producer.producer
+        return None
+
+    def _pop_loop_producer(
+        self, loop: asyncio.AbstractEventLoop
+    ) -> Optional["LoopProducer"]:
+        with self._loop_locks_lock:
+            loop_producer = self._loop_producers.get(id(loop))
+            if loop_producer is None or loop_producer.loop is not loop:
+                return None
+            self._loop_locks.pop(id(loop), None)
+            return self._loop_producers.pop(id(loop))
+
+    def _get_loop_lock(self, loop: asyncio.AbstractEventLoop) -> asyncio.Lock:
+        with self._loop_locks_lock:
+            self._forget_closed_loops()
+            loop_lock = self._loop_locks.get(id(loop))
+            if loop_lock is None or loop_lock[0] is not loop:
+                loop_lock = self._loop_locks[id(loop)] = (loop, asyncio.Lock())
+            return loop_lock[1]
+
+    def _forget_closed_loops(self) -> None:
+        # the loops that were closed without shutting down, for example
+        # with `loop.close()`, their producers can not be stopped anymore
+        for key, loop_producer in list(self._loop_producers.items()):
+            if loop_producer.loop.is_closed():
+                del self._loop_producers[key]
+        for key, (loop, _) in list(self._loop_locks.items()):
+            if loop.is_closed():
+                del self._loop_locks[key]
+
+    async def send(
+        self,
+        topic: str,
+        value: Any = None,
+        key: Any = None,
+        partition: Optional[int] = None,
+        timestamp_ms: Optional[int] = None,
+        headers: Optional[Headers] = None,
+        serializer: Optional[Serializer] = None,
+        serializer_kwargs: Optional[Dict] = None,
+    ) -> RecordMetadata:
+        """
+        Same as `kstreams` but the event is produced with the producer of
+        the running event loop, see `get_producer`.
+        """
+        producer = await self.get_producer()
+        value = await self._serialize(value, headers, serializer, serializer_kwargs)
+
+        fut = await producer.send(
+            topic,
+            value=value,
+            key=key,
+            partition=partition,
+            timestamp_ms=timestamp_ms,
+            headers=encode_headers(headers) if headers is not None else None,
+        )
+        metadata: RecordMetadata = await self._track_delivery(fut)
+        self.monitor.add_topic_partition_offset(
+            topic, metadata.partition, metadata.offset
+        )
+        return metadata
+
+    def prewarm_producer(self, topics: Sequence[str] = ()) -> None:
+        """
+        Start the producer and fetch the metadata of the topics, so the first
+        `sync_send` does not wait for the connection to the brokers.
+        Call it when the process starts, for example in `AppConfig.ready` or
+        in the `post_fork` hook of gunicorn.
+        """
+        self._run_sync(self._prewarm_producer(topics))
+        logger.info(f"Producer prewarmed for topics {list(topics)}")
+
+    async def _prewarm_producer(self, topics: Sequence[str]) -> None:
+        producer = await self.get_producer()
+        for topic in topics:
+            await producer.partitions_for(topic)
+
     async def clean_streams(self) -> None:
         await super().clean_streams()
         self._stream_task = None
+        self._tables = {}
+        self._retry_streams = {}
 
     async def _send_patch(
         self,
@@ -47,9 +453,6 @@ class StreamEngine(Base, metaclass=Singleton):
         timestamp_ms: Optional[int] = None,
         headers: Optional[Dict] = None,
     ) -> RecordMetadata:
-        if self._producer is None:
-            await self.start_producer()
-
         return await self.send(
             topic,
             value=value,
@@ -59,6 +462,125 @@ class StreamEngine(Base, metaclass=Singleton):
             headers=headers,
         )
 
+    async def _enqueue(
+        self,
+        topic: str,
+        *,
+        value: Any = None,
+        key: Optional[str] = None,
+        partition: Optional[int] = None,
+        timestamp_ms: Optional[int] = None,
+        headers: Optional[Dict] = None,
+    ) -> asyncio.Future:
+        """
+        Serialize the record and put it in the producer buffer without waiting
+        for the broker. The returned future resolves with the `RecordMetadata`
+        when the record is acked.
+        """
+        producer = await self.get_producer()
+        value = await self._serialize(value, headers)
+
+        fut = await producer.send(
+            topic,
+            value=value,
+            key=key,
+            partition=partition,
+            timestamp_ms=timestamp_ms,
+            headers=encode_headers(headers) if headers is not None else None,
+        )
+        delivery = self._track_delivery(fut)
+        delivery.add_done_callback(self._add_topic_partition_offset)
+        return delivery
+
+    async def _serialize(
+        self,
+        value: Any,
+        headers: Optional[Headers],
+        serializer: Optional[Serializer] = None,
+        serializer_kwargs: Optional[Dict] = None,
+    ) -> Any:
+        serializer = serializer or self.serializer
+
+        # serialize only when value and serializer are present
+        if value is None or serializer is None:
+            return value
+
+        start = time.perf_counter()
+        value = await serializer.serialize(
+            value, headers=headers, serializer_kwargs=serializer_kwargs
+        )
+        metrics.MET_SERIALIZATION.labels(operation="serialize").observe(
+            time.perf_counter() - start
+        )
+        return value
+
+    @staticmethod
+    def _track_delivery(fut: Any) -> asyncio.Future:
+        """
+        Count the record as in flight until the broker acks it
+        """
+        delivery = asyncio.ensure_future(fut)
+        metrics.MET_PRODUCER_IN_FLIGHT.inc()
+        delivery.add_done_callback(lambda _: metrics.MET_PRODUCER_IN_FLIGHT.dec())
+        return delivery
+
+    def _add_topic_partition_offset(self, delivery: asyncio.Future) -> None:
+        if not delivery.cancelled() and delivery.exception() is None:
+            metadata: RecordMetadata = delivery.result()
+            self.monitor.add_topic_partition_offset(
+                metadata.topic, metadata.partition, metadata.offset
+            )
+
+    async def _send_nowait(
+        self, result: concurrent.futures.Future, topic: str, **kwargs
+    ) -> None:
+        delivery = await self._enqueue(topic, **kwargs)
+
+        def copy_state(delivery: asyncio.Future) -> None:
+            if delivery.cancelled():
+                result.cancel()
+            elif delivery.exception() is not None:
+                result.set_exception(delivery.exception())  # type: ignore
+            else:
+                result.set_result(delivery.result())
+
+        delivery.add_done_callback(copy_state)
+
+    async def send_many(
+        self, records: Iterable[Sequence]
+    ) -> List[Union[RecordMetadata, Exception]]:
+        """
+        Produce many records at once. All the records are queued in the producer
+        first and then the deliveries are awaited together, so the cost is
+        the broker throughput instead of one round trip per record.
+
+        Attributes:
+            records Iterable[Record | Tuple]: records as
+                `(topic, value, key, headers, partition)`
+
+        Returns:
+            A `RecordMetadata` or the `Exception` that was raised,
+                for each record in the same order
+        """
+        deliveries: List[asyncio.Future] = []
+        for record in records:
+            topic, value, key, headers, partition, timestamp_ms = Record(*record)
+            try:
+                delivery = await self._enqueue(
+                    topic,
+                    value=value,
+                    key=key,
+                    partition=partition,
+                    timestamp_ms=timestamp_ms,
+                    headers=headers,
+                )
+            except Exception as exc:
+                delivery = asyncio.get_running_loop().create_future()
+                delivery.set_exception(exc)
+            deliveries.append(delivery)
+
+        return await asyncio.gather(*deliveries, return_exceptions=True)
+
     def sync_send(
         self,
         topic: str,
@@ -74,11 +596,8 @@ class StreamEngine(Base, metaclass=Singleton):
         sync context (for example inside a view). In an `async`
         context, normal `send` must be used.
         """
-        # we need to make sure that the event loop is free
-        # and not running to call the next iteration with sync_send
-        # otherwise, it will raise: RuntimeError: This event loop is already running
-        with self._lock:
-            return self.loop.run_until_complete(
+        with metrics.MET_SYNC_SEND.labels(method="sync_send").time():
+            return self._run_sync(
                 self._send_patch(
                     topic,
                     value=value,
@@ -89,10 +608,615 @@ class StreamEngine(Base, metaclass=Singleton):
                 )
             )
 
+    def sync_send_many(
+        self, records: Iterable[Sequence]
+    ) -> List[Union[RecordMetadata, Exception]]:
+        """
+        Sync version of `send_many`, to be called from a django sync context.
+
+        The records are collected in the calling thread before being produced,
+        so it is safe to build them from querysets.
+        """
+        records = list(records)
+        with metrics.MET_SYNC_SEND.labels(method="sync_send_many").time():
+            return self._run_sync(self.send_many(records))
+
+    def send_on_commit(
+        self,
+        topic: str,
+        *,
+        value: Any = None,
+        key: Optional[str] = None,
+        partition: Optional[int] = None,
+        timestamp_ms: Optional[int] = None,
+        headers: Optional[Dict] = None,
+        coalesce: bool = False,
+        using: Optional[str] = None,
+    ) -> None:
+        """
+        Produce the event after the current transaction is committed.
+
+        The events produced inside an `atomic` block are buffered and produced
+        with `sync_send_many` as one batch when the transaction commits, so the
+        database locks are not held while waiting for the kafka acks. If the
+        transaction (or the savepoint) is rolled back the events are dropped.
+        Outside an `atomic` block the event is produced right away.
+
+        The events of the savepoints (nested `atomic` blocks) that are released
+        are produced in the same batch, in the order they were sent.
+
+        If `coalesce` is `True` only the last coalesced event with the same topic
+        and key of the transaction is produced.
+
+        Delivery errors are logged, as the transaction is already committed.
+        """
+        self.send_many_on_commit(
+            [Record(topic, value, key, headers, partition, timestamp_ms)],
+            coalesce=coalesce,
+            using=using,
+        )
+
+    def send_many_on_commit(
+        self,
+        records: Iterable[Sequence],
+        *,
+        coalesce: bool = False,
+        using: Optional[str] = None,
+    ) -> None:
+        """
+        Like `send_on_commit` for many records, which have the same format
+        as in `send_many`. Outside an `atomic` block they are produced
+        right away as one batch.
+        """
+        connection = transaction.get_connection(using)
+        queued = [(Record(*record), coalesce) for record in records]
+
+        if not connection.in_atomic_block:
+            produce_coalesced(self, queued)
+            return None
+
+        if not _has_commit_hooks(connection):
+            # the records can not be buffered, each call is produced on commit
+            # as its own batch, and they are coalesced only within it
+            transaction.on_commit(
+                partial(produce_coalesced, self, queued), using=connection.alias
+            )
+            return None
+
+        buffer = self._get_on_commit_buffer(connection)
+        for record, _ in queued:
+            buffer.add(record, coalesce=coalesce)
+
+    def _get_on_commit_buffer(self, connection) -> OnCommitBuffer:
+        """
+        Get the buffer of the current transaction, creating a new one when
+        the previous transaction was committed or rolled back.
+        """
+        buffers: Dict = self._on_commit_buffers.__dict__.setdefault("buffers", {})
+        buffer = buffers.get(connection.alias)
+        if buffer is None or not buffer.is_active():
+            buffer = OnCommitBuffer(self, connection)
+            buffers[connection.alias] = buffer
+        return buffer
+
+    def sync_send_nowait(
+        self,
+        topic: str,
+        *,
+        value: Any = None,
+        key: Optional[str] = None,
+        partition: Optional[int] = None,
+        timestamp_ms: Optional[int] = None,
+        headers: Optional[Dict] = None,
+        on_success: Optional[Callable[[RecordMetadata], Any]] = None,
+        on_error: Optional[Callable[[BaseException], Any]] = None,
+    ) -> "concurrent.futures.Future[RecordMetadata]":
+        """
+        Like `sync_send` but it returns as soon as the record is queued
+        in the producer, without waiting for the broker ack.
+
+        The returned `concurrent.futures.Future` resolves with the `RecordMetadata`
+        when the record is delivered. `on_success` is called with the
+        `RecordMetadata` and `on_error` with the exception. The callbacks run in the
+        producer thread, so they must be cheap and must not block.
+
+        The producer thread is started if it is not running yet.
+        """
+        self._check_sync_context()
+        if self._producer_thread is None:
+            self.start_producer_thread()
+
+        result: concurrent.futures.Future = concurrent.futures.Future()
+        if on_success is not None or on_error is not None:
+
+            def delivery_callback(result: concurrent.futures.Future) -> None:
+                if result.cancelled():
+                    return None
+                exc = result.exception()
+                if exc is None:
+                    if on_success is not None:
+                        on_success(result.result())
+                elif on_error is not None:
+                    on_error(exc)
+
+            result.add_done_callback(delivery_callback)
+
+        # the callbacks are added before the hand-off, so they always run in
+        # the producer thread, even when the record is delivered right away
+        self._run_sync(
+            self._send_nowait(
+                result,
+                topic,
+                value=value,
+                key=key,
+                partition=partition,
+                timestamp_ms=timestamp_ms,
+                headers=headers,
+            )
+        )
+
+        return result
+
+    @staticmethod
+    def _check_sync_context() -> None:
+        """
+        Raise `RuntimeError` when called from a running event loop, where
+        waiting for the engine `loop` would block it, or deadlock when it is
+        the engine `loop` itself, like in the `sync_send_nowait` callbacks.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+        raise RuntimeError(
+            "Sync methods can not be called from a running event loop, "
+            "use `await stream_engine.send(...)` instead"
+        )
+
+    def _run_sync(self, coro: Coroutine[Any, Any, T]) -> T:
+        """
+        Run a coroutine on the engine `loop` from a sync context and wait for it.
+
+        When the producer thread is running the coroutine is handed over to it,
+        so many threads can have coroutines in flight at the same time.
+        Otherwise the calling thread runs the loop itself.
+        """
+        try:
+            self._check_sync_context()
+        except RuntimeError:
+            coro.close()
+            raise
+
+        waiting_since = time.perf_counter()
+        with self._lock:
+            metrics.MET_SYNC_LOCK_WAIT.observe(time.perf_counter() - waiting_since)
+            # we need to make sure that the event loop is free
+            # and not running to call the next iteration with sync_send
+            # otherwise, it will raise:
+            # RuntimeError: This event loop is already running
+            if self._producer_thread is None:
+                return self.loop.run_until_complete(coro)
+
+            # the coroutine is handed over while holding the lock, so the
+            # producer thread can not stop before it is scheduled, and
+            # `stop_producer_thread` waits for it before stopping the loop
+            future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+            self._handoffs.add(future)
+            future.add_done_callback(self._handoffs.discard)
+
+        return future.result()
+
+    def start_producer_thread(self) -> None:
+        """
+        Run the engine `loop` forever in a dedicated background thread and
+        start the producer on it. From then on `sync_send` hands the coroutines
+        over to this thread instead of taking the lock and running the loop,
+        so request threads no longer wait behind each other.
+
+        Call it once per process, for example in `AppConfig.ready` or in the
+        `post_fork` hook of gunicorn, and call `stop_producer_thread`
+        on shutdown.
+        """
+        with self._lock:
+            if self._producer_thread is not None:
+                return None
+
+            thread = Thread(
+                target=self.loop.run_forever,
+                name="django-streams-producer",
+                daemon=True,
+            )
+            thread.start()
+            self._producer_thread = thread
+
+            if self._producer is None:
+                asyncio.run_coroutine_threadsafe(
+                    self.start_producer(), self.loop
+                ).result()
+        logger.info("Producer thread has STARTED....")
+
+    def stop_producer_thread(self, timeout: Optional[float] = None) -> None:
+        """
+        Flush and stop the producer, then stop the background thread.
+        Records that were already handed over are delivered before the
+        producer stops. Next `sync_send` calls use the blocking mode.
+        """
+        with self._lock:
+            thread = self._producer_thread
+            if thread is None:
+                return None
+
+            # new calls fall back to the blocking mode and wait for the lock
+            self._producer_thread = None
+            concurrent.futures.wait(list(self._handoffs), timeout)
+            asyncio.run_coroutine_threadsafe(self.stop_producer(), self.loop).result(
+                timeout
+            )
+            self._producer = None
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            thread.join(timeout)
+        logger.info("Producer thread has STOPPED....")
+
+    def add_stream(
+        self, stream: Stream, error_policy: Optional[StreamErrorPolicy] = None
+    ) -> None:
+        # observe the handler duration and the records processed of all
+        # the streams, see `metrics.StreamMetricsMiddleware`
+        stream.middlewares = [
+            Middleware(metrics.StreamMetricsMiddleware),
+            *stream.middlewares,
+        ]
+        super().add_stream(stream, error_policy=error_policy)
+
+    def stream(
+        self,
+        topics: Union[List[str], str],
+        *,
+        name: Optional[str] = None,
+        initial_offsets: Optional[List[TopicPartitionOffset]] = None,
+        rebalance_listener: Optional[RebalanceListener] = None,
+        middlewares: Optional[List[Middleware]] = None,
+        subscribe_by_pattern: bool = False,
+        error_policy: StreamErrorPolicy = StreamErrorPolicy.STOP,
+        concurrency: int = 1,
+        retry_policy: Optional[RetryPolicy] = None,
+        tables: Sequence[Table] = (),
+        **kwargs,
+    ) -> Callable[[StreamFunc], Stream]:
+        """
+        Same as `kstreams` but with `concurrency` greater than `1` the stream
+        processes up to `concurrency` records at the same time, keeping the order
+        of the records with the same key. See `ConcurrentStream`.
+
+        With a `retry_policy` the records that fail are produced to the retry
+        topics, and then to the dead letter topic, and a second stream named
+        `<name>-retry` consumes the retry topics. See `RetryPolicy`.
+
+        The `tables` changed by the function are flushed before the offsets
+        are committed, so the stream commits like a `ConcurrentStream`.
+        See `StreamEngine.table`.
+
+        Raises:
+            ValueError: if `concurrency`, `retry_policy` or `tables` are used
+                with a function without typing, `retry_policy` with a pattern
+                or with `tables`
+        """
+        if retry_policy is not None and tables:
+            raise ValueError("Streams with retry_policy can not use tables")
+
+        if retry_policy is not None:
+            return self._stream_with_retries(
+                topics,
+                name=name,
+                initial_offsets=initial_offsets,
+                rebalance_listener=rebalance_listener,
+                middlewares=middlewares,
+                subscribe_by_pattern=subscribe_by_pattern,
+                error_policy=error_policy,
+                concurrency=concurrency,
+                retry_policy=retry_policy,
+                **kwargs,
+            )
+
+        if concurrency == 1 and not tables:
+            return super().stream(
+                topics,
+                name=name,
+                initial_offsets=initial_offsets,
+                rebalance_listener=rebalance_listener,
+                middlewares=middlewares,
+                subscribe_by_pattern=subscribe_by_pattern,
+                error_policy=error_policy,
+                **kwargs,
+            )
+
+        if tables:
+            # the rows changed by the revoked partitions are committed
+            # before another worker changes them
+            rebalance_listener = TablesRebalanceListener(
+                rebalance_listener or MetricsRebalanceListener()
+            )
+
+        def decorator(func: StreamFunc) -> Stream:
+            stream = ConcurrentStream(
+                topics,
+                func=func,
+                concurrency=concurrency,
+                tables=tables,
+                name=name,
+                initial_offsets=initial_offsets,
+                rebalance_listener=rebalance_listener,
+                middlewares=middlewares,
+                subscribe_by_pattern=subscribe_by_pattern,
+                config=kwargs,
+            )
+            udf_type = UdfHandler(next_call=func, send=self.send, stream=stream).type
+            if udf_type == UDFType.NO_TYPING:
+                option = "concurrency" if concurrency > 1 else "tables"
+                raise ValueError(
+                    f"Stream {func.__name__} can not use {option} without typing. "
+                    "Use `async def stream(cr: ConsumerRecord)` instead"
+                )
+
+            update_wrapper(stream, func)
+            self.add_stream(stream, error_policy=error_policy)
+            return stream
+
+        return decorator
+
+    def _stream_with_retries(
+        self,
+        topics: Union[List[str], str],
+        *,
+        name: Optional[str],
+        middlewares: Optional[List[Middleware]],
+        subscribe_by_pattern: bool,
+        error_policy: StreamErrorPolicy,
+        retry_policy: RetryPolicy,
+        **kwargs,
+    ) -> Callable[[StreamFunc], Stream]:
+        if subscribe_by_pattern:
+            raise ValueError("Streams subscribed by pattern can not use retry_policy")
+
+        middlewares = middlewares or []
+        stream_decorator = self.stream(
+            topics,
+            name=name,
+            middlewares=[
+                Middleware(RetryMiddleware, retry_policy=retry_policy),
+                *middlewares,
+            ],
+            error_policy=error_policy,
+            **kwargs,
+        )
+        # the retry stream has the consumer options, like the `group_id`,
+        # but it consumes the records one by one from the start
+        retry_kwargs = {
+            option: value
+            for option, value in kwargs.items()
+            if option not in ("initial_offsets", "rebalance_listener", "concurrency")
+        }
+
+        def decorator(func: StreamFunc) -> Stream:
+            udf_type = UdfHandler(next_call=func, send=self.send, stream=None).type
+            if udf_type == UDFType.NO_TYPING:
+                raise ValueError(
+                    f"Stream {func.__name__} can not use retry_policy without typing. "
+                    "Use `async def stream(cr: ConsumerRecord)` instead"
+                )
+
+            stream = stream_decorator(func)
+            self._retry_streams[stream.name] = super(StreamEngine, self).stream(
+                retry_policy.retry_topics(stream.topics),
+                name=f"{stream.name}-retry",
+                middlewares=[
+                    Middleware(RetryMiddleware, retry_policy=retry_policy),
+                    Middleware(RetryDelayMiddleware),
+                    *middlewares,
+                ],
+                error_policy=error_policy,
+                **retry_kwargs,
+            )(func)
+            return stream
+
+        return decorator
+
+    def table(self, name: str, *, model: Type[models.Model], **kwargs) -> Table:
+        """
+        Create a table, keyed state backed by `model` that is written in bulk.
+        The engine `db_executor` runs its queries, unless `executor` is set.
+        See `Table` for the options.
+
+        !!! Example
+            ```python
+            counters = stream_engine.table("counters", model=HelloWorld)
+
+            @stream_engine.stream("local--hello-world", tables=[counters])
+            async def count(cr: ConsumerRecord):
+                row = await counters.get(cr.key)
+                row.total += 1
+                await counters.save(row)
+            ```
+
+        Raises:
+            ValueError: if a table with the same name exists
+        """
+        if name in self._tables:
+            raise ValueError(f"Table {name} already exists")
+
+        kwargs.setdefault("executor", self.db_executor)
+        table = Table(name, model=model, **kwargs)
+        self._tables[name] = table
+        return table
+
+    def batch_stream(
+        self,
+        topics: Union[List[str], str],
+        *,
+        name: Optional[str] = None,
+        max_records: int = 500,
+        max_wait_ms: int = 1000,
+        error_policy: StreamErrorPolicy = StreamErrorPolicy.STOP,
+        executor: Optional[DatabaseExecutor] = None,
+        **kwargs,
+    ) -> Callable[[BatchFunc], BatchStream]:
+        """
+        Decorator to consume the records in batches with a `sync` function,
+        which is called once per batch with the list of `ConsumerRecord`.
+
+        Attributes:
+            topics List[str] | str: topics to consume from
+            name str | None: name of the stream
+            max_records int: maximum amount of records per batch
+            max_wait_ms int: milliseconds to wait for records to fill a batch
+            error_policy StreamErrorPolicy: what to do when the function raises
+            executor DatabaseExecutor | None: threads to call the function,
+                by default the engine `db_executor` or `sync_to_async`
+            kwargs: consumer configuration, `enable_auto_commit` is always `False`
+
+        !!! Example
+            ```python
+            @stream_engine.batch_stream("local--hello-world", group_id="my-group")
+            def consume_batch(records: List[ConsumerRecord]):
+                HelloWorld.objects.bulk_create(
+                    [HelloWorld(payload=cr.value) for cr in records]
+                )
+            ```
+        """
+
+        def decorator(func: BatchFunc) -> BatchStream:
+            stream = BatchStream(
+                topics,
+                batch_func=func,
+                name=name,
+                max_records=max_records,
+                max_wait_ms=max_wait_ms,
+                error_policy=error_policy,
+                executor=executor or self.db_executor,
+                config=kwargs,
+            )
+            update_wrapper(stream, func)
+            self.add_stream(stream)
+
+            # the middlewares are called per record, so only the error
+            # policy is applied to the batches
+            stream.func = ExceptionMiddleware(
+                next_call=metrics.StreamMetricsMiddleware(
+                    next_call=stream.func, send=self.send, stream=stream
+                ),
+                send=self.send,
+                stream=stream,
+                engine=self,
+                error_policy=error_policy,
+            )
+            return stream
+
+        return decorator
+
+    def select_streams(
+        self,
+        *,
+        names: Optional[Sequence[str]] = None,
+        exclude: Optional[Sequence[str]] = None,
+        topics: Optional[Sequence[str]] = None,
+    ) -> List[Stream]:
+        """
+        Keep only the selected streams in the engine and discard the rest,
+        so their consumers are never created. It must be called before the
+        engine starts. The retry stream of a stream, `<name>-retry`,
+        is selected or excluded with it, unless it is excluded by name.
+
+        Attributes:
+            names Sequence[str] | None: names of the streams to keep
+            exclude Sequence[str] | None: names of the streams to discard
+            topics Sequence[str] | None: keep only the streams that consume
+                from any of these topics
+
+        Returns:
+            The selected streams
+
+        Raises:
+            ValueError: if a stream name does not exist or
+                no stream consumes from a topic
+        """
+        available = [stream.name for stream in self._streams]
+        unknown = set(names or ()).union(exclude or ()).difference(available)
+        if unknown:
+            raise ValueError(
+                f"Streams {sorted(unknown)} do not exist. "
+                f"Available streams: {available}"
+            )
+
+        # excluding a stream excludes its retry stream as well
+        exclude = [
+            *(exclude or ()),
+            *(
+                self._retry_streams[name].name
+                for name in exclude or ()
+                if name in self._retry_streams
+            ),
+        ]
+
+        streams = self._streams
+        if names:
+            streams = [stream for stream in streams if stream.name in names]
+        if exclude:
+            streams = [stream for stream in streams if stream.name not in exclude]
+        if topics:
+            unknown = {
+                topic
+                for topic in topics
+                if not any(self._consumes_from(stream, topic) for stream in streams)
+            }
+            if unknown:
+                raise ValueError(f"No selected stream consumes from {sorted(unknown)}")
+
+            streams = [
+                stream
+                for stream in streams
+                if any(self._consumes_from(stream, topic) for topic in topics)
+            ]
+
+        # the retry stream of a selected stream is selected with it
+        retry_streams = [
+            self._retry_streams[stream.name]
+            for stream in streams
+            if stream.name in self._retry_streams
+            and self._retry_streams[stream.name].name not in exclude
+        ]
+        streams = [
+            stream
+            for stream in self._streams
+            if stream in streams or stream in retry_streams
+        ]
+
+        logger.info(f"Selected streams {[stream.name for stream in streams]}")
+        self._streams = streams
+        return streams
+
+    @staticmethod
+    def _consumes_from(stream: Stream, topic: str) -> bool:
+        if stream.subscribe_by_pattern:
+            return re.match(stream.topics[0], topic) is not None
+        return topic in stream.topics
+
     async def start_streams(self):
         """
         Redefine start_streams to make sure that the event_loop is not closed
         """
+        if self.loop_monitor is not None:
+            self.loop_monitor.start()
+        if self.lag_exporter is not None:
+            self.lag_exporter.start(self._streams)
+
+        membership.configure_consumers(
+            self._streams,
+            group_instance_id=self.group_instance_id,
+            partition_assignor=self.partition_assignor,
+        )
+
+        self._draining = False
+        self._drain_task = None
         self._stream_task = asyncio.gather(
             *[stream.start() for stream in self._streams]
         )
@@ -100,8 +1224,19 @@ class StreamEngine(Base, metaclass=Singleton):
         try:
             await self._stream_task
         except asyncio.CancelledError:
-            await self.stop()
-            logger.info("Gracefully Shutdown. Doei")
+            # the streams that are not drained in time are cancelled
+            if self._drain_task is None:
+                await self.stop()
+                logger.info("Gracefully Shutdown. Doei")
+
+        try:
+            if self._drain_task is not None:
+                await self._drain_task
+        finally:
+            if self.loop_monitor is not None:
+                await self.loop_monitor.stop()
+            if self.lag_exporter is not None:
+                await self.lag_exporter.stop()
 
     def sync_start(self):
         """
@@ -109,7 +1244,16 @@ class StreamEngine(Base, metaclass=Singleton):
         during testing, the async start is used.
         """
         logger.info("Worker starting...")
-        asyncio.run(self.start())
+
+        # a producer started in `AppConfig.ready` is bound to another event loop,
+        # the worker starts its own one
+        if self._producer_thread is not None:
+            self.stop_producer_thread()
+        elif self._producer is not None:
+            self._run_sync(self.stop_producer())
+            self._producer = None
+
+        loops.run(self.start(), loop_factory=self.loop_factory)
 
     def sync_stop(self, *args):
         """
@@ -117,7 +1261,55 @@ class StreamEngine(Base, metaclass=Singleton):
         When the flag ready_to_stop is set to `Ture` then the stop coroutine will
         stop the engine.
 
+        With `drain_timeout` the streams are drained instead of cancelled,
+        see `drain`. A second signal cancels them right away.
+
         NOTE: During testing, the async stop is used instead of `sync_stop`.
         """
         assert self._stream_task, "Engine is not running"
-        self._stream_task.cancel(msg="Stopping django-streams engine")
+        if self.drain_timeout is None or self._draining:
+            self._stream_task.cancel(msg="Stopping django-streams engine")
+            return None
+
+        self._draining = True
+        # the signal handler runs in the thread of the loop, which might be
+        # waiting in `select`, so the loop is woken up thread-safe
+        self._stream_task.get_loop().call_soon_threadsafe(self._start_drain)
+
+    def _start_drain(self) -> None:
+        self._drain_task = asyncio.ensure_future(self.drain(self.drain_timeout or 0))
+
+    async def drain(self, timeout: float) -> None:
+        """
+        Stop the engine gracefully: the streams stop fetching records and the
+        records in flight, and then the pending producer sends, can finish for
+        up to `timeout` seconds. The consumers commit the final offsets and
+        leave their groups when they stop, so the partitions are assigned to
+        the other workers right away instead of after the session timeout.
+
+        The streams that are not drained in time are cancelled, like in
+        `sync_stop` without `drain_timeout`, and then stopped.
+        """
+        logger.info(f"Draining the streams for up to {timeout} seconds...")
+        deadline = time.monotonic() + timeout
+        # `stop` waits for the records in flight before stopping the consumer
+        stopping = [asyncio.ensure_future(stream.stop()) for stream in self._streams]
+        pending: Set[asyncio.Future] = set()
+        if stopping:
+            _, pending = await asyncio.wait(stopping, timeout=timeout)
+
+        if pending:
+            logger.warning(f"Streams not drained in {timeout} seconds. Cancelling")
+            if self._stream_task is not None:
+                self._stream_task.cancel(msg="Stopping django-streams engine")
+            await asyncio.wait(pending)
+        elif self._producer is not None:
+            try:
+                await asyncio.wait_for(
+                    self._producer.flush(), max(deadline - time.monotonic(), 0)
+                )
+            except asyncio.TimeoutError:
+                logger.warning(f"Producer not flushed in {timeout} seconds")
+
+        await self.stop()
+        logger.info("Streams drained. Doei")
@@ -1,11 +1,17 @@
-from typing import Optional, Type
+from typing import Any, Dict, Optional, Type
 
 from kstreams.backends.kafka import Kafka
 from kstreams.clients import Consumer, Producer
 from kstreams.prometheus.monitor import PrometheusMonitor
 from kstreams.serializers import Deserializer, Serializer
 
+from . import conf
+from .db import DatabaseExecutor
 from .engine import StreamEngine
+from .lag import LagExporter
+from .loop_monitor import LoopMonitor
+from .loops import LoopFactory, get_loop_factory
+from .membership import get_instance_name
 
 
 def create_engine(
@@ -17,6 +23,14 @@ def create_engine(
     serializer: Optional[Serializer] = None,
     deserializer: Optional[Deserializer] = None,
     monitor: Optional[PrometheusMonitor] = None,
+    db_executor: Optional[DatabaseExecutor] = None,
+    producer_config: Optional[Dict[str, Any]] = None,
+    loop_monitor: Optional[LoopMonitor] = None,
+    loop_factory: Optional[LoopFactory] = None,
+    lag_exporter: Optional[LagExporter] = None,
+    drain_timeout: Optional[float] = None,
+    group_instance_id: Optional[str] = None,
+    partition_assignor: Optional[str] = None,
 ) -> StreamEngine:
     if monitor is None:
         monitor = PrometheusMonitor()
@@ -32,4 +46,51 @@ def create_engine(
         serializer=serializer,
         deserializer=deserializer,
         monitor=monitor,
+        db_executor=db_executor,
+        producer_config=producer_config,
+        loop_monitor=loop_monitor,
+        loop_factory=loop_factory,
+        lag_exporter=lag_exporter,
+        drain_timeout=drain_timeout,
+        group_instance_id=group_instance_id,
+        partition_assignor=partition_assignor,
+    )
+
+
+def create_engine_from_settings() -> StreamEngine:
+    """
+    Create the engine with the `DJANGO_STREAMS` setting:
+
+    ```python
+    # settings.py
+    DJANGO_STREAMS = {
+        "TITLE": "my-stream-engine",
+        "BACKEND": {"bootstrap_servers": ["localhost:9092"]},
+        "SERIALIZER": "streaming_app.serializers.JsonSerializer",
+        "PRODUCER_CONFIG": {"linger_ms": 5, "acks": "all"},
+        "PREWARM_PRODUCER": True,
+        "TOPICS": ["local--hello-world"],
+    }
+    ```
+
+    As the engine is a Singleton, if it was already created
+    the same instance is returned.
+    """
+    streams_settings = conf.get_settings()
+    backend = streams_settings["BACKEND"]
+    if isinstance(backend, dict):
+        backend = Kafka(**backend)
+
+    return create_engine(
+        title=streams_settings["TITLE"],
+        backend=backend,
+        serializer=conf.load(streams_settings["SERIALIZER"]),
+        deserializer=conf.load(streams_settings["DESERIALIZER"]),
+        monitor=conf.load(streams_settings["MONITOR"]),
+        producer_config=streams_settings["PRODUCER_CONFIG"],
+        loop_factory=get_loop_factory(streams_settings["EVENT_LOOP"]),
+        group_instance_id=(
+            get_instance_name() if streams_settings["STATIC_MEMBERSHIP"] else None
+        ),
+        partition_assignor=streams_settings["PARTITION_ASSIGNOR"],
     )
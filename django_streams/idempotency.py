@@ -0,0 +1,444 @@
+import abc
+import asyncio
+import datetime
+import functools
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    TypeVar,
+)
+
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from kstreams import ConsumerRecord, TopicPartition, middleware
+from kstreams.rebalance_listener import RebalanceListener
+
+from . import metrics
+from .db import DatabaseExecutor, bulk_upsert
+from .models import ProcessedRecord
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+KeyFunc = Callable[[ConsumerRecord], str]
+
+
+def offset_key(cr: ConsumerRecord) -> str:
+    """
+    Identify the records by their position, so the records consumed again
+    after a rebalance or a failed commit are duplicates
+    """
+    return f"{cr.topic}:{cr.partition}:{cr.offset}"
+
+
+def header_key(header: str) -> KeyFunc:
+    """
+    Identify the records by the value of `header`, so the same event produced
+    twice, like by a producer retry, is a duplicate as well. The records
+    without the header are identified by their position.
+    """
+
+    def key(cr: ConsumerRecord) -> str:
+        for name, value in cr.headers or ():
+            if name == header:
+                return value.decode()
+        return offset_key(cr)
+
+    key.__qualname__ = f"header_key({header!r})"
+    return key
+
+
+class LRUSet:
+    """
+    Set with at most `maxsize` keys, the least recently used are discarded
+    """
+
+    def __init__(self, maxsize: int = 10_000) -> None:
+        self.maxsize = maxsize
+        self._keys: "OrderedDict[str, None]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: str) -> bool:
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return True
+        return False
+
+    def add(self, key: str) -> None:
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        if len(self._keys) > self.maxsize:
+            self._keys.popitem(last=False)
+
+    def discard(self, key: str) -> None:
+        self._keys.pop(key, None)
+
+
+def _digest(key: str) -> str:
+    # fixed length keys that are valid for any cache backend and column
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class IdempotencyStore(abc.ABC):
+    """
+    Shared store of the keys of the processed records, so the duplicates are
+    detected by any worker. The methods are `sync` and called in a thread.
+
+    Attributes:
+        ttl int: seconds to remember the processed records
+    """
+
+    def __init__(self, *, ttl: int = 7 * 24 * 3600) -> None:
+        self.ttl = ttl
+
+    @abc.abstractmethod
+    def get_processed(self, keys: Sequence[str]) -> Set[str]:
+        """
+        Returns the keys that were processed
+        """
+
+    @abc.abstractmethod
+    def add(self, keys: Sequence[str]) -> None:
+        """
+        Remember the processed keys for `ttl` seconds
+        """
+
+    def expire(self) -> int:
+        """
+        Forget the keys older than `ttl`.
+
+        Returns:
+            The amount of keys removed
+        """
+        return 0
+
+
+class CacheStore(IdempotencyStore):
+    """
+    Store the keys in a django cache, like redis or memcached, which expires
+    them after `ttl`. Both the lookups and the writes are one round trip,
+    with `get_many` and `set_many`.
+
+    Attributes:
+        alias str: name of the cache in the `CACHES` setting
+        ttl int: seconds to remember the processed records
+    """
+
+    def __init__(self, alias: str = "default", *, ttl: int = 7 * 24 * 3600) -> None:
+        super().__init__(ttl=ttl)
+        self.alias = alias
+
+    def __str__(self) -> str:
+        return f"CacheStore(alias={self.alias}, ttl={self.ttl})"
+
+    def _cache_key(self, key: str) -> str:
+        return f"django-streams-processed:{_digest(key)}"
+
+    def get_processed(self, keys: Sequence[str]) -> Set[str]:
+        cache_keys = {self._cache_key(key): key for key in keys}
+        return {cache_keys[key] for key in caches[self.alias].get_many(cache_keys)}
+
+    def add(self, keys: Sequence[str]) -> None:
+        caches[self.alias].set_many(
+            {self._cache_key(key): 1 for key in keys}, timeout=self.ttl
+        )
+
+
+class DatabaseStore(IdempotencyStore):
+    """
+    Store the keys in the `ProcessedRecord` table. The lookups are one query
+    with `key IN (...)`, the writes one upsert and the expired rows are
+    deleted in batches by `expire`, see the `expire_processed_records` command.
+
+    Attributes:
+        using str: database alias
+        ttl int: seconds to remember the processed records
+        batch_size int: maximum amount of rows deleted per query when expiring
+    """
+
+    def __init__(
+        self,
+        using: str = DEFAULT_DB_ALIAS,
+        *,
+        ttl: int = 7 * 24 * 3600,
+        batch_size: int = 1000,
+    ) -> None:
+        super().__init__(ttl=ttl)
+        self.using = using
+        self.batch_size = batch_size
+
+    def __str__(self) -> str:
+        return f"DatabaseStore(using={self.using}, ttl={self.ttl})"
+
+    def get_processed(self, keys: Sequence[str]) -> Set[str]:
+        digests = {_digest(key): key for key in keys}
+        processed = ProcessedRecord.objects.using(self.using).filter(
+            key__in=digests, expires_at__gt=timezone.now()
+        )
+        return {digests[key] for key in processed.values_list("key", flat=True)}
+
+    def add(self, keys: Sequence[str]) -> None:
+        expires_at = timezone.now() + datetime.timedelta(seconds=self.ttl)
+        # the expired rows that were not deleted yet are renewed
+        bulk_upsert(
+            ProcessedRecord.objects.using(self.using),
+            [ProcessedRecord(key=_digest(key), expires_at=expires_at) for key in keys],
+            unique_field="key",
+            update_fields=["expires_at"],
+        )
+
+    def expire(self) -> int:
+        queryset = ProcessedRecord.objects.using(self.using)
+        expired = 0
+        while True:
+            keys = list(
+                queryset.filter(expires_at__lte=timezone.now()).values_list(
+                    "key", flat=True
+                )[: self.batch_size]
+            )
+            if not keys:
+                return expired
+            expired += queryset.filter(key__in=keys).delete()[0]
+
+
+class _Window(NamedTuple):
+    # offsets from `start` to `end`, not included, that were looked up
+    start: int
+    end: int
+    processed: Set[int]
+
+
+class _IdempotencyRebalanceListener(RebalanceListener):
+    """
+    Flush the processed keys and forget the lookups of the revoked partitions
+    before another consumer gets them, then call the listener of the stream
+    """
+
+    def __init__(
+        self, idempotency: "IdempotencyMiddleware", listener: Optional[Any]
+    ) -> None:
+        super().__init__()
+        self.idempotency = idempotency
+        self.listener = listener
+
+    async def on_partitions_revoked(self, revoked: Set[TopicPartition]) -> None:
+        await self.idempotency.on_partitions_revoked(revoked)
+        if self.listener is not None:
+            await self.listener.on_partitions_revoked(revoked)
+
+    async def on_partitions_assigned(self, assigned: Set[TopicPartition]) -> None:
+        if self.listener is not None:
+            await self.listener.on_partitions_assigned(assigned)
+
+
+class IdempotencyMiddleware(middleware.BaseMiddleware):
+    """
+    Skip the records that were already processed, like the ones consumed again
+    after a rebalance, so the side effects of the stream happen once.
+
+    The keys are looked up first in an in-process LRU and then in the `store`,
+    which is shared by all the workers. With `offset_key` the lookups in the
+    store are batched: the keys of the next `prefetch` offsets of the partition
+    are looked up at once, so the records that are not duplicates do not need
+    a round trip each. The lookups are forgotten when the partition is revoked.
+    The keys of the processed records are written to the store in bulk, every
+    `flush_size` records or `flush_interval` seconds, when the partitions
+    are revoked, so the next consumer sees them, and when the stream stops.
+
+    A record that fails is not remembered, so it is processed again.
+
+    !!! Example
+        ```python
+        from django_streams.idempotency import DatabaseStore, IdempotencyMiddleware
+
+        @stream_engine.stream(
+            "local--orders",
+            group_id="orders",
+            middlewares=[
+                Middleware(IdempotencyMiddleware, store=DatabaseStore()),
+            ],
+        )
+        async def consume(cr: ConsumerRecord):
+            ...
+        ```
+
+    Attributes:
+        store IdempotencyStore: shared store, a `CacheStore` or a `DatabaseStore`
+        key Callable[[ConsumerRecord], str]: identifies the records,
+            `offset_key` or `header_key("<header>")`
+        namespace str | None: prefix of the keys, default the `group_id`
+            of the stream or its name
+        maxsize int: maximum amount of keys in the LRU
+        prefetch int: amount of offsets looked up at once with `offset_key`
+        flush_size int: amount of processed keys written at once
+        flush_interval float: maximum seconds to wait before writing them
+        executor DatabaseExecutor | None: threads to call the store,
+            by default `sync_to_async`
+    """
+
+    def __init__(
+        self,
+        *,
+        store: IdempotencyStore,
+        key: KeyFunc = offset_key,
+        namespace: Optional[str] = None,
+        maxsize: int = 10_000,
+        prefetch: int = 100,
+        flush_size: int = 100,
+        flush_interval: float = 1.0,
+        executor: Optional[DatabaseExecutor] = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(**kwargs)
+        self.store = store
+        self.key = key
+        self.namespace = (
+            namespace or self.stream.config.get("group_id") or self.stream.name
+        )
+        self.prefetch = prefetch
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.executor = executor
+        self._processed = LRUSet(maxsize)
+        self._windows: Dict[TopicPartition, _Window] = {}
+        self._pending: List[str] = []
+        self._flush_timer: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        # created in the loop of the worker
+        self._lookup_lock: Optional[asyncio.Lock] = None
+        self._duplicates = metrics.MET_DUPLICATES.labels(stream=self.stream.name)
+        self._get_processed = self._to_async(store.get_processed, "get_processed")
+        self._add = self._to_async(store.add, "add")
+
+        self.stream.rebalance_listener = _IdempotencyRebalanceListener(
+            self, self.stream.rebalance_listener
+        )
+        stop = self._stop_and_flush(self.stream.stop)
+        self.stream.stop = stop  # type: ignore[method-assign]
+
+    def _stop_and_flush(
+        self, stop: Callable[[], Coroutine[Any, Any, None]]
+    ) -> Callable[[], Coroutine[Any, Any, None]]:
+        # the keys of the records processed since the last flush are
+        # written when the stream stops, once the records in flight finish
+        @functools.wraps(stop)
+        async def wrapper() -> None:
+            try:
+                await stop()
+            finally:
+                await self.flush()
+
+        return wrapper
+
+    async def __call__(self, cr: ConsumerRecord) -> Any:
+        key = f"{self.namespace}:{self.key(cr)}"
+        if key in self._processed:
+            duplicate = True
+        else:
+            # the keys of the records in flight are in the LRU as well,
+            # so the duplicates processed concurrently are skipped
+            self._processed.add(key)
+            try:
+                duplicate = await self.is_processed(cr, key)
+            except BaseException:
+                self._processed.discard(key)
+                raise
+
+        if duplicate:
+            self._duplicates.inc()
+            logger.info(
+                f"Record {cr.topic}[{cr.partition}]@{cr.offset} with key {key} "
+                "was already processed. Skipped"
+            )
+            return None
+
+        try:
+            result = await self.next_call(cr)  # type: ignore[func-returns-value]
+        except BaseException:
+            self._processed.discard(key)
+            raise
+
+        self._pending.append(key)
+        if len(self._pending) >= self.flush_size:
+            await self.flush()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(
+                self.flush_interval, self._schedule_flush
+            )
+        return result
+
+    def _schedule_flush(self) -> None:
+        self._flush_timer = None
+        self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def is_processed(self, cr: ConsumerRecord, key: str) -> bool:
+        if self.key is not offset_key:
+            return key in await self._get_processed([key])
+
+        if self._lookup_lock is None:
+            self._lookup_lock = asyncio.Lock()
+
+        topic_partition = TopicPartition(topic=cr.topic, partition=cr.partition)
+        # the records in flight wait for the same look ahead
+        async with self._lookup_lock:
+            window = self._windows.get(topic_partition)
+            if window is None or not window.start <= cr.offset < window.end:
+                window = await self._look_ahead(cr, topic_partition)
+        return cr.offset in window.processed
+
+    async def _look_ahead(
+        self, cr: ConsumerRecord, topic_partition: TopicPartition
+    ) -> _Window:
+        offsets = range(cr.offset, cr.offset + self.prefetch)
+        keys = {
+            f"{self.namespace}:{cr.topic}:{cr.partition}:{offset}": offset
+            for offset in offsets
+        }
+        processed = await self._get_processed(list(keys))
+        window = _Window(offsets.start, offsets.stop, {keys[key] for key in processed})
+        self._windows[topic_partition] = window
+        return window
+
+    async def flush(self) -> None:
+        """
+        Write the keys of the processed records to the store. If it fails they
+        are written in the next flush.
+        """
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+        keys, self._pending = self._pending, []
+        if not keys:
+            return None
+        try:
+            await self._add(keys)
+        except Exception:
+            logger.exception(f"Processed keys could not be added to {self.store}")
+            self._pending[:0] = keys
+
+    async def on_partitions_revoked(self, revoked: Iterable[TopicPartition]) -> None:
+        for topic_partition in revoked:
+            self._windows.pop(topic_partition, None)
+        await self.flush()
+
+    def _to_async(self, fn: Callable[..., T], name: str) -> Callable[..., Awaitable[T]]:
+        if self.executor is not None:
+            return functools.partial(self.executor.run, fn)
+        return metrics.sync_to_async(fn, name=f"{type(self.store).__name__}.{name}")
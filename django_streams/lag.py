@@ -0,0 +1,278 @@
+import asyncio
+import contextlib
+import logging
+import re
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from aiokafka.admin import AIOKafkaAdminClient
+from kstreams import Consumer, Stream, TopicPartition
+from kstreams.exceptions import BackendNotSet
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PartitionLag(NamedTuple):
+    consumer_group: Optional[str]
+    topic: str
+    partition: int
+    end_offset: int
+    # `None` when the group did not commit yet, then the lag
+    # is calculated from the beginning of the partition
+    committed: Optional[int]
+    lag: int
+
+
+def create_admin(stream: Stream) -> AIOKafkaAdminClient:
+    """
+    Admin client for the cluster of the stream
+    """
+    if stream.backend is None:
+        raise BackendNotSet("A backend has not been set for this stream")
+    return AIOKafkaAdminClient(**stream.backend.model_dump())
+
+
+async def get_committed(
+    admin: AIOKafkaAdminClient,
+    group_id: Optional[str],
+    partitions: List[TopicPartition],
+) -> Dict[TopicPartition, Optional[int]]:
+    """
+    Returns the offsets committed by the consumer group, with one request
+    for all the partitions. `None` when the group did not commit yet.
+    """
+    if group_id is None:
+        return {tp: None for tp in partitions}
+
+    offsets = await admin.list_consumer_group_offsets(group_id, partitions=partitions)
+    committed: Dict[TopicPartition, Optional[int]] = {}
+    for tp in partitions:
+        offset = offsets.get(tp)
+        # `-1` when the group has no offset for the partition
+        committed[tp] = None if offset is None or offset.offset < 0 else offset.offset
+    return committed
+
+
+async def get_lag(
+    consumer: Consumer,
+    admin: AIOKafkaAdminClient,
+    group_id: Optional[str],
+    partitions: Optional[Iterable[TopicPartition]] = None,
+) -> List[PartitionLag]:
+    """
+    Returns the lag of the partitions, by default the ones assigned to the
+    consumer, calculated as the end offset minus the committed offset of
+    the consumer group.
+
+    The end offsets are requested to the brokers, so the lag is correct
+    even for the partitions that the consumer did not fetch yet.
+    """
+    topic_partitions = sorted(
+        consumer.assignment() if partitions is None else partitions
+    )
+    if not topic_partitions:
+        return []
+
+    end_offsets = await consumer.end_offsets(topic_partitions)
+    committed = await get_committed(admin, group_id, topic_partitions)
+    uncommitted = [tp for tp, offset in committed.items() if offset is None]
+    beginning_offsets = (
+        await consumer.beginning_offsets(uncommitted) if uncommitted else {}
+    )
+
+    lags = []
+    for tp in topic_partitions:
+        offset = committed[tp]
+        start = beginning_offsets[tp] if offset is None else offset
+        lags.append(
+            PartitionLag(
+                consumer_group=group_id,
+                topic=tp.topic,
+                partition=tp.partition,
+                end_offset=end_offsets[tp],
+                committed=offset,
+                lag=max(end_offsets[tp] - start, 0),
+            )
+        )
+    return lags
+
+
+async def _get_partitions(
+    admin: AIOKafkaAdminClient, stream: Stream
+) -> List[TopicPartition]:
+    topics = stream.topics
+    if stream.subscribe_by_pattern:
+        pattern = re.compile(stream.topics[0])
+        topics = sorted(
+            topic for topic in await admin.list_topics() if pattern.match(topic)
+        )
+    if not topics:
+        return []
+
+    return [
+        TopicPartition(metadata["topic"], partition["partition"])
+        for metadata in await admin.describe_topics(topics)
+        for partition in metadata["partitions"]
+    ]
+
+
+async def get_stream_lag(stream: Stream) -> List[PartitionLag]:
+    """
+    Returns the lag of all the partitions of the stream topics for the
+    consumer group of the stream. It can be called from any process: the
+    consumer that fetches the offsets does not join the group, so the
+    workers are not rebalanced.
+    """
+    consumer = stream._create_consumer()
+    admin = create_admin(stream)
+    await consumer.start()
+    try:
+        await admin.start()
+        partitions = await _get_partitions(admin, stream)
+        return await get_lag(consumer, admin, stream.config.get("group_id"), partitions)
+    finally:
+        await admin.close()
+        await consumer.stop()
+
+
+def lag_report(lags: Iterable[PartitionLag]) -> Dict[str, Any]:
+    """
+    Group the lags per consumer group and topic, with the total lag on top,
+    so it can be used as an external metric for KEDA or the HPA:
+
+    ```python
+    {
+        "lag": 15,
+        "groups": [
+            {
+                "consumer_group": "my-group",
+                "topic": "local--hello-world",
+                "lag": 15,
+                "partitions": [
+                    {"partition": 0, "end_offset": 20, "committed": 5, "lag": 15},
+                ],
+            },
+        ],
+    }
+    ```
+    """
+    groups: Dict[Tuple[Optional[str], str], Dict[str, Any]] = {}
+    for lag in lags:
+        group = groups.setdefault(
+            (lag.consumer_group, lag.topic),
+            {
+                "consumer_group": lag.consumer_group,
+                "topic": lag.topic,
+                "lag": 0,
+                "partitions": [],
+            },
+        )
+        group["lag"] += lag.lag
+        group["partitions"].append(
+            {
+                "partition": lag.partition,
+                "end_offset": lag.end_offset,
+                "committed": lag.committed,
+                "lag": lag.lag,
+            }
+        )
+
+    return {
+        "lag": sum(group["lag"] for group in groups.values()),
+        "groups": list(groups.values()),
+    }
+
+
+class LagExporter:
+    """
+    Export the lag of the partitions assigned to the streams of the worker in
+    `django_streams_consumer_lag`, every `interval` seconds, to scale
+    the workers on it.
+
+    Unlike the lag of the `PrometheusMonitor`, which uses the highwater of the
+    last fetch, the end and the committed offsets are requested to the brokers,
+    one request of each per stream and interval.
+
+    Attributes:
+        interval float: seconds between lag exports
+    """
+
+    def __init__(self, interval: float = 15) -> None:
+        self.interval = interval
+        self._streams: List[Stream] = []
+        self._task: Optional[asyncio.Task] = None
+        self._exported: Set[Tuple[Optional[str], str, int]] = set()
+        self._admin: Optional[AIOKafkaAdminClient] = None
+
+    def __str__(self) -> str:
+        return f"LagExporter(interval={self.interval})"
+
+    def start(self, streams: List[Stream]) -> None:
+        """
+        Start exporting the lag of the streams in the running event loop
+        """
+        if self._task is not None:
+            return None
+
+        self._streams = streams
+        self._task = asyncio.ensure_future(self._run())
+        logger.info(f"{self} started")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return None
+
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+        self._remove(self._exported)
+        self._exported = set()
+        if self._admin is not None:
+            await self._admin.close()
+            self._admin = None
+
+    async def _get_admin(self, stream: Stream) -> AIOKafkaAdminClient:
+        # the streams of the engine share the backend, so one admin is enough
+        if self._admin is None:
+            admin = create_admin(stream)
+            await admin.start()
+            self._admin = admin
+        return self._admin
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.export()
+
+    async def export(self) -> None:
+        exported = set()
+        for stream in self._streams:
+            if stream.consumer is None or not stream.running:
+                continue
+            try:
+                admin = await self._get_admin(stream)
+                lags = await get_lag(
+                    stream.consumer, admin, stream.config.get("group_id")
+                )
+            except Exception as exc:
+                # the partitions can be revoked while fetching the offsets
+                logger.warning(f"Could not get the lag of {stream.name}: {exc}")
+                continue
+
+            for lag in lags:
+                labels = (lag.consumer_group, lag.topic, lag.partition)
+                metrics.MET_CONSUMER_LAG.labels(*labels).set(lag.lag)
+                exported.add(labels)
+
+        # the partitions assigned to another worker after a rebalance
+        self._remove(self._exported - exported)
+        self._exported = exported
+
+    def _remove(self, labels: Iterable[Tuple[Optional[str], str, int]]) -> None:
+        for consumer_group, topic, partition in labels:
+            # in multiprocess mode the removed values stay in the files
+            # of the process, so they are reset first
+            metrics.MET_CONSUMER_LAG.labels(consumer_group, topic, partition).set(0)
+            metrics.MET_CONSUMER_LAG.remove(consumer_group, topic, partition)
@@ -0,0 +1,111 @@
+import asyncio
+import contextlib
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LoopMonitor:
+    """
+    Measure the lag of the event loop and detect the calls that block it,
+    for example an ORM query or `requests` call inside an `async def` stream,
+    which stalls all the streams of the worker.
+
+    A coroutine sleeps `interval` seconds and observes how late it wakes up in
+    `django_streams_event_loop_lag_seconds`. A watchdog thread checks that the
+    coroutine keeps waking up: when the loop is blocked for more than `threshold`
+    seconds, the stack of the event loop thread, which is the code blocking it,
+    is logged once per blocking call and `django_streams_event_loop_blocked_total`
+    is increased.
+
+    The cost is one timer per `interval` in the loop and one thread waking up
+    every `threshold / 2` seconds, so it can stay enabled in production. The
+    asyncio debug mode is not enabled, but `slow_callback_duration` is set to
+    `threshold` in case it is enabled with `PYTHONASYNCIODEBUG`.
+
+    Attributes:
+        threshold float: seconds that the loop can be blocked before logging
+        interval float: seconds between lag measurements
+    """
+
+    def __init__(self, threshold: float = 0.1, interval: float = 0.25) -> None:
+        self.threshold = threshold
+        self.interval = interval
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._beat = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def __str__(self) -> str:
+        return f"LoopMonitor(threshold={self.threshold}, interval={self.interval})"
+
+    def start(self) -> None:
+        """
+        Start monitoring the running event loop
+        """
+        if self._task is not None:
+            return None
+
+        self._loop = asyncio.get_running_loop()
+        self._loop.slow_callback_duration = self.threshold
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+
+        self._task = asyncio.ensure_future(self._measure_lag())
+        self._watchdog = threading.Thread(
+            target=self._watch, name="django-streams-loop-watchdog", daemon=True
+        )
+        self._watchdog.start()
+        logger.info(f"{self} started")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return None
+
+        self._stopped.set()
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+    async def _measure_lag(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            metrics.MET_LOOP_LAG.observe(max(loop.time() - expected, 0))
+            self._beat = time.monotonic()
+
+    def _watch(self) -> None:
+        reported_beat = None
+        while not self._stopped.wait(self.threshold / 2):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked > self.threshold and beat != reported_beat:
+                reported_beat = beat
+                self._report(blocked)
+
+    def _report(self, blocked: float) -> None:
+        metrics.MET_LOOP_BLOCKED.inc()
+
+        task = asyncio.current_task(self._loop) if self._loop is not None else None
+        frame = sys._current_frames().get(self._loop_thread_id)  # type: ignore
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+        logger.warning(
+            f"Event loop blocked for more than {blocked:.3f} seconds by {task}. "
+            f"Use `await` or run the blocking code in a thread:\n{stack}"
+        )
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import sys
+from typing import Any, Callable, Coroutine, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+LoopFactory = Callable[[], asyncio.AbstractEventLoop]
+
+EVENT_LOOPS = ("asyncio", "uvloop")
+
+
+def get_loop_factory(name: str = "asyncio") -> LoopFactory:
+    """
+    Returns the function to create the event loops of the engine.
+
+    `uvloop` is used only if it is installed, otherwise a warning is logged
+    and the `asyncio` event loop is used.
+
+    Raises:
+        ValueError: if the event loop is unknown
+    """
+    if name not in EVENT_LOOPS:
+        raise ValueError(f"Unknown event loop {name}. Available loops: {EVENT_LOOPS}")
+
+    if name == "uvloop":
+        try:
+            import uvloop
+        except ImportError:
+            logger.warning("uvloop is not installed, using the asyncio event loop")
+        else:
+            return uvloop.new_event_loop
+
+    return asyncio.new_event_loop
+
+
+def run(
+    main: Coroutine[Any, Any, T], *, loop_factory: Optional[LoopFactory] = None
+) -> T:
+    """
+    Like `asyncio.run`, creating the event loop with `loop_factory`,
+    which `asyncio.run` supports only from python 3.12
+    """
+    if loop_factory is None:
+        return asyncio.run(main)
+
+    if sys.version_info >= (3, 11):
+        with asyncio.Runner(loop_factory=loop_factory) as runner:
+            return runner.run(main)
+
+    loop = loop_factory()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(main)
+    finally:
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        asyncio.set_event_loop(None)
+        loop.close()
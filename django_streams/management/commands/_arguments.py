@@ -0,0 +1,8 @@
+from typing import List
+
+
+def comma_separated(value: str) -> List[str]:
+    """
+    `type` of the arguments that accept many values, like `--streams a,b`
+    """
+    return [item.strip() for item in value.split(",") if item.strip()]
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from django_streams.idempotency import DatabaseStore
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the expired keys of the records processed with the "
+        "IdempotencyMiddleware and a DatabaseStore"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Maximum amount of rows deleted per query",
+        )
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        store = DatabaseStore(options["database"], batch_size=options["batch_size"])
+        expired = store.expire()
+        self.stdout.write(f"Expired {expired} processed records")
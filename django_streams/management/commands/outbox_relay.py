@@ -0,0 +1,87 @@
+import logging
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, close_old_connections
+
+from django_streams import outbox
+from django_streams.factories import create_engine_from_settings
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Produce the events stored in the outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Maximum amount of events claimed and produced at once",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait before polling again when the outbox is empty",
+        )
+        parser.add_argument(
+            "--mark-published",
+            action="store_true",
+            help="Mark the produced events as published instead of deleting them",
+        )
+        parser.add_argument(
+            "--claim-timeout",
+            type=float,
+            default=300,
+            help=(
+                "Seconds the claimed events are not claimed by other relays, "
+                "they are claimed again if they are not produced meanwhile"
+            ),
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Produce the pending events until there are none left and exit",
+        )
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        # StreamEngine is a Singlenton, so it will return the same instance
+        # as the user has defined in the custom django app.
+        engine = create_engine_from_settings()
+        stopped = threading.Event()
+
+        def stop(*args):
+            stopped.set()
+
+        # Listening signals from main Thread
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        logger.info(f"Starting outbox relay with engine {engine}")
+        engine.start_producer_thread()
+        try:
+            while not stopped.is_set():
+                close_old_connections()
+                produced = outbox.relay(
+                    engine,
+                    batch_size=options["batch_size"],
+                    delete=not options["mark_published"],
+                    claim_timeout=options["claim_timeout"],
+                    using=options["database"],
+                )
+                logger.debug(f"Outbox relay produced {produced} events")
+
+                if options["once"]:
+                    # the events that failed wait for their backoff
+                    if produced == 0 and not outbox.has_pending(options["database"]):
+                        break
+                elif produced < options["batch_size"]:
+                    # the outbox is drained, wait for new events
+                    stopped.wait(options["interval"])
+        finally:
+            engine.stop_producer_thread()
+            logger.info("Outbox relay stopped")
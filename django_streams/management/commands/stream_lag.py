@@ -0,0 +1,57 @@
+import json
+from typing import List
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_streams import loops
+from django_streams.engine import StreamEngine
+from django_streams.factories import create_engine_from_settings
+from django_streams.lag import PartitionLag, get_stream_lag, lag_report
+from django_streams.management.commands._arguments import comma_separated
+
+
+async def get_lags(engine: StreamEngine) -> List[PartitionLag]:
+    lags = []
+    for stream in engine._streams:
+        lags.extend(await get_stream_lag(stream))
+    return lags
+
+
+class Command(BaseCommand):
+    help = (
+        "Print the lag of the consumer groups of the streams in JSON, "
+        "for example for the KEDA or HPA external metrics"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--streams",
+            type=comma_separated,
+            action="extend",
+            help="Comma separated names of the streams. Default all",
+        )
+        parser.add_argument(
+            "--topics",
+            type=comma_separated,
+            action="extend",
+            help="Report only the streams that consume from these topics",
+        )
+        parser.add_argument(
+            "--indent",
+            type=int,
+            help="Indent the JSON with this amount of spaces",
+        )
+
+    def handle(self, *args, **options):
+        engine = create_engine_from_settings()
+
+        if options["streams"] or options["topics"]:
+            try:
+                engine.select_streams(
+                    names=options["streams"], topics=options["topics"]
+                )
+            except ValueError as exc:
+                raise CommandError(str(exc)) from exc
+
+        lags = loops.run(get_lags(engine), loop_factory=engine.loop_factory)
+        self.stdout.write(json.dumps(lag_report(lags), indent=options["indent"]))
@@ -1,25 +1,208 @@
 import logging
 import signal
+from typing import Optional
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
-from django_streams.factories import create_engine
+from django_streams import metrics
+from django_streams.engine import StreamEngine
+from django_streams.factories import create_engine_from_settings
+from django_streams.lag import LagExporter
+from django_streams.loop_monitor import LoopMonitor
+from django_streams.loops import EVENT_LOOPS, get_loop_factory
+from django_streams.management.commands._arguments import comma_separated
+from django_streams.membership import ASSIGNORS, get_instance_name
+from django_streams.supervisor import Supervisor
 
 logger = logging.getLogger(__name__)
 
 
+def run_worker(
+    engine: StreamEngine, *, handle_sigint: bool = True, process: Optional[int] = None
+) -> None:
+    if process is not None and engine.group_instance_id is not None:
+        # the processes of the same pod are different static members
+        engine.group_instance_id = f"{engine.group_instance_id}-{process}"
+
+    # Listening signals from main Thread
+    if handle_sigint:
+        signal.signal(signal.SIGINT, engine.sync_stop)
+    signal.signal(signal.SIGTERM, engine.sync_stop)
+
+    # start app
+    engine.sync_start()
+
+
 class Command(BaseCommand):
     help = "Start Worker to consume from kafka topics"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=1,
+            help=(
+                "Amount of worker processes. Each process runs its own engine "
+                "with all the streams"
+            ),
+        )
+        parser.add_argument(
+            "--streams",
+            type=comma_separated,
+            action="extend",
+            help="Comma separated names of the streams to start. Default all",
+        )
+        parser.add_argument(
+            "--exclude-streams",
+            type=comma_separated,
+            action="extend",
+            help="Comma separated names of the streams to not start",
+        )
+        parser.add_argument(
+            "--topics",
+            type=comma_separated,
+            action="extend",
+            help="Start only the streams that consume from these topics",
+        )
+        parser.add_argument(
+            "--shutdown-timeout",
+            type=float,
+            default=30.0,
+            help="Seconds to wait for the worker processes to stop gracefully",
+        )
+        parser.add_argument(
+            "--drain-timeout",
+            type=float,
+            metavar="SECONDS",
+            help=(
+                "On SIGTERM or SIGINT stop fetching and let the records in flight "
+                "and the pending sends finish for up to SECONDS before cancelling "
+                "the streams. Default cancel them right away"
+            ),
+        )
+        parser.add_argument(
+            "--metrics-port",
+            type=int,
+            help=(
+                "Expose the prometheus metrics on this port. With more than one "
+                "process PROMETHEUS_MULTIPROC_DIR must be set"
+            ),
+        )
+        parser.add_argument(
+            "--metrics-addr",
+            default="0.0.0.0",
+            help="Address to expose the prometheus metrics. Default 0.0.0.0",
+        )
+        parser.add_argument(
+            "--detect-blocking",
+            type=float,
+            nargs="?",
+            const=0.1,
+            metavar="SECONDS",
+            help=(
+                "Measure the event loop lag and log the stack of the code that "
+                "blocks the event loop for more than SECONDS. Default 0.1"
+            ),
+        )
+        parser.add_argument(
+            "--export-lag",
+            type=float,
+            nargs="?",
+            const=15.0,
+            metavar="SECONDS",
+            help=(
+                "Export the lag of the assigned partitions in "
+                "django_streams_consumer_lag every SECONDS. Default 15"
+            ),
+        )
+        parser.add_argument(
+            "--static-membership",
+            nargs="?",
+            const="",
+            metavar="INSTANCE",
+            help=(
+                "Join the consumer groups as static members INSTANCE-<stream index>, "
+                "so a restart gets the same partitions without a rebalance. "
+                "Default INSTANCE the POD_NAME environment variable or the hostname"
+            ),
+        )
+        parser.add_argument(
+            "--assignor",
+            choices=list(ASSIGNORS),
+            help="Partition assignment strategy. Default the PARTITION_ASSIGNOR setting",
+        )
+        parser.add_argument(
+            "--loop",
+            choices=EVENT_LOOPS,
+            help=(
+                "Event loop of the worker. uvloop must be installed, otherwise "
+                "asyncio is used. Default the EVENT_LOOP setting"
+            ),
+        )
+
     def handle(self, *args, **options):
         # StreamEngine is a Singlenton, so it will return the same instance
         # as the user has defined in the custom django app.
-        engine = create_engine()
-        logger.info(f"Starting worker with engine {engine}")
+        engine = create_engine_from_settings()
 
-        # Listening signals from main Thread
-        signal.signal(signal.SIGINT, engine.sync_stop)
-        signal.signal(signal.SIGTERM, engine.sync_stop)
+        if options["streams"] or options["exclude_streams"] or options["topics"]:
+            try:
+                engine.select_streams(
+                    names=options["streams"],
+                    exclude=options["exclude_streams"],
+                    topics=options["topics"],
+                )
+            except ValueError as exc:
+                raise CommandError(str(exc)) from exc
+
+        if options["metrics_port"] is not None:
+            if options["processes"] > 1 and not metrics.is_multiprocess():
+                raise CommandError(
+                    "PROMETHEUS_MULTIPROC_DIR must be set to expose the metrics "
+                    "of more than one process"
+                )
+            # with many processes the parent aggregates the metrics of the children
+            metrics.start_http_server(
+                options["metrics_port"], addr=options["metrics_addr"]
+            )
+            logger.info(f"Exposing metrics on port {options['metrics_port']}")
+
+        if options["drain_timeout"] is not None:
+            if (
+                options["processes"] > 1
+                and options["drain_timeout"] >= options["shutdown_timeout"]
+            ):
+                raise CommandError(
+                    "--drain-timeout must be lower than --shutdown-timeout, "
+                    "otherwise the processes are killed while draining"
+                )
+            engine.drain_timeout = options["drain_timeout"]
+
+        if options["static_membership"] is not None:
+            engine.group_instance_id = (
+                options["static_membership"] or get_instance_name()
+            )
+        if options["assignor"] is not None:
+            engine.partition_assignor = options["assignor"]
+
+        if options["loop"] is not None:
+            engine.loop_factory = get_loop_factory(options["loop"])
+
+        if options["detect_blocking"] is not None:
+            engine.loop_monitor = LoopMonitor(threshold=options["detect_blocking"])
+
+        if options["export_lag"] is not None:
+            engine.lag_exporter = LagExporter(interval=options["export_lag"])
+
+        logger.info(f"Starting worker with engine {engine}")
 
-        # start app
-        engine.sync_start()
+        if options["processes"] > 1:
+            supervisor = Supervisor(
+                # the children are stopped by the SIGTERM forwarded by the parent
+                lambda index: run_worker(engine, handle_sigint=False, process=index),
+                options["processes"],
+                shutdown_timeout=options["shutdown_timeout"],
+            )
+            supervisor.run()
+        else:
+            run_worker(engine)
@@ -0,0 +1,72 @@
+import os
+import socket
+from typing import Dict, Optional, Sequence, Tuple, Type
+
+from aiokafka.coordinator.assignors.abstract import AbstractPartitionAssignor
+from aiokafka.coordinator.assignors.range import RangePartitionAssignor
+from aiokafka.coordinator.assignors.roundrobin import RoundRobinPartitionAssignor
+from aiokafka.coordinator.assignors.sticky.sticky_assignor import (
+    StickyPartitionAssignor,
+)
+from kstreams import Stream
+
+# the group uses the first strategy supported by all its members, so the
+# default one is kept as a fallback to switch strategies with a rolling deploy
+ASSIGNORS: Dict[str, Tuple[Type[AbstractPartitionAssignor], ...]] = {
+    "roundrobin": (RoundRobinPartitionAssignor,),
+    "range": (RangePartitionAssignor, RoundRobinPartitionAssignor),
+    "sticky": (StickyPartitionAssignor, RoundRobinPartitionAssignor),
+}
+
+
+def get_assignors(name: str) -> Tuple[Type[AbstractPartitionAssignor], ...]:
+    """
+    Returns the `partition_assignment_strategy` of the consumers
+
+    Raises:
+        ValueError: if the assignor is unknown
+    """
+    try:
+        return ASSIGNORS[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown partition assignor {name}. Available assignors: {list(ASSIGNORS)}"
+        ) from None
+
+
+def get_instance_name() -> str:
+    """
+    Returns the name of the pod, from the `POD_NAME` environment variable, or
+    the hostname, which is the pod name in kubernetes unless `hostname` is set.
+    Use the downward API to set `POD_NAME` in a `StatefulSet`, so the name
+    survives the restarts.
+    """
+    return os.environ.get("POD_NAME") or socket.gethostname()
+
+
+def configure_consumers(
+    streams: Sequence[Stream],
+    *,
+    group_instance_id: Optional[str] = None,
+    partition_assignor: Optional[str] = None,
+) -> None:
+    """
+    Configure the consumers of the streams before they are created. The
+    options set in a stream, like `@stream_engine.stream(topic, group_instance_id=...)`,
+    are kept.
+
+    Attributes:
+        group_instance_id str | None: the consumer of the stream at `index`
+            becomes the static member `<group_instance_id>-<index>` of its
+            group. Streams without `group_id` are not members of a group.
+        partition_assignor str | None: `roundrobin`, `range` or `sticky`
+    """
+    for index, stream in enumerate(streams):
+        if partition_assignor is not None:
+            stream.config.setdefault(
+                "partition_assignment_strategy", get_assignors(partition_assignor)
+            )
+        if group_instance_id is not None and stream.config.get("group_id"):
+            stream.config.setdefault(
+                "group_instance_id", f"{group_instance_id}-{index}"
+            )
@@ -0,0 +1,203 @@
+import functools
+import os
+import time
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+from asgiref.sync import sync_to_async as asgiref_sync_to_async
+from django.http import HttpRequest, HttpResponse
+from kstreams import ConsumerRecord, middleware
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client import start_http_server as prometheus_http_server
+
+T = TypeVar("T")
+
+# seconds that `sync_send` waits for the engine loop when
+# the producer thread is not running
+MET_SYNC_LOCK_WAIT = Histogram(
+    "django_streams_sync_lock_wait_seconds",
+    "help seconds waiting for the lock of the engine loop",
+)
+MET_SYNC_SEND = Histogram(
+    "django_streams_sync_send_seconds",
+    "help seconds to produce with the sync methods, including the lock wait",
+    ["method"],
+)
+MET_SERIALIZATION = Histogram(
+    "django_streams_serialization_seconds",
+    "help seconds serializing and deserializing values",
+    ["operation"],
+)
+MET_PRODUCER_IN_FLIGHT = Gauge(
+    "django_streams_producer_in_flight_requests",
+    "help records sent to the producer that were not acked yet",
+    multiprocess_mode="livesum",
+)
+MET_HANDLER = Histogram(
+    "django_streams_handler_seconds",
+    "help seconds processing a record, or a batch, per stream",
+    ["stream"],
+)
+MET_RECORDS = Counter(
+    "django_streams_records_processed",
+    "help records processed per stream",
+    ["stream"],
+)
+MET_SYNC_TO_ASYNC_WAIT = Histogram(
+    "django_streams_sync_to_async_wait_seconds",
+    "help seconds that sync_to_async functions wait for their thread",
+    ["function"],
+)
+
+MET_LOOP_LAG = Histogram(
+    "django_streams_event_loop_lag_seconds",
+    "help seconds that the event loop is late to run a timer",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+MET_LOOP_BLOCKED = Counter(
+    "django_streams_event_loop_blocked",
+    "help times that the event loop was blocked for more than the threshold",
+)
+
+MET_RETRIED = Counter(
+    "django_streams_records_retried",
+    "help records produced to a retry or dead letter topic per stream",
+    ["stream", "topic"],
+)
+MET_DUPLICATES = Counter(
+    "django_streams_records_duplicated",
+    "help records skipped because they were already processed per stream",
+    ["stream"],
+)
+MET_TABLE_FLUSHED = Counter(
+    "django_streams_table_rows_flushed",
+    "help changed rows written to the database per table",
+    ["table"],
+)
+MET_CONSUMER_LAG = Gauge(
+    "django_streams_consumer_lag",
+    "help end offset minus committed offset of the partitions assigned to the worker",
+    ["consumer_group", "topic", "partition"],
+    multiprocess_mode="livesum",
+)
+
+
+class StreamMetricsMiddleware(middleware.BaseMiddleware):
+    """
+    Observe how long the stream takes to process a record, or a batch, and
+    count the records processed, so the rate per second is
+    `rate(django_streams_records_processed_total[1m])`.
+    It is added to all the streams by the engine.
+    """
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._duration = MET_HANDLER.labels(stream=self.stream.name)
+        self._records = MET_RECORDS.labels(stream=self.stream.name)
+
+    async def __call__(self, cr: ConsumerRecord) -> Any:
+        start = time.perf_counter()
+        try:
+            return await self.next_call(cr)
+        finally:
+            self._duration.observe(time.perf_counter() - start)
+            # batch streams are called with the list of records
+            self._records.inc(len(cr) if isinstance(cr, list) else 1)
+
+
+def sync_to_async(
+    fn: Callable[..., T], *, name: Optional[str] = None
+) -> Callable[..., Awaitable[T]]:
+    """
+    Like `asgiref.sync.sync_to_async`, observing the seconds that the function
+    waits for the thread that runs it in `django_streams_sync_to_async_wait_seconds`.
+    The functions are labelled with their qualified name, or `name`.
+    """
+    name = name or getattr(fn, "__qualname__", type(fn).__name__)
+    wait_time = MET_SYNC_TO_ASYNC_WAIT.labels(function=name)
+
+    def run(submitted_at: float, *args, **kwargs) -> T:
+        wait_time.observe(time.monotonic() - submitted_at)
+        return fn(*args, **kwargs)
+
+    run_async = asgiref_sync_to_async(run)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs) -> T:
+        return await run_async(time.monotonic(), *args, **kwargs)
+
+    return wrapper
+
+
+def is_multiprocess() -> bool:
+    return "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+
+def get_registry() -> CollectorRegistry:
+    """
+    Returns the registry to expose. In multiprocess mode, when the
+    `PROMETHEUS_MULTIPROC_DIR` environment variable is set, the metrics
+    of all the processes are aggregated.
+    """
+    if not is_multiprocess():
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def start_http_server(port: int, addr: str = "0.0.0.0") -> None:
+    """
+    Expose the metrics on `http://<addr>:<port>/` in a daemon thread.
+    """
+    prometheus_http_server(port, addr=addr, registry=get_registry())
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """
+    Django view to expose the metrics of the web workers, for example
+    with gunicorn in multiprocess mode:
+
+    !!! Example
+        ```python
+        # urls.py
+        from django_streams.metrics import metrics_view
+
+        urlpatterns = [path("metrics", metrics_view)]
+        ```
+    """
+    return HttpResponse(
+        generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST
+    )
+
+
+def child_exit(server: Any, worker: Any) -> None:
+    """
+    gunicorn `child_exit` hook to remove the live gauges of the dead workers
+    in multiprocess mode.
+
+    !!! Example
+        ```python
+        # gunicorn.conf.py
+        from django_streams.metrics import child_exit
+        ```
+    """
+    mark_process_dead(worker.pid)
+
+
+def mark_process_dead(pid: int) -> None:
+    """
+    Remove the live gauges of the process `pid`, which is dead,
+    in multiprocess mode.
+    """
+    if is_multiprocess():
+        multiprocess.mark_process_dead(pid)
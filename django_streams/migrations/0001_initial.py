@@ -0,0 +1,34 @@
+# Generated by Django 4.2.17 on 2026-10-18 02:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="OutboxEvent",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("topic", models.CharField(max_length=249)),
+                ("key", models.TextField(blank=True, null=True)),
+                ("value", models.BinaryField(blank=True, null=True)),
+                ("payload", models.JSONField(blank=True, null=True)),
+                ("headers", models.JSONField(blank=True, null=True)),
+                ("partition", models.IntegerField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("published_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["published_at", "id"],
+                        name="django_streams_outbox_pending",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,207 @@
+import base64
+import datetime
+import itertools
+import logging
+import uuid
+from decimal import Decimal
+from operator import attrgetter
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Type
+
+from django.db import models
+from django.utils.duration import duration_iso_string
+
+from .engine import Record, StreamEngine
+
+logger = logging.getLogger(__name__)
+
+Converter = Callable[[Any], Any]
+
+
+def _isoformat(value: Any) -> str:
+    return value.isoformat()
+
+
+def _b64encode(value: Any) -> str:
+    return base64.b64encode(bytes(value)).decode()
+
+
+# python types returned by the fields that are not json native
+CONVERTERS: Dict[type, Converter] = {
+    Decimal: str,
+    uuid.UUID: str,
+    datetime.datetime: _isoformat,
+    datetime.date: _isoformat,
+    datetime.time: _isoformat,
+    datetime.timedelta: duration_iso_string,
+    bytes: _b64encode,
+    memoryview: _b64encode,
+}
+
+FIELD_TYPES: List[Tuple[Type[models.Field], type]] = [
+    (models.DecimalField, Decimal),
+    (models.UUIDField, uuid.UUID),
+    # DateTimeField is a subclass of DateField
+    (models.DateTimeField, datetime.datetime),
+    (models.DateField, datetime.date),
+    (models.TimeField, datetime.time),
+    (models.DurationField, datetime.timedelta),
+    (models.BinaryField, bytes),
+]
+
+
+def get_converter(field: models.Field) -> Optional[Converter]:
+    """
+    Returns the function that converts the values of the field to a json native
+    type, or `None` if they are already json native.
+    Foreign keys use the converter of the field that they point to.
+    """
+    if field.is_relation:
+        field = field.target_field  # type: ignore
+
+    for field_class, python_type in FIELD_TYPES:
+        if isinstance(field, field_class):
+            return CONVERTERS[python_type]
+    return None
+
+
+class ModelEventSerializer:
+    """
+    Build the events of a model. The attribute getters and the converters to
+    json native types are compiled once, when the serializer is created, so
+    serializing an instance is a loop over the fields.
+
+    The value of the events is a `dict` with the `attname` of the fields as keys,
+    so foreign keys are serialized as `<field>_id` with the primary key of the
+    related object.
+
+    Attributes:
+        model Type[models.Model]: model of the instances
+        topic str: topic to produce the events to
+        fields Sequence[str] | None: names of the fields, by default
+            all the concrete fields
+        key_field str: name of the field used as key of the events
+        headers Dict | None: headers of all the events
+
+    !!! Example
+        ```python
+        order_events = ModelEventSerializer(
+            Order, "local--orders", fields=["id", "customer", "total", "created_at"]
+        )
+
+        # one instance
+        stream_engine.sync_send_many([order_events.to_record(order)])
+
+        # a snapshot of the table
+        order_events.send_queryset(stream_engine, Order.objects.all())
+        ```
+    """
+
+    def __init__(
+        self,
+        model: Type[models.Model],
+        topic: str,
+        *,
+        fields: Optional[Sequence[str]] = None,
+        key_field: str = "pk",
+        headers: Optional[Dict] = None,
+    ) -> None:
+        opts = model._meta
+        if fields is None:
+            model_fields = list(opts.concrete_fields)
+        else:
+            model_fields = [opts.get_field(name) for name in fields]  # type: ignore
+
+        self.model = model
+        self.topic = topic
+        self.headers = headers
+        self.attnames: List[str] = [field.attname for field in model_fields]
+        self._getters = [attrgetter(attname) for attname in self.attnames]
+        # only the fields that are not json native are converted
+        self._converters = [
+            (attname, convert)
+            for attname, convert in zip(self.attnames, map(get_converter, model_fields))
+            if convert is not None
+        ]
+
+        key = opts.pk if key_field == "pk" else opts.get_field(key_field)
+        self.key_attname: str = key.attname  # type: ignore
+        self._key_getter = attrgetter(self.key_attname)
+
+    def __str__(self) -> str:
+        return f"ModelEventSerializer(model={self.model.__name__}, topic={self.topic})"
+
+    def to_dict(self, instance: models.Model) -> Dict[str, Any]:
+        return self._build([getter(instance) for getter in self._getters])
+
+    def to_record(self, instance: models.Model) -> Record:
+        return Record(
+            self.topic,
+            value=self.to_dict(instance),
+            key=self._to_key(self._key_getter(instance)),
+            headers=self.headers,
+        )
+
+    def records(
+        self, queryset: models.QuerySet, chunk_size: int = 2000
+    ) -> Iterator[Record]:
+        """
+        Iterate the records of the queryset without creating the model instances.
+        The rows are fetched with `values_list(...).iterator(chunk_size)`, so the
+        memory used does not depend on the size of the table.
+        """
+        with_key = self.key_attname not in self.attnames
+        attnames = [*self.attnames, self.key_attname] if with_key else self.attnames
+        key_index = attnames.index(self.key_attname)
+
+        rows = queryset.values_list(*attnames).iterator(chunk_size=chunk_size)
+        for row in rows:
+            yield Record(
+                self.topic,
+                value=self._build(row),
+                key=self._to_key(row[key_index]),
+                headers=self.headers,
+            )
+
+    def send_queryset(
+        self,
+        engine: StreamEngine,
+        queryset: models.QuerySet,
+        *,
+        batch_size: int = 500,
+        chunk_size: int = 2000,
+    ) -> int:
+        """
+        Produce the events of all the rows of the queryset with `sync_send_many`,
+        `batch_size` records at a time.
+
+        Returns:
+            The amount of events produced
+        """
+        produced = 0
+        records = self.records(queryset, chunk_size=chunk_size)
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                return produced
+
+            results = engine.sync_send_many(batch)
+            for record, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    logger.error(
+                        f"{self.model.__name__} event with key {record.key} "
+                        f"could not be produced: {result!r}"
+                    )
+                else:
+                    produced += 1
+
+    def _build(self, values: Sequence[Any]) -> Dict[str, Any]:
+        data = dict(zip(self.attnames, values))
+        for attname, convert in self._converters:
+            value = data[attname]
+            if value is not None:
+                data[attname] = convert(value)
+        return data
+
+    @staticmethod
+    def _to_key(value: Any) -> Optional[str]:
+        return None if value is None else str(value)
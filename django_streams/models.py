@@ -0,0 +1,63 @@
+from django.db import models
+
+from .engine import Record
+
+
+class OutboxEvent(models.Model):
+    """
+    An event waiting to be produced by the `outbox_relay` command.
+
+    Rows are inserted in the same transaction as the business data,
+    so an event exists only if the transaction was committed.
+    `value` holds already encoded events (bytes) and `payload` any other
+    value, which is serialized with the engine serializer when produced.
+    The events that could not be produced have the `attempts` and the
+    `last_error`, and are retried after `available_at`.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    topic = models.CharField(max_length=249)
+    key = models.TextField(null=True, blank=True)
+    value = models.BinaryField(null=True, blank=True)
+    payload = models.JSONField(null=True, blank=True)
+    headers = models.JSONField(null=True, blank=True)
+    partition = models.IntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    published_at = models.DateTimeField(null=True, blank=True)
+    # claimed by a relay or waiting to be retried until then
+    available_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["published_at", "id"], name="django_streams_outbox_pending"
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"OutboxEvent {self.pk} to topic {self.topic}"
+
+    def as_record(self) -> Record:
+        value = self.payload if self.value is None else bytes(self.value)
+        return Record(
+            self.topic,
+            value=value,
+            key=self.key,
+            headers=self.headers,
+            partition=self.partition,
+        )
+
+
+class ProcessedRecord(models.Model):
+    """
+    Key of a record processed by a stream with the `IdempotencyMiddleware`
+    and a `DatabaseStore`. The keys are hashed, so they have a fixed length.
+    """
+
+    key = models.CharField(max_length=64, primary_key=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self) -> str:
+        return f"ProcessedRecord {self.key} until {self.expires_at}"
@@ -0,0 +1,162 @@
+import datetime
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from .engine import Record, StreamEngine
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+# maximum seconds to wait before producing again an event that failed
+MAX_BACKOFF = 300
+
+
+def _to_outbox_event(record: Sequence) -> OutboxEvent:
+    topic, value, key, headers, partition, _ = Record(*record)
+    is_bytes = isinstance(value, (bytes, bytearray, memoryview))
+
+    return OutboxEvent(
+        topic=topic,
+        key=key,
+        value=value if is_bytes else None,
+        payload=None if is_bytes else value,
+        headers=headers,
+        partition=partition,
+    )
+
+
+def send(
+    topic: str,
+    *,
+    value: Any = None,
+    key: Optional[str] = None,
+    headers: Optional[Dict] = None,
+    partition: Optional[int] = None,
+    using: str = DEFAULT_DB_ALIAS,
+) -> OutboxEvent:
+    """
+    Store an event in the outbox. It must be called inside the same transaction
+    that changes the business data, then the event is produced by the
+    `outbox_relay` command only if the transaction is committed.
+
+    `value` can be `bytes` or any json serializable value, which is serialized
+    with the engine serializer when the event is produced.
+    """
+    event = _to_outbox_event((topic, value, key, headers, partition))
+    event.save(using=using)
+    return event
+
+
+def send_many(
+    records: Iterable[Sequence], *, using: str = DEFAULT_DB_ALIAS
+) -> List[OutboxEvent]:
+    """
+    Store many events in the outbox with one `bulk_create`.
+    The records have the same format as in `StreamEngine.send_many`.
+    """
+    return OutboxEvent.objects.using(using).bulk_create(
+        [_to_outbox_event(record) for record in records]
+    )
+
+
+def _backoff(attempts: int) -> datetime.timedelta:
+    return datetime.timedelta(seconds=min(2**attempts, MAX_BACKOFF))
+
+
+def _available(using: str) -> QuerySet:
+    return OutboxEvent.objects.using(using).filter(
+        Q(available_at__isnull=True) | Q(available_at__lte=timezone.now()),
+        published_at__isnull=True,
+    )
+
+
+def has_pending(using: str = DEFAULT_DB_ALIAS) -> bool:
+    """
+    Returns whether there are events that can be produced now
+    """
+    return _available(using).exists()
+
+
+def claim(
+    *,
+    batch_size: int = 500,
+    claim_timeout: float = 300,
+    using: str = DEFAULT_DB_ALIAS,
+) -> List[OutboxEvent]:
+    """
+    Claim a batch of pending events for `claim_timeout` seconds.
+
+    The rows are selected with `SELECT ... FOR UPDATE SKIP LOCKED` and their
+    `available_at` is moved forward in the same short transaction, so many
+    relays can run at the same time without producing the same event twice,
+    and no row is locked while the events are produced. If the relay dies,
+    the events are claimed again after `claim_timeout`.
+    """
+    with transaction.atomic(using=using):
+        events = list(
+            _available(using)
+            .select_for_update(skip_locked=True)
+            .order_by("id")[:batch_size]
+        )
+        if events:
+            claimed_until = timezone.now() + datetime.timedelta(seconds=claim_timeout)
+            OutboxEvent.objects.using(using).filter(
+                pk__in=[event.pk for event in events]
+            ).update(available_at=claimed_until)
+    return events
+
+
+def relay(
+    engine: StreamEngine,
+    *,
+    batch_size: int = 500,
+    delete: bool = True,
+    claim_timeout: float = 300,
+    using: str = DEFAULT_DB_ALIAS,
+) -> int:
+    """
+    Produce one batch of pending events and remove them from the outbox.
+
+    The events are claimed with `claim`, produced with `sync_send_many` and
+    then deleted, or marked as published if `delete` is `False`, in bulk.
+    The events that could not be produced keep the error in `last_error` and
+    are retried after an exponential backoff of up to `MAX_BACKOFF` seconds,
+    so they do not block the events behind them.
+
+    Returns:
+        The amount of events produced
+    """
+    events = claim(batch_size=batch_size, claim_timeout=claim_timeout, using=using)
+    if not events:
+        return 0
+
+    results = engine.sync_send_many(event.as_record() for event in events)
+
+    published = []
+    failed = []
+    for event, result in zip(events, results):
+        if isinstance(result, Exception):
+            logger.error(f"{event} could not be produced: {result!r}")
+            event.attempts += 1
+            event.last_error = repr(result)
+            event.available_at = timezone.now() + _backoff(event.attempts)
+            failed.append(event)
+        else:
+            published.append(event.pk)
+
+    queryset = OutboxEvent.objects.using(using).filter(pk__in=published)
+    if delete:
+        queryset.delete()
+    else:
+        queryset.update(published_at=timezone.now(), available_at=None)
+
+    if failed:
+        OutboxEvent.objects.using(using).bulk_update(
+            failed, ["attempts", "last_error", "available_at"]
+        )
+
+    return len(published)
@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import time
+from typing import Any, List, Optional, Sequence, Tuple, Type
+
+from kstreams import ConsumerRecord, TopicPartition, middleware, types
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+ATTEMPT_HEADER = "retry-attempt"
+TOPIC_HEADER = "retry-topic"
+PARTITION_HEADER = "retry-partition"
+OFFSET_HEADER = "retry-offset"
+ERROR_HEADER = "retry-error"
+DUE_HEADER = "retry-due"
+
+# the errors are truncated to keep the headers small
+MAX_ERROR_LENGTH = 1000
+
+
+def format_delay(seconds: int) -> str:
+    for unit, size in (("h", 3600), ("m", 60)):
+        if seconds % size == 0:
+            return f"{seconds // size}{unit}"
+    return f"{seconds}s"
+
+
+class RetryPolicy:
+    """
+    Retry the records that fail without blocking their partition: the record
+    is produced to the retry topic of the next attempt, `<topic>.retry.<delay>`,
+    and the stream continues with the next record. A retry stream consumes
+    the retry topics and calls the function again when the delay is over.
+    After the last attempt, the record is produced to the dead letter topic.
+
+    The retried records keep their key and value, the original headers, and
+    carry the attempt, the original topic, partition and offset, and the
+    error in the `retry-*` headers.
+
+    !!! Example
+        ```python
+        from django_streams.retries import RetryPolicy
+
+        # retried after 1 minute, then after 10 minutes and then produced
+        # to `local--orders.dlq`
+        @stream_engine.stream(
+            "local--orders",
+            group_id="orders",
+            retry_policy=RetryPolicy(delays=(60, 600)),
+        )
+        async def consume(cr: ConsumerRecord):
+            ...
+        ```
+
+    Attributes:
+        delays Sequence[int]: seconds to wait before each attempt
+        dlq_topic str | None: dead letter topic, default `<topic>.dlq`
+        retry_on Tuple[Type[Exception]]: errors to retry, the other ones
+            are raised and the `error_policy` of the stream is applied
+    """
+
+    def __init__(
+        self,
+        delays: Sequence[int] = (60, 600),
+        *,
+        dlq_topic: Optional[str] = None,
+        retry_on: Tuple[Type[Exception], ...] = (Exception,),
+    ) -> None:
+        self.delays = list(delays)
+        self.dlq_topic = dlq_topic
+        self.retry_on = retry_on
+
+    def __str__(self) -> str:
+        return f"RetryPolicy(delays={self.delays}, dlq_topic={self.dlq_topic})"
+
+    def retry_topic(self, topic: str, attempt: int) -> str:
+        return f"{topic}.retry.{format_delay(self.delays[attempt - 1])}"
+
+    def retry_topics(self, topics: Sequence[str]) -> List[str]:
+        return [
+            self.retry_topic(topic, attempt)
+            for topic in topics
+            for attempt in range(1, len(self.delays) + 1)
+        ]
+
+    def get_dlq_topic(self, topic: str) -> str:
+        return self.dlq_topic or f"{topic}.dlq"
+
+    def next_topic(self, topic: str, attempt: int) -> Tuple[str, Optional[int]]:
+        """
+        Returns the topic to produce the record that failed in `attempt`,
+        `0` for the first one, and the delay of the next attempt.
+        `None` is returned as delay for the dead letter topic.
+        """
+        if attempt < len(self.delays):
+            return self.retry_topic(topic, attempt + 1), self.delays[attempt]
+        return self.get_dlq_topic(topic), None
+
+
+class _PassThroughSerializer:
+    # the consumed value is produced as it is to the retry topics
+    async def serialize(self, payload: Any, *args, **kwargs) -> Any:
+        return payload
+
+
+def _decode_headers(cr: ConsumerRecord) -> types.Headers:
+    # the records can have headers from any producer, which are not
+    # always utf-8, the invalid bytes are replaced instead of failing
+    return {
+        header: value.decode(errors="replace")
+        for header, value in cr.headers or ()
+        if value is not None
+    }
+
+
+def _get_int_header(cr: ConsumerRecord, name: str) -> Optional[int]:
+    value = _decode_headers(cr).get(name)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        logger.warning(f"Header {name} has an invalid value {value!r}, ignoring it")
+        return None
+
+
+class RetryMiddleware(middleware.BaseMiddleware):
+    """
+    Produce the records that fail to the next retry topic, or to the
+    dead letter topic, of the `retry_policy`. It is added by the engine
+    to the streams with a `retry_policy`.
+    """
+
+    def __init__(self, *, retry_policy: RetryPolicy, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.retry_policy = retry_policy
+        self._serializer = _PassThroughSerializer()
+
+    async def __call__(self, cr: ConsumerRecord) -> Any:
+        # the next middlewares can deserialize the value in place
+        key, value = cr.key, cr.value
+        try:
+            return await self.next_call(cr)
+        except self.retry_policy.retry_on as exc:
+            await self.retry(cr, key, value, exc)
+        return None
+
+    async def retry(
+        self, cr: ConsumerRecord, key: Any, value: Any, exc: Exception
+    ) -> None:
+        headers = _decode_headers(cr)
+        topic = headers.get(TOPIC_HEADER) or cr.topic
+        attempt = _get_int_header(cr, ATTEMPT_HEADER) or 0
+        next_topic, delay = self.retry_policy.next_topic(topic, attempt)
+
+        headers.update(
+            {
+                ATTEMPT_HEADER: str(attempt + 1),
+                TOPIC_HEADER: topic,
+                PARTITION_HEADER: headers.get(PARTITION_HEADER, str(cr.partition)),
+                OFFSET_HEADER: headers.get(OFFSET_HEADER, str(cr.offset)),
+                ERROR_HEADER: repr(exc)[:MAX_ERROR_LENGTH],
+            }
+        )
+        if delay is not None:
+            headers[DUE_HEADER] = str(int((time.time() + delay) * 1000))
+
+        try:
+            await self.send(
+                next_topic,
+                value=value,
+                key=key,
+                headers=headers,
+                serializer=self._serializer,
+            )
+        except Exception:
+            logger.exception(f"Record could not be produced to {next_topic}")
+            # the error policy of the stream is applied to the original error
+            raise exc
+
+        metrics.MET_RETRIED.labels(stream=self.stream.name, topic=next_topic).inc()
+        logger.warning(
+            f"Record {cr.topic}[{cr.partition}]@{cr.offset} failed in attempt "
+            f"{attempt} with {exc!r}. Produced to {next_topic}"
+        )
+
+
+class RetryDelayMiddleware(middleware.BaseMiddleware):
+    """
+    Wait until the records of the retry topics are due without blocking the
+    stream: the partition is paused and the record is consumed again when
+    the partition is resumed, after the delay. The records of a retry topic
+    have the same delay, so they are due in the order of the partition.
+    """
+
+    async def __call__(self, cr: ConsumerRecord) -> Any:
+        due = _get_int_header(cr, DUE_HEADER)
+        delay = due / 1000 - time.time() if due is not None else 0
+        consumer = self.stream.consumer
+        if delay <= 0 or consumer is None:
+            return await self.next_call(cr)
+
+        topic_partition = TopicPartition(topic=cr.topic, partition=cr.partition)
+        consumer.pause(topic_partition)
+        consumer.seek(topic_partition, cr.offset)
+        asyncio.get_running_loop().call_later(delay, self._resume, topic_partition)
+        return None
+
+    def _resume(self, topic_partition: TopicPartition) -> None:
+        consumer = self.stream.consumer
+        # the partition could be assigned to another consumer meanwhile
+        if consumer is not None and topic_partition in consumer.assignment():
+            consumer.resume(topic_partition)
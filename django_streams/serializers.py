@@ -0,0 +1,162 @@
+import dataclasses
+import datetime
+import functools
+import json
+import time
+import uuid
+from decimal import Decimal
+from typing import Any, Callable, Dict, Optional, Type, TypeVar
+
+from django.utils.duration import duration_iso_string
+from django.utils.functional import Promise
+from kstreams import ConsumerRecord, middleware, types
+
+from . import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None  # type: ignore
+
+T = TypeVar("T")
+
+
+def default(obj: Any) -> Any:
+    """
+    Convert the django types that are not supported by the json libraries.
+    """
+    if isinstance(obj, Promise):
+        # lazy strings, like `gettext_lazy`
+        return str(obj)
+    if isinstance(obj, (Decimal, uuid.UUID)):
+        return str(obj)
+    if isinstance(obj, datetime.timedelta):
+        return duration_iso_string(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, default=default, separators=(",", ":")).encode()
+
+
+_dumps: Callable[[Any], bytes]
+_loads: Callable[[bytes], Any]
+
+if orjson is not None:
+    BACKEND = "orjson"
+    _dumps = functools.partial(orjson.dumps, default=default)
+    _loads = orjson.loads
+elif msgspec is not None:
+    BACKEND = "msgspec"
+    _dumps = msgspec.json.Encoder(enc_hook=default).encode
+    _loads = msgspec.json.Decoder().decode
+else:
+    BACKEND = "json"
+    _dumps = _json_dumps
+    _loads = json.loads
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Encode to json bytes with `orjson` or `msgspec` when one is installed,
+    otherwise with the standard library.
+    UUID, Decimal, dates, times, durations and lazy strings are supported.
+    """
+    return _dumps(obj)
+
+
+def loads(data: bytes, value_type: Optional[Type[T]] = None) -> Any:
+    """
+    Decode json bytes without decoding them to `str` first.
+
+    If `value_type` is given, the result is an instance of it: `msgspec.Struct`
+    and dataclasses are decoded and validated with `msgspec` when it is
+    installed, pydantic models are validated with `model_validate` and any
+    other class is called with the decoded object as keyword arguments.
+    Types that are not classes, like `List[Order]`, are decoded and validated
+    with `msgspec` when it is installed, otherwise they are not validated.
+    """
+    if value_type is None:
+        return _loads(data)
+
+    if not isinstance(value_type, type):
+        if msgspec is not None:
+            return msgspec.json.decode(data, type=value_type)
+        return _loads(data)
+
+    if msgspec is not None and (
+        dataclasses.is_dataclass(value_type) or issubclass(value_type, msgspec.Struct)
+    ):
+        return msgspec.json.decode(data, type=value_type)
+
+    value = _loads(data)
+    if hasattr(value_type, "model_validate"):
+        return value_type.model_validate(value)  # type: ignore
+    return value_type(**value)
+
+
+class JsonSerializer:
+    """
+    Serializer to produce json events. `bytes` payloads are produced as they are.
+
+    !!! Example
+        ```python
+        from django_streams import create_engine
+        from django_streams.serializers import JsonSerializer
+
+        stream_engine = create_engine(serializer=JsonSerializer())
+        ```
+    """
+
+    async def serialize(
+        self,
+        payload: Any,
+        headers: Optional[types.Headers] = None,
+        serializer_kwargs: Optional[Dict] = None,
+    ) -> bytes:
+        if isinstance(payload, bytes):
+            return payload
+        return dumps(payload)
+
+
+class JsonDeserializerMiddleware(middleware.BaseMiddleware):
+    """
+    Middleware to decode the json value of the consumed records,
+    optionally into `value_type`. See `loads`.
+
+    !!! Example
+        ```python
+        from kstreams import middleware
+        from django_streams.serializers import JsonDeserializerMiddleware
+
+
+        @stream_engine.stream(
+            "local--hello-world",
+            middlewares=[
+                middleware.Middleware(JsonDeserializerMiddleware, value_type=Order)
+            ],
+        )
+        async def consume(cr: ConsumerRecord):
+            order: Order = cr.value
+        ```
+    """
+
+    def __init__(self, *, value_type: Optional[Type] = None, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.value_type = value_type
+
+    async def __call__(self, cr: ConsumerRecord) -> Any:
+        if cr.value is not None:
+            start = time.perf_counter()
+            cr.value = loads(cr.value, self.value_type)
+            metrics.MET_SERIALIZATION.labels(operation="deserialize").observe(
+                time.perf_counter() - start
+            )
+        return await self.next_call(cr)
@@ -0,0 +1,368 @@
+import asyncio
+import logging
+import sys
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Union,
+)
+
+from aiokafka import errors
+from kstreams import ConsumerRecord, Stream, TopicPartition
+from kstreams.middleware import ExceptionMiddleware, Middleware
+
+from . import metrics
+from .db import DatabaseExecutor
+from .tables import Table
+
+logger = logging.getLogger(__name__)
+
+BatchFunc = Callable[[List[ConsumerRecord]], Any]
+
+
+class BatchStream(Stream):
+    """
+    Stream that consumes the records in batches and calls a `sync` function
+    once per batch, in a thread, so it can use the django ORM bulk operations
+    like `bulk_create` or `bulk_update`. The function runs in the `executor`
+    if it is set, otherwise with `sync_to_async`.
+
+    The batches are fetched with `getmany`: a batch has at most `max_records`
+    records and waits at most `max_wait_ms` milliseconds for them. The offsets
+    are committed only after the function returns, so the auto commit is
+    disabled. If the function raises the batch is not committed and the
+    `error_policy` of the stream is applied, like in any other stream.
+
+    Attributes:
+        batch_func Callable[[List[ConsumerRecord]], Any]: sync function
+            called with the list of records
+        max_records int: maximum amount of records per batch
+        max_wait_ms int: milliseconds to wait for records to fill a batch
+        executor DatabaseExecutor | None: threads to call the function
+    """
+
+    def __init__(
+        self,
+        topics: Union[List[str], str],
+        *,
+        batch_func: BatchFunc,
+        max_records: int = 500,
+        max_wait_ms: int = 1000,
+        executor: Optional[DatabaseExecutor] = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(topics, func=self.process, **kwargs)
+        self.config["enable_auto_commit"] = False
+        self.batch_func = batch_func
+        self.max_records = max_records
+        self.max_wait_ms = max_wait_ms
+        self.executor = executor
+        self._batch_func_async = metrics.sync_to_async(batch_func)
+
+    async def process(self, records) -> bool:
+        if self.executor is not None:
+            await self.executor.run(self.batch_func, records)
+        else:
+            await self._batch_func_async(records)
+        return True
+
+    async def start(self) -> None:
+        if self.running:
+            return None
+
+        self.subscribe()
+
+        if self.consumer is not None:
+            await self.consumer.start()
+            self.running = True
+            await self.func_wrapper_with_batches()
+
+    async def func_wrapper_with_batches(self) -> None:
+        while self.running:
+            try:
+                batches = await self.getmany(
+                    timeout_ms=self.max_wait_ms, max_records=self.max_records
+                )
+            except errors.ConsumerStoppedError:
+                logger.info(
+                    f"Stream {self} stopped after Coordinator was closed {self.topics}"
+                )
+                return None
+
+            offsets: Dict[TopicPartition, int] = {}
+            records: List[ConsumerRecord] = []
+            for topic_partition, partition_records in batches.items():
+                partition_records = [cr for cr in partition_records if cr is not None]
+                if partition_records:
+                    records.extend(partition_records)
+                    offsets[topic_partition] = partition_records[-1].offset + 1
+
+            if not records:
+                continue
+
+            async with self.is_processing:
+                # `None` is returned when the batch failed and
+                # the error policy did not re-raise the exception
+                if await self.func(records):
+                    await self.commit(offsets)
+
+
+class OffsetTracker:
+    """
+    Keep track of the records in flight per partition, so only the offsets of
+    the records that were processed, and all the records before them, are
+    committed.
+    """
+
+    def __init__(self) -> None:
+        self._in_flight: Dict[TopicPartition, Set[int]] = {}
+        self._next: Dict[TopicPartition, int] = {}
+        self._committed: Dict[TopicPartition, int] = {}
+
+    def add(self, topic_partition: TopicPartition, offset: int) -> None:
+        self._in_flight.setdefault(topic_partition, set()).add(offset)
+        self._next[topic_partition] = offset + 1
+
+    def done(self, topic_partition: TopicPartition, offset: int) -> None:
+        self._in_flight[topic_partition].discard(offset)
+
+    def committable(
+        self, assignment: Sequence[TopicPartition]
+    ) -> Dict[TopicPartition, int]:
+        """
+        Returns the offsets to commit of the assigned partitions that changed
+        since the last commit: the lowest offset in flight or, if all the
+        records were processed, the offset after the last one.
+        """
+        offsets = {}
+        for topic_partition, next_offset in self._next.items():
+            in_flight = self._in_flight[topic_partition]
+            offset = min(in_flight) if in_flight else next_offset
+            if (
+                topic_partition in assignment
+                and self._committed.get(topic_partition) != offset
+            ):
+                offsets[topic_partition] = offset
+        return offsets
+
+    def committed(self, offsets: Dict[TopicPartition, int]) -> None:
+        self._committed.update(offsets)
+
+
+class ConcurrentExceptionMiddleware(ExceptionMiddleware):
+    """
+    Log the exception and re-raise it. The error policy is applied by the
+    `ConcurrentStream` when the records in flight are finished.
+    """
+
+    async def __call__(self, cr: ConsumerRecord) -> Any:
+        try:
+            return await self.next_call(cr)
+        except Exception as exc:
+            logger.exception(
+                "Unhandled error occurred while listening to the stream. "
+                f"Stream consuming from topics {self.stream.topics} CRASHED!!! \n\n "
+            )
+            if sys.version_info >= (3, 11):
+                exc.add_note(f"Handler: {self.stream.func}")
+                exc.add_note(f"Topics: {self.stream.topics}")
+            raise
+
+
+class ConcurrentStream(Stream):
+    """
+    Stream that processes up to `concurrency` records at the same time.
+
+    Records with the same key are processed one after the other, in the order
+    of the partition, and records without key are processed as soon as there
+    is room. The auto commit is disabled: the offsets are committed every
+    `auto_commit_interval_ms` and when the stream stops, only up to the lowest
+    offset that was not processed yet, so no record is skipped after a crash
+    or a rebalance.
+
+    While records are in flight `is_processing` is locked, so stopping the
+    stream waits for them. If a record fails, no new records are fetched and
+    the `error_policy` is applied when the records in flight are finished.
+
+    The `tables` are flushed before the offsets are committed, and if they can
+    not be flushed the offsets are not committed.
+
+    Attributes:
+        concurrency int: maximum amount of records processed at the same time
+        tables Sequence[Table]: tables changed by the stream
+    """
+
+    def __init__(
+        self,
+        topics: Union[List[str], str],
+        *,
+        concurrency: int,
+        tables: Sequence[Table] = (),
+        **kwargs,
+    ) -> None:
+        super().__init__(topics, **kwargs)
+        self.concurrency = concurrency
+        self.tables = tables
+        self.commit_interval = self.config.get("auto_commit_interval_ms", 5000) / 1000
+        self.config["enable_auto_commit"] = False
+        self._stopping: Optional[asyncio.Future] = None
+
+    def get_middlewares(self, engine) -> Sequence[Middleware]:
+        return [
+            Middleware(
+                ConcurrentExceptionMiddleware,
+                engine=engine,
+                error_policy=self.error_policy,
+            ),
+            *self.middlewares,
+        ]
+
+    async def start(self) -> None:
+        if self.running:
+            return None
+
+        self.subscribe()
+
+        if self.consumer is not None:
+            await self.consumer.start()
+            self.running = True
+            await self.func_wrapper_with_concurrency()
+
+    async def stop(self) -> None:
+        if self.running and not self.is_processing.locked():
+            # the records in flight commit when they finish, when there are
+            # none commit the ones processed since the last commit
+            await self.commit_processed()
+
+        # wake up the dispatcher, which might be waiting for a record
+        if self._stopping is not None and not self._stopping.done():
+            self._stopping.set_result(None)
+        await super().stop()
+
+    async def func_wrapper_with_concurrency(self) -> None:
+        self._offsets = OffsetTracker()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._lanes: Dict[Hashable, asyncio.Task] = {}
+        self._in_flight = 0
+        self._failed: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._stopping = asyncio.get_running_loop().create_future()
+        committed_at = time.monotonic()
+        fetch: Optional[asyncio.Task] = None
+
+        try:
+            while self.running and not self._failed.done():
+                if fetch is None:
+                    fetch = asyncio.ensure_future(self.getone())
+
+                timeout = committed_at + self.commit_interval - time.monotonic()
+                await asyncio.wait(
+                    [fetch, self._failed, self._stopping],
+                    timeout=max(timeout, 0),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+
+                if time.monotonic() - committed_at >= self.commit_interval:
+                    await self.commit_processed()
+                    committed_at = time.monotonic()
+
+                if fetch.done() and not self._failed.done():
+                    cr, fetch = fetch.result(), None
+                    await self.dispatch(cr)
+        except errors.ConsumerStoppedError:
+            logger.info(
+                f"Stream {self} stopped after Coordinator was closed {self.topics}"
+            )
+            return None
+        finally:
+            if fetch is not None:
+                fetch.cancel()
+
+        if not self._failed.done():
+            # the stream was stopped
+            return None
+
+        # a record failed: wait for the records in flight
+        # and apply the error policy
+        async with self.is_processing:
+            await self.commit_processed()
+            await self.func.cleanup_policy(self._failed.result())  # type: ignore
+
+    async def dispatch(self, cr: ConsumerRecord) -> None:
+        await self._slots.acquire()
+        if self._in_flight == 0:
+            await self.is_processing.acquire()
+        self._in_flight += 1
+
+        topic_partition = TopicPartition(topic=cr.topic, partition=cr.partition)
+        self._offsets.add(topic_partition, cr.offset)
+
+        if cr.key is None:
+            asyncio.ensure_future(self.process(cr, topic_partition))
+            return None
+
+        lane = (cr.topic, cr.key)
+        previous = self._lanes.get(lane)
+        task = asyncio.ensure_future(self.process(cr, topic_partition, previous))
+        self._lanes[lane] = task
+
+        def remove_lane(task: asyncio.Task) -> None:
+            if self._lanes.get(lane) is task:
+                del self._lanes[lane]
+
+        task.add_done_callback(remove_lane)
+
+    async def process(
+        self,
+        cr: ConsumerRecord,
+        topic_partition: TopicPartition,
+        previous: Optional[asyncio.Task] = None,
+    ) -> None:
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+
+            # after a failure the records are not processed, so they are
+            # consumed again when the stream restarts
+            if not self._failed.done():
+                await self.func(cr)
+                self._offsets.done(topic_partition, cr.offset)
+        except Exception as exc:
+            if not self._failed.done():
+                self._failed.set_result(exc)
+        finally:
+            self._slots.release()
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                if not self.running:
+                    # the stream is stopping, commit before the consumer stops
+                    await self.commit_processed()
+                self.is_processing.release()
+
+    async def commit_processed(self) -> None:
+        if self.consumer is None:
+            return None
+
+        offsets = self._offsets.committable(self.consumer.assignment())
+        if not offsets:
+            return None
+
+        try:
+            for table in self.tables:
+                await table.flush()
+        except Exception:
+            logger.exception(f"Stream {self} could not flush the tables to commit")
+            return None
+
+        try:
+            await self.commit(offsets)
+        except errors.KafkaError as exc:
+            logger.warning(f"Stream {self} could not commit {offsets}: {exc!r}")
+        else:
+            self._offsets.committed(offsets)
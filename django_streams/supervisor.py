@@ -0,0 +1,170 @@
+import logging
+import multiprocessing
+import signal
+import time
+from multiprocessing.connection import wait
+from multiprocessing.process import BaseProcess
+from typing import Any, Callable, Dict, List, Optional
+
+from django.db import connections
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Supervisor:
+    """
+    Prefork `processes` children that run `target` and keep them running.
+    `target` is called with the index of the child, from `0` to `processes - 1`.
+
+    Crashed children are restarted with an exponential backoff, which is reset
+    when a child was running for more than `stable_after` seconds.
+    When the parent receives `SIGINT` or `SIGTERM` it forwards `SIGTERM` to the
+    children and waits up to `shutdown_timeout` seconds for them to stop
+    gracefully before killing them.
+
+    Attributes:
+        target Callable[[int], Any]: function that runs the worker in each child
+        processes int: amount of children
+        min_backoff float: seconds to wait before the first restart
+        max_backoff float: maximum seconds to wait between restarts
+        stable_after float: seconds after which a child is considered healthy
+        shutdown_timeout float: seconds to wait for the children to stop
+    """
+
+    def __init__(
+        self,
+        target: Callable[[int], Any],
+        processes: int,
+        *,
+        min_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        stable_after: float = 60.0,
+        shutdown_timeout: float = 30.0,
+    ) -> None:
+        self.target = target
+        self.processes = processes
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self.shutdown_timeout = shutdown_timeout
+        self.stopping = False
+        self._context = multiprocessing.get_context("fork")
+        self._children: Dict[int, Optional[BaseProcess]] = {}
+        self._started_at: Dict[int, float] = {}
+        self._restart_at: Dict[int, float] = {}
+        self._failures: Dict[int, int] = {}
+
+    def run(self) -> None:
+        previous_handlers = {
+            signum: signal.signal(signum, self.stop)
+            for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+
+        # connections must not be shared between the parent and the children
+        connections.close_all()
+
+        try:
+            for index in range(self.processes):
+                self._spawn(index)
+
+            while not self.stopping:
+                self._supervise()
+        finally:
+            self._shutdown()
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+    def stop(self, *args) -> None:
+        """
+        Stop supervising and forward `SIGTERM` to the children.
+        Used as signal handler by `run`.
+        """
+        self.stopping = True
+        for child in self._alive_children():
+            child.terminate()
+
+    def _child_main(self, index: int) -> None:
+        # the SIGINT from a terminal reaches all the process group,
+        # the children only stop when the parent forwards SIGTERM
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        self.target(index)
+
+    def _spawn(self, index: int) -> None:
+        child = self._context.Process(
+            target=self._child_main,
+            args=(index,),
+            name=f"django-streams-worker-{index}",
+        )
+        child.start()
+        self._children[index] = child
+        self._started_at[index] = time.monotonic()
+        logger.info(f"Worker process {index} started with pid {child.pid}")
+
+    def _alive_children(self) -> List[BaseProcess]:
+        return [
+            child
+            for child in self._children.values()
+            if child is not None and child.is_alive()
+        ]
+
+    def _supervise(self) -> None:
+        now = time.monotonic()
+        for index, child in list(self._children.items()):
+            if child is None:
+                if now >= self._restart_at[index]:
+                    self._spawn(index)
+            elif not child.is_alive():
+                child.join()
+                self._schedule_restart(index, child, now)
+
+        # wake up when a child exits or when the next restart is due
+        restarts = [
+            max(0.0, self._restart_at[index] - now)
+            for index, child in self._children.items()
+            if child is None
+        ]
+        wait(
+            [child.sentinel for child in self._alive_children()],
+            timeout=min([1.0, *restarts]),
+        )
+
+    def _schedule_restart(self, index: int, child: BaseProcess, now: float) -> None:
+        # the child was joined, its live gauges must not be aggregated anymore
+        metrics.mark_process_dead(child.pid)  # type: ignore[arg-type]
+        if self.stopping:
+            return None
+
+        if now - self._started_at[index] >= self.stable_after:
+            self._failures[index] = 0
+        self._failures[index] = self._failures.get(index, 0) + 1
+
+        backoff = min(
+            self.min_backoff * 2 ** (self._failures[index] - 1), self.max_backoff
+        )
+        logger.error(
+            f"Worker process {index} with pid {child.pid} exited with code "
+            f"{child.exitcode}. Restarting in {backoff} seconds"
+        )
+        self._children[index] = None
+        self._restart_at[index] = now + backoff
+
+    def _shutdown(self) -> None:
+        self.stop()
+
+        deadline = time.monotonic() + self.shutdown_timeout
+        for child in self._children.values():
+            if child is None:
+                continue
+            child.join(max(0.0, deadline - time.monotonic()))
+            if child.is_alive():
+                logger.warning(
+                    f"Worker process with pid {child.pid} did not stop "
+                    f"in {self.shutdown_timeout} seconds. Killing it"
+                )
+                child.kill()
+                child.join()
+            metrics.mark_process_dead(child.pid)  # type: ignore[arg-type]
+        logger.info("All worker processes have STOPPED....")
@@ -0,0 +1,259 @@
+import asyncio
+import functools
+import logging
+from collections import OrderedDict
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Set,
+    Type,
+    TypeVar,
+)
+
+from django.db import DEFAULT_DB_ALIAS, models
+from kstreams import TopicPartition
+from kstreams.rebalance_listener import RebalanceListener
+
+from . import metrics
+from .db import DatabaseExecutor, bulk_upsert
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Table:
+    """
+    Keyed state of the streams backed by a django model. The rows are kept in
+    memory, so the hot keys are read once, and the changes are buffered and
+    written with one upsert, see `db.bulk_upsert`, every
+    `flush_size` changed rows, every `flush_interval` seconds and before the
+    streams that use the table commit their offsets. A committed offset means
+    that the changes of its records are in the database.
+
+    Create the tables with `stream_engine.table` and pass them to the streams
+    that change them with `@stream_engine.stream(..., tables=[...])`.
+
+    !!! Example
+        ```python
+        counters = stream_engine.table("counters", model=Counter, key_field="name")
+
+        @stream_engine.stream("local--clicks", group_id="clicks", tables=[counters])
+        async def count(cr: ConsumerRecord):
+            counter = await counters.get(cr.key)
+            counter.total += 1
+            await counters.save(counter)
+        ```
+
+    Attributes:
+        name str: name of the table
+        model Type[models.Model]: model of the rows
+        key_field str | None: unique field of the keys, default the primary key
+        fields List[str] | None: fields written on flush, default all the
+            concrete fields but the key
+        maxsize int: maximum amount of unchanged rows kept in memory
+        flush_size int: amount of changed rows that triggers a flush
+        flush_interval float: maximum seconds between flushes
+        using str: database alias
+        executor DatabaseExecutor | None: threads to run the queries,
+            by default `sync_to_async`
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        model: Type[models.Model],
+        key_field: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        maxsize: int = 10_000,
+        flush_size: int = 1000,
+        flush_interval: float = 1.0,
+        using: str = DEFAULT_DB_ALIAS,
+        executor: Optional[DatabaseExecutor] = None,
+    ) -> None:
+        self.name = name
+        self.model = model
+        self.key_field = key_field or model._meta.pk.name
+        self.fields = fields or [
+            field.name
+            for field in model._meta.concrete_fields
+            if field.name != self.key_field and not field.primary_key
+        ]
+        self.maxsize = maxsize
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.using = using
+        self.executor = executor
+        self._rows: "OrderedDict[Hashable, models.Model]" = OrderedDict()
+        self._changed: Dict[Hashable, models.Model] = {}
+        self._flushing: Dict[Hashable, models.Model] = {}
+        self._flush_timer: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flushed = metrics.MET_TABLE_FLUSHED.labels(table=name)
+        self._load = self._to_async(self._load_row, "load")
+        self._upsert = self._to_async(self._upsert_rows, "upsert")
+
+    def __str__(self) -> str:
+        return f"Table(name={self.name}, model={self.model.__name__})"
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def to_key(self, key: Any) -> Hashable:
+        # `"1"` from a record key and `1` from a field are the same key
+        return self.model._meta.get_field(self.key_field).to_python(key)
+
+    async def get(self, key: Any) -> Any:
+        """
+        Returns the row of the key, from memory or from the database. If it
+        does not exist a new instance is returned, which is created on flush.
+        """
+        key = self.to_key(key)
+        row = self._rows.get(key)
+        if row is None:
+            loaded = await self._load(key)
+            # the row could be loaded by another record meanwhile
+            row = self._rows.get(key)
+            if row is None:
+                # evict before inserting, so the row returned is never evicted
+                self._evict(room=1)
+                row = self._rows[key] = loaded
+        self._rows.move_to_end(key)
+        return row
+
+    async def save(self, row: models.Model) -> None:
+        """
+        Buffer the changes of the row, they are written on the next flush
+        """
+        key = self.to_key(getattr(row, self.key_field))
+        self._rows[key] = row
+        self._rows.move_to_end(key)
+        self._changed[key] = row
+
+        if len(self._changed) >= self.flush_size:
+            await self.flush()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(
+                self.flush_interval, self._schedule_flush
+            )
+
+    def _schedule_flush(self) -> None:
+        self._flush_timer = None
+        self._flush_task = asyncio.ensure_future(self._flush_or_log())
+
+    async def _flush_or_log(self) -> None:
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception(f"{self} could not be flushed")
+
+    async def flush(self) -> None:
+        """
+        Write the changed rows with one upsert.
+
+        Raises:
+            DatabaseError: if they could not be written, then they
+                are written in the next flush
+        """
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+        changed, self._changed = self._changed, {}
+        if not changed:
+            return None
+
+        self._flushing.update(changed)
+        try:
+            await self._upsert(list(changed.values()))
+        except BaseException:
+            # the rows saved meanwhile have the latest changes
+            self._changed = {**changed, **self._changed}
+            raise
+        finally:
+            for key in changed:
+                self._flushing.pop(key, None)
+        self._flushed.inc(len(changed))
+        self._evict()
+
+    def clear(self) -> None:
+        """
+        Forget the rows that did not change, so they are read again
+        """
+        self._rows = OrderedDict(
+            (key, row) for key, row in self._rows.items() if self._is_changed(key)
+        )
+
+    def _is_changed(self, key: Hashable) -> bool:
+        return key in self._changed or key in self._flushing
+
+    def _evict(self, room: int = 0) -> None:
+        """
+        Forget the least recently used rows until there is `room` for new ones.
+        The changed rows are kept until they are flushed, otherwise they could
+        be read again before the changes are written, so there can be more
+        than `maxsize` rows while they are not flushed.
+        """
+        excess = len(self._rows) + room - self.maxsize
+        if excess <= 0:
+            return None
+
+        evicted: List[Hashable] = []
+        for key in self._rows:
+            if len(evicted) == excess:
+                break
+            if not self._is_changed(key):
+                evicted.append(key)
+        for key in evicted:
+            del self._rows[key]
+
+    def _load_row(self, key: Hashable) -> models.Model:
+        lookup = {self.key_field: key}
+        row = self.model._default_manager.using(self.using).filter(**lookup).first()
+        return row if row is not None else self.model(**lookup)
+
+    def _upsert_rows(self, rows: List[models.Model]) -> None:
+        bulk_upsert(
+            self.model._default_manager.using(self.using),
+            rows,
+            unique_field=self.key_field,
+            update_fields=self.fields,
+        )
+
+    def _to_async(self, fn: Callable[..., T], name: str) -> Callable[..., Awaitable[T]]:
+        if self.executor is not None:
+            return functools.partial(self.executor.run, fn)
+        return metrics.sync_to_async(fn, name=f"Table.{name}")
+
+
+class TablesRebalanceListener(RebalanceListener):
+    """
+    Before the partitions are revoked, commit the records processed with the
+    tables flushed, and forget the rows of the tables, as other workers can
+    change them from now on. Then call the listener of the stream.
+    """
+
+    def __init__(self, listener: Optional[RebalanceListener] = None) -> None:
+        super().__init__()
+        self.listener = listener
+
+    async def on_partitions_revoked(self, revoked: Set[TopicPartition]) -> None:
+        await self.stream.commit_processed()  # type: ignore
+        for table in self.stream.tables:  # type: ignore
+            table.clear()
+        if self.listener is not None:
+            self.listener.stream = self.stream
+            self.listener.engine = self.engine
+            await self.listener.on_partitions_revoked(revoked)
+
+    async def on_partitions_assigned(self, assigned: Set[TopicPartition]) -> None:
+        if self.listener is not None:
+            self.listener.stream = self.stream
+            self.listener.engine = self.engine
+            await self.listener.on_partitions_assigned(assigned)
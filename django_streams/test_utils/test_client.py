@@ -1,5 +1,7 @@
+import asyncio
+import concurrent.futures
 from datetime import datetime
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Union
 
 from aiokafka.structs import RecordMetadata, TopicPartition
 from kstreams import ConsumerRecord, types
@@ -7,7 +9,7 @@ from kstreams.test_utils import TestStreamClient as Base
 from kstreams.test_utils import TopicManager
 
 from django_streams.engine import Base as BaseEngine
-from django_streams.engine import StreamEngine
+from django_streams.engine import Record, StreamEngine
 
 
 class TestStreamClient(Base):
@@ -20,11 +22,43 @@ class TestStreamClient(Base):
         """
         super().__init__(*args, **kwargs)
 
+        # store the engine methods to restore them later
+        self.engine_sync_send = StreamEngine.sync_send
+        self.engine_sync_send_nowait = StreamEngine.sync_send_nowait
+        self.engine_sync_send_many = StreamEngine.sync_send_many
+        self.engine_start_streams = StreamEngine.start_streams
+
         # monkey patch get_sync_producer to make sure that a kafka connection never happens
         StreamEngine.sync_send = self.sync_send  # type: ignore
+        StreamEngine.sync_send_nowait = self.sync_send_nowait  # type: ignore
+        StreamEngine.sync_send_many = self.sync_send_many  # type: ignore
 
         # monkey patch the start_streams as the django_streams engine runs them not in an asyncio.Task
-        StreamEngine.start_streams = BaseEngine.start_streams  # type: ignore
+        StreamEngine.start_streams = self.start_streams  # type: ignore
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def start_streams(self) -> None:
+        """
+        Start the streams and the monitor in tasks, like kstreams does, and keep
+        the tasks, which kstreams does not keep, to cancel them on `stop`
+        """
+        running = asyncio.all_tasks()
+        await BaseEngine.start_streams(self.stream_engine)
+        self._tasks = asyncio.all_tasks() - running
+
+    async def stop(self) -> None:
+        await super().stop()
+
+        # the streams wait for records that never come after they are stopped
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        # restore original engine methods
+        StreamEngine.sync_send = self.engine_sync_send  # type: ignore
+        StreamEngine.sync_send_nowait = self.engine_sync_send_nowait  # type: ignore
+        StreamEngine.sync_send_many = self.engine_sync_send_many  # type: ignore
+        StreamEngine.start_streams = self.engine_start_streams  # type: ignore
 
     def sync_send(
         self,
@@ -73,3 +107,52 @@ class TestStreamClient(Base):
             timestamp_type=0,
             log_start_offset=None,
         )
+
+    def sync_send_nowait(
+        self,
+        topic_name: str,
+        *,
+        on_success: Optional[Callable[[RecordMetadata], Any]] = None,
+        on_error: Optional[Callable[[BaseException], Any]] = None,
+        **kwargs,
+    ) -> "concurrent.futures.Future[RecordMetadata]":
+        """
+        Method intended to monkey patch the stream_engine.sync_send_nowait method.
+        The event is produced right away and the returned future is already done.
+        """
+        result: concurrent.futures.Future = concurrent.futures.Future()
+        try:
+            metadata = self.sync_send(topic_name, **kwargs)
+        except Exception as exc:
+            result.set_exception(exc)
+            if on_error is not None:
+                on_error(exc)
+        else:
+            result.set_result(metadata)
+            if on_success is not None:
+                on_success(metadata)
+        return result
+
+    def sync_send_many(
+        self, records: Iterable[Sequence]
+    ) -> List[Union[RecordMetadata, Exception]]:
+        """
+        Method intended to monkey patch the stream_engine.sync_send_many method.
+        """
+        results: List[Union[RecordMetadata, Exception]] = []
+        for record in records:
+            topic, value, key, headers, partition, timestamp_ms = Record(*record)
+            try:
+                metadata = self.sync_send(
+                    topic,
+                    value=value,
+                    key=key,
+                    headers=headers,  # type: ignore
+                    partition=partition or 0,
+                    timestamp_ms=timestamp_ms,
+                )
+            except Exception as exc:
+                results.append(exc)
+            else:
+                results.append(metadata)
+        return results
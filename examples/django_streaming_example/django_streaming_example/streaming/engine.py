@@ -6,8 +6,7 @@ from kstreams import utils
 from kstreams.backends import kafka
 
 from django_streams import create_engine
-
-from .serializer import JsonSerializer
+from django_streams.serializers import JsonSerializer
 
 
 def get_ssl_context() -> Optional[ssl.SSLContext]:
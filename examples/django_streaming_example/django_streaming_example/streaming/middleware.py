@@ -1,11 +0,0 @@
-import json
-
-from kstreams import ConsumerRecord, middleware
-
-
-class JsonDeserializerMiddleware(middleware.BaseMiddleware):
-    async def __call__(self, cr: ConsumerRecord):
-        if cr.value is not None:
-            data = json.loads(cr.value.decode())
-            cr.value = data
-        return await self.next_call(cr)
@@ -1,33 +1,29 @@
 import logging
 
-from asgiref.sync import sync_to_async
 from kstreams import ConsumerRecord, consts, middleware
 
+from django_streams.idempotency import CacheStore, IdempotencyMiddleware
+from django_streams.serializers import JsonDeserializerMiddleware
+
 from .engine import stream_engine
-from .middleware import JsonDeserializerMiddleware
 from .models import HelloWorld
 from .utils import hello_topic, hello_topic_enriched
 
 logger = logging.getLogger(__name__)
 
-
-@sync_to_async
-def get_object(pk: int = 1):
-    instance, _ = HelloWorld.objects.get_or_create(pk=pk)
-    return instance
-
-
-@sync_to_async
-def save_to_db(instance):
-    instance.total += 1
-    instance.save()
-    logger.info(f"Total increased to {instance.total}")
+# the total is written in bulk before the offsets are committed
+totals = stream_engine.table("hello-totals", model=HelloWorld)
 
 
 @stream_engine.stream(
     hello_topic,
     group_id="django-streams-example-hello-kpn",
-    middlewares=[middleware.Middleware(JsonDeserializerMiddleware)],
+    middlewares=[
+        # records consumed again after a rebalance do not increase the total
+        middleware.Middleware(IdempotencyMiddleware, store=CacheStore()),
+        middleware.Middleware(JsonDeserializerMiddleware),
+    ],
+    tables=[totals],
 )
 async def consumer_task(cr: ConsumerRecord):
     logger.info(f"Event consumed: headers: {cr.headers}, payload: {cr.value} \n")
@@ -42,5 +38,7 @@ async def consumer_task(cr: ConsumerRecord):
     )
 
     logger.info(f"Event produced with metadata {metadata} \n")
-    instance = await get_object()
-    await save_to_db(instance)
+    instance = await totals.get(1)
+    instance.total += 1
+    await totals.save(instance)
+    logger.info(f"Total increased to {instance.total}")
@@ -4,6 +4,8 @@ from django.http import HttpResponse
 from django.views.generic import View
 from kstreams import consts
 
+from django_streams import Record
+
 from .engine import stream_engine
 from .utils import hello_topic
 
@@ -47,22 +49,21 @@ class ProduceTombStone(View):
 
 class StressTestView(View):
     def get(self, _, total_events, *args, **kwargs):
-        counter = 0
         start_time = time.time()
-        while counter < total_events:
-            stream_engine.sync_send(
+        records = (
+            Record(
                 hello_topic,
                 value={"message": f"hello world topic {hello_topic}"},
+                key="hello",
                 headers={
                     "kpn-event-type": "hello_world.test",
                     "content-type": consts.APPLICATION_JSON,
                 },
-                key="hello",
-                partition=None,
-                timestamp_ms=None,
             )
+            for _ in range(total_events)
+        )
+        results = stream_engine.sync_send_many(records)
 
-            counter += 1
         return HttpResponse(
-            f"{counter} event produced to topic {hello_topic} in {time.time() - start_time} seconds"
+            f"{len(results)} event produced to topic {hello_topic} in {time.time() - start_time} seconds"
         )
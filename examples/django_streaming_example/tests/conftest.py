@@ -2,7 +2,8 @@ import asyncio
 
 import pytest
 from django_streaming_example.streaming.engine import stream_engine
-from kstreams import TestStreamClient
+
+from django_streams.test_utils.test_client import TestStreamClient
 
 
 @pytest.fixture(scope="session")
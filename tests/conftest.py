@@ -1,3 +1,4 @@
+import asyncio
 from dataclasses import field
 from typing import Dict, NamedTuple
 
@@ -46,5 +47,15 @@ async def stream_engine():
     )
     yield stream_engine
     await stream_engine.clean_streams()
+    stream_engine._producer = None
+    stream_engine._producer_loop = None
+    stream_engine.db_executor = None
+    stream_engine.producer_config = {}
+    stream_engine.loop_monitor = None
+    stream_engine.lag_exporter = None
+    stream_engine.drain_timeout = None
+    stream_engine.group_instance_id = None
+    stream_engine.partition_assignor = None
+    stream_engine.loop_factory = asyncio.new_event_loop
     stream_engine.serializer = None
     stream_engine.deserializer = None
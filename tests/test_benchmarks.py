@@ -45,12 +45,31 @@ sudo py-spy record -o profile.svg -- python tests/test_benchmarks.py
 
 """
 
+import asyncio
+import datetime
+import importlib.util
+import json
+import statistics
+import threading
+import time
+import uuid
+from decimal import Decimal
+from typing import List
 from unittest import mock
 
 import aiokafka
+import pytest
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from kstreams import ConsumerRecord, middleware
 from kstreams.test_utils.structs import RecordMetadata
 
-from django_streams.engine import StreamEngine
+from django_streams import loops, serializers
+from django_streams.engine import Record, StreamEngine
+from django_streams.loop_monitor import LoopMonitor
+from django_streams.model_events import ModelEventSerializer
+from django_streams.test_utils.test_client import TestStreamClient
+from tests.testing_app.models import HelloWorld, Order
 
 topic = "dev-kpn-des--hello-world"
 value = {"message": "Hi KPN"}
@@ -58,6 +77,18 @@ event_type = "hello_world.test"
 schema_id = "example/hello_kpn/v0.0.1/schema.avsc"
 key = "hello"
 
+# uvloop is optional, its benchmarks are skipped when it is not installed
+EVENT_LOOPS = [
+    "asyncio",
+    pytest.param(
+        "uvloop",
+        marks=pytest.mark.skipif(
+            importlib.util.find_spec("uvloop") is None,
+            reason="uvloop is not installed",
+        ),
+    ),
+]
+
 
 def bench_sync_send(stream_engine: StreamEngine, record_metadata: RecordMetadata):
     async def async_func():
@@ -95,3 +126,407 @@ def test_sync_send(
 ):
     # benchmark something
     benchmark(bench_sync_send, stream_engine, record_metadata)
+
+
+# simulated time between a record being queued and acked by the broker
+ACK_LATENCY = 0.001
+SENDS_PER_THREAD = 50
+
+
+def bench_sync_send_contention(stream_engine: StreamEngine, threads: int) -> List:
+    latencies: List[float] = []
+
+    def produce():
+        for _ in range(SENDS_PER_THREAD):
+            start = time.perf_counter()
+            stream_engine.sync_send(topic, value=value, key=key)
+            latencies.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=produce) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return latencies
+
+
+@pytest.mark.parametrize("threads", [1, 4, 16])
+@pytest.mark.parametrize("producer_thread", [False, True], ids=["lock", "thread"])
+def test_sync_send_contention(
+    benchmark,
+    stream_engine: StreamEngine,
+    record_metadata: RecordMetadata,
+    threads: int,
+    producer_thread: bool,
+):
+    """
+    Latency of `sync_send` when several request threads produce at the same time,
+    using the blocking mode (lock) and the background producer thread.
+    p50/p99 per `sync_send` call are stored in `extra_info`.
+    """
+
+    async def send(*args, **kwargs):
+        return asyncio.ensure_future(asyncio.sleep(ACK_LATENCY, result=record_metadata))
+
+    with mock.patch.multiple(
+        aiokafka.AIOKafkaProducer,
+        start=mock.DEFAULT,
+        stop=mock.DEFAULT,
+        send=send,
+    ):
+        if producer_thread:
+            stream_engine.start_producer_thread()
+
+        try:
+            latencies = benchmark.pedantic(
+                bench_sync_send_contention,
+                args=(stream_engine, threads),
+                rounds=5,
+            )
+        finally:
+            stream_engine.stop_producer_thread()
+
+    percentiles = statistics.quantiles(latencies, n=100)
+    benchmark.extra_info["p50_ms"] = percentiles[49] * 1000
+    benchmark.extra_info["p99_ms"] = percentiles[98] * 1000
+
+
+RECORDS_PER_ROUND = 500
+
+
+def consumer_records(amount: int) -> List[ConsumerRecord]:
+    return [
+        ConsumerRecord(
+            topic=topic,
+            partition=0,
+            offset=offset,
+            timestamp=1616671352653,
+            timestamp_type=0,
+            key=key,
+            value=b"Hi KPN",
+            checksum=None,
+            serialized_key_size=len(key),
+            serialized_value_size=6,
+            headers=[],
+        )
+        for offset in range(amount)
+    ]
+
+
+SENDS = 1_000
+
+
+@pytest.mark.parametrize("event_loop_name", EVENT_LOOPS)
+@pytest.mark.parametrize("mode", ["send", "send_many"])
+def test_send_throughput(
+    benchmark,
+    stream_engine: StreamEngine,
+    record_metadata: RecordMetadata,
+    mode: str,
+    event_loop_name: str,
+):
+    """
+    Time to produce `SENDS` records from a coroutine, awaiting every `send`
+    and with one `send_many`, on the `asyncio` and `uvloop` event loops
+    """
+    loop_factory = loops.get_loop_factory(event_loop_name)
+
+    async def send(*args, **kwargs):
+        return asyncio.ensure_future(asyncio.sleep(0, result=record_metadata))
+
+    async def produce():
+        if mode == "send":
+            for _ in range(SENDS):
+                await stream_engine.send(topic, value=value, key=key)
+        else:
+            await stream_engine.send_many((topic, value, key) for _ in range(SENDS))
+        await stream_engine.stop_producer()
+        stream_engine._producer = None
+
+    with mock.patch.multiple(
+        aiokafka.AIOKafkaProducer,
+        start=mock.DEFAULT,
+        stop=mock.DEFAULT,
+        send=send,
+    ):
+        benchmark.pedantic(
+            lambda: loops.run(produce(), loop_factory=loop_factory), rounds=5
+        )
+
+    # there are no stats with `--benchmark-disable`
+    if benchmark.stats is not None:
+        benchmark.extra_info["records_per_second"] = SENDS / benchmark.stats.stats.mean
+
+
+LOOP_ITERATIONS = 10_000
+
+
+@pytest.mark.parametrize("monitored", [False, True], ids=["off", "on"])
+def test_loop_monitor_overhead(benchmark, monitored: bool):
+    """
+    Time to run `LOOP_ITERATIONS` iterations of the event loop
+    with and without the `LoopMonitor` of `worker --detect-blocking`
+    """
+
+    async def run():
+        monitor = LoopMonitor()
+        if monitored:
+            monitor.start()
+        for _ in range(LOOP_ITERATIONS):
+            await asyncio.sleep(0)
+        await monitor.stop()
+
+    benchmark.pedantic(lambda: asyncio.run(run()), rounds=10)
+
+
+class PassThroughMiddleware(middleware.BaseMiddleware):
+    async def __call__(self, cr: ConsumerRecord):
+        return await self.next_call(cr)
+
+
+CONSUMED_RECORDS = 500
+
+
+@pytest.mark.parametrize("event_loop_name", EVENT_LOOPS)
+@pytest.mark.parametrize("middlewares", [0, 4, 16])
+def test_consume_latency(
+    benchmark, stream_engine: StreamEngine, middlewares: int, event_loop_name: str
+):
+    """
+    Latency between sending a record with the `TestStreamClient` and the stream
+    handling it, through a chain of `middlewares` middlewares, on the `asyncio`
+    and `uvloop` event loops.
+    p50/p99 per record are stored in `extra_info`.
+    """
+    loop_factory = loops.get_loop_factory(event_loop_name)
+    latencies: List[float] = []
+    consumed: List[asyncio.Event] = []
+
+    @stream_engine.stream(
+        topic,
+        middlewares=[
+            middleware.Middleware(PassThroughMiddleware) for _ in range(middlewares)
+        ],
+    )
+    async def consume(cr: ConsumerRecord):
+        latencies.append(time.perf_counter() - float(cr.value))
+        if len(latencies) % CONSUMED_RECORDS == 0:
+            consumed[-1].set()
+
+    async def send_and_consume():
+        consumed.append(asyncio.Event())
+        async with TestStreamClient(stream_engine=stream_engine):
+            for _ in range(CONSUMED_RECORDS):
+                await stream_engine.send(
+                    topic, value=str(time.perf_counter()).encode(), key=key
+                )
+            await consumed[-1].wait()
+
+    benchmark.pedantic(
+        lambda: loops.run(send_and_consume(), loop_factory=loop_factory), rounds=5
+    )
+
+    percentiles = statistics.quantiles(latencies, n=100)
+    benchmark.extra_info["p50_ms"] = percentiles[49] * 1000
+    benchmark.extra_info["p99_ms"] = percentiles[98] * 1000
+
+
+@sync_to_async
+def save_record(cr: ConsumerRecord) -> None:
+    HelloWorld(message=cr.value.decode()).save()
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("batch", [False, True], ids=["per-record", "batch"])
+def test_consume_to_orm(benchmark, stream_engine: StreamEngine, batch: bool):
+    """
+    Time to store `RECORDS_PER_ROUND` records with the ORM, with one
+    `sync_to_async` hop and one `save` per record, as in the example app,
+    and with one `bulk_create` per batch using `batch_stream`.
+    """
+
+    @stream_engine.batch_stream(topic, max_records=RECORDS_PER_ROUND)
+    def consume_batch(records: List[ConsumerRecord]):
+        HelloWorld.objects.bulk_create(
+            [HelloWorld(message=cr.value.decode()) for cr in records]
+        )
+
+    records = consumer_records(RECORDS_PER_ROUND)
+
+    async def consume():
+        if batch:
+            await consume_batch.func(records)
+        else:
+            for cr in records:
+                await save_record(cr)
+
+    def clear():
+        HelloWorld.objects.all().delete()
+
+    # every round starts with an empty table, also with `--benchmark-disable`
+    # where it runs only once
+    benchmark.pedantic(lambda: asyncio.run(consume()), setup=clear, rounds=5)
+    assert HelloWorld.objects.count() == RECORDS_PER_ROUND
+
+
+ORDERS = 5_000
+
+
+def hand_built_records(queryset) -> List[Record]:
+    # as every call site did before `ModelEventSerializer`
+    return [
+        Record(
+            "orders",
+            value={
+                "id": order.pk,
+                "reference": str(order.reference),
+                "total": str(order.total),
+                "created_at": order.created_at.isoformat(),
+                "delivery_time": None,
+                "hello_id": order.hello_id,
+            },
+            key=str(order.pk),
+        )
+        for order in queryset
+    ]
+
+
+order_events = ModelEventSerializer(Order, "orders")
+
+
+def serializer_records(queryset) -> List[Record]:
+    return list(order_events.records(queryset))
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "build", [hand_built_records, serializer_records], ids=["dict", "serializer"]
+)
+def test_model_events(benchmark, build):
+    """
+    Build the events of `ORDERS` rows, from model instances with hand built
+    dicts, and from the rows with a `ModelEventSerializer`
+    """
+    Order.objects.bulk_create(
+        Order(
+            reference=uuid.uuid4(),
+            total=Decimal("10.50"),
+            created_at=datetime.datetime(2024, 1, 2),
+        )
+        for _ in range(ORDERS)
+    )
+    # a new queryset every round, so the rows are always fetched
+    records = benchmark(lambda: build(Order.objects.all()))
+    assert len(records) == ORDERS
+
+
+CONCURRENT_REQUESTS = 200
+
+
+@pytest.mark.parametrize("mode", ["send", "sync_to_async"])
+def test_async_view_send(
+    benchmark,
+    stream_engine: StreamEngine,
+    record_metadata: RecordMetadata,
+    mode: str,
+):
+    """
+    Throughput of async views producing in the event loop of an ASGI server:
+    `await send` with the producer of the server loop, and `sync_send` wrapped
+    with `sync_to_async` handing over to the producer thread.
+    uvicorn is not needed, the server loop is simulated with `asyncio.run`
+    and `CONCURRENT_REQUESTS` views producing at the same time.
+    """
+
+    async def send(*args, **kwargs):
+        return asyncio.ensure_future(asyncio.sleep(ACK_LATENCY, result=record_metadata))
+
+    if mode == "send":
+        produce = stream_engine.send
+    else:
+        produce = sync_to_async(stream_engine.sync_send, thread_sensitive=False)
+
+    async def view():
+        return await produce(topic, value=value, key=key)
+
+    async def server():
+        results = await asyncio.gather(*[view() for _ in range(CONCURRENT_REQUESTS)])
+        # stop the producer of the server loop, if any
+        await stream_engine.stop_producer()
+        return results
+
+    with mock.patch.multiple(
+        aiokafka.AIOKafkaProducer,
+        start=mock.DEFAULT,
+        stop=mock.DEFAULT,
+        send=send,
+    ):
+        stream_engine.start_producer_thread()
+        try:
+            results = benchmark.pedantic(lambda: asyncio.run(server()), rounds=5)
+        finally:
+            stream_engine.stop_producer_thread()
+
+    assert results == [record_metadata] * CONCURRENT_REQUESTS
+
+
+def json_payload(size: int) -> dict:
+    """
+    Payload of about `size` bytes when it is encoded to json
+    """
+    item = {"id": 1, "message": "Hi KPN", "total": 10.5, "tags": ["a", "b"]}
+    item_size = len(json.dumps(item)) + 1
+    return {"items": [item] * max(1, size // item_size)}
+
+
+def stdlib_roundtrip(payload: dict) -> dict:
+    # as the JsonSerializer and JsonDeserializerMiddleware of the example app
+    return json.loads(json.dumps(payload).encode().decode())
+
+
+def django_streams_roundtrip(payload: dict) -> dict:
+    return serializers.loads(serializers.dumps(payload))
+
+
+@pytest.mark.parametrize("size", [100, 10_000, 1_000_000], ids=["100B", "10KB", "1MB"])
+@pytest.mark.parametrize(
+    "roundtrip",
+    [stdlib_roundtrip, django_streams_roundtrip],
+    ids=["stdlib", f"django_streams-{serializers.BACKEND}"],
+)
+def test_json_roundtrip(benchmark, size: int, roundtrip):
+    """
+    Serialize and deserialize json payloads from 100 B to 1 MB
+    """
+    payload = json_payload(size)
+    assert benchmark(roundtrip, payload) == payload
+
+
+WORKER_STREAMS = 20
+
+
+def test_worker_startup(benchmark, stream_engine: StreamEngine):
+    """
+    Time for `manage.py worker` to start `WORKER_STREAMS` streams, until
+    they fetch the first record, and stop
+    """
+
+    def add_streams():
+        asyncio.run(stream_engine.clean_streams())
+        for index in range(WORKER_STREAMS):
+
+            @stream_engine.stream(f"{topic}-{index}", name=f"stream-{index}")
+            async def consume(cr: ConsumerRecord): ...
+
+    with (
+        mock.patch("kstreams.clients.Consumer.start"),
+        mock.patch(
+            "kstreams.clients.Consumer.getone",
+            # the worker stops gracefully when the streams are cancelled
+            side_effect=asyncio.CancelledError,
+        ),
+        mock.patch("kstreams.clients.Producer.start"),
+    ):
+        benchmark.pedantic(call_command, args=("worker",), setup=add_streams, rounds=5)
+
+    assert all(not stream.running for stream in stream_engine._streams)
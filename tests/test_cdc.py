@@ -0,0 +1,135 @@
+import datetime
+import uuid
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+from django.db import transaction
+
+from django_streams import cdc
+from django_streams.engine import Record, StreamEngine
+from tests.testing_app.models import Order
+
+topic = "dev-kpn-des--orders"
+
+
+@pytest.fixture
+def sync_send_many(stream_engine: StreamEngine):
+    cdc.register(stream_engine, Order, topic, fields=["id", "total"])
+    with mock.patch.object(
+        StreamEngine, "sync_send_many", return_value=[]
+    ) as sync_send_many:
+        yield sync_send_many
+    cdc.unregister(Order)
+
+
+def new_order(total: int) -> Order:
+    return Order(
+        reference=uuid.uuid4(),
+        total=Decimal(total),
+        created_at=datetime.datetime(2024, 1, 2),
+    )
+
+
+def change(op: str, pk: int, total: str) -> Record:
+    return Record(
+        topic, value={"op": op, "data": {"id": pk, "total": total}}, key=str(pk)
+    )
+
+
+def produced(sync_send_many: mock.Mock):
+    return [list(call.args[0]) for call in sync_send_many.call_args_list]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_changes_are_coalesced_per_transaction(sync_send_many):
+    with transaction.atomic():
+        order = new_order(1)
+        order.save()
+        for total in ["2.00", "3.00"]:
+            order.total = total
+            order.save()
+        other = Order.objects.create(
+            reference=uuid.uuid4(), total="5.00", created_at=datetime.datetime.now()
+        )
+        other_pk = other.pk
+        other.delete()
+        sync_send_many.assert_not_called()
+
+    # one batch, with the last change of every instance
+    assert produced(sync_send_many) == [
+        [change("save", order.pk, "3.00"), change("delete", other_pk, "5.00")]
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_changes_in_savepoints(sync_send_many):
+    with transaction.atomic():
+        order = Order.objects.create(
+            reference=uuid.uuid4(), total="2.00", created_at=datetime.datetime.now()
+        )
+        # `update_or_create` saves inside a savepoint
+        order, _ = Order.objects.update_or_create(
+            pk=order.pk, defaults={"total": Decimal("3.00")}
+        )
+        order.total = Decimal("4.00")
+        order.save()
+
+    # the last change produced is the one in the database
+    order.refresh_from_db()
+    assert str(order.total) == "4.00"
+    assert produced(sync_send_many) == [[change("save", order.pk, "4.00")]]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_changes_rollback(sync_send_many):
+    with pytest.raises(RuntimeError):
+        with transaction.atomic():
+            new_order(1).save()
+            raise RuntimeError("Rollback")
+
+    sync_send_many.assert_not_called()
+
+    # outside a transaction the change is produced right away
+    order = new_order(1)
+    order.save()
+    assert produced(sync_send_many) == [[change("save", order.pk, "1")]]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bulk_changes(sync_send_many):
+    orders = Order.objects.bulk_create([new_order(total) for total in range(3)])
+    assert produced(sync_send_many) == [
+        [change("save", order.pk, str(total)) for total, order in enumerate(orders)]
+    ]
+    sync_send_many.reset_mock()
+
+    for order in orders:
+        order.total = Decimal("7.00")
+    assert Order.objects.bulk_update(orders, ["total"]) == 3
+    assert produced(sync_send_many) == [
+        [change("save", order.pk, "7.00") for order in orders]
+    ]
+    sync_send_many.reset_mock()
+
+    # the updated rows are produced even if they do not match the filter anymore
+    cdc.StreamedQuerySet.PK_BATCH_SIZE = 2
+    try:
+        assert Order.objects.filter(total=7).update(total=Decimal("8.00")) == 3
+    finally:
+        cdc.StreamedQuerySet.PK_BATCH_SIZE = 500
+    assert produced(sync_send_many) == [
+        [change("save", order.pk, "8.00") for order in orders]
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_unregistered_model(stream_engine: StreamEngine):
+    with mock.patch.object(
+        StreamEngine, "sync_send_many", return_value=[]
+    ) as sync_send_many:
+        new_order(1).save()
+        Order.objects.update(total=Decimal("2.00"))
+        Order.objects.bulk_create([new_order(2)])
+
+    sync_send_many.assert_not_called()
@@ -0,0 +1,155 @@
+import sys
+from unittest import mock
+
+import aiokafka
+import pytest
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+
+from django_streams import conf
+from django_streams.engine import Singleton, StreamEngine
+from django_streams.factories import create_engine_from_settings
+
+from .test_engine import MySerializer
+
+
+def test_get_settings(settings):
+    settings.DJANGO_STREAMS = {"TITLE": "settings-engine"}
+    streams_settings = conf.get_settings()
+
+    assert streams_settings["TITLE"] == "settings-engine"
+    assert streams_settings["PRODUCER_CONFIG"] == {}
+
+    settings.DJANGO_STREAMS = {"PRODUCER": {}}
+    with pytest.raises(ImproperlyConfigured):
+        conf.get_settings()
+
+
+def test_create_engine_from_settings(settings):
+    settings.DJANGO_STREAMS = {
+        "TITLE": "settings-engine",
+        "BACKEND": {"bootstrap_servers": ["kafka:9092"]},
+        "SERIALIZER": "tests.test_engine.MySerializer",
+        "PRODUCER_CONFIG": {"linger_ms": 5},
+    }
+
+    with mock.patch.dict(Singleton._instances, clear=True):
+        engine = create_engine_from_settings()
+
+    assert engine.title == "settings-engine"
+    assert engine.backend.bootstrap_servers == ["kafka:9092"]
+    assert isinstance(engine.serializer, MySerializer)
+    assert engine.producer_config == {"linger_ms": 5}
+
+
+@pytest.mark.asyncio
+async def test_start_producer_config(stream_engine: StreamEngine):
+    stream_engine.producer_config = {"linger_ms": 5, "acks": "all"}
+
+    with mock.patch.object(stream_engine, "producer_class") as producer_class:
+        producer_class.return_value.start = mock.AsyncMock()
+        await stream_engine.start_producer(acks=1)
+
+    assert producer_class.call_args.kwargs["linger_ms"] == 5
+    assert producer_class.call_args.kwargs["acks"] == 1
+
+
+@pytest.mark.asyncio
+async def test_start_producer_error(stream_engine: StreamEngine):
+    with mock.patch.object(
+        aiokafka.AIOKafkaProducer, "start", side_effect=ConnectionError
+    ):
+        with pytest.raises(ConnectionError):
+            await stream_engine.start_producer()
+
+    assert stream_engine._producer is None
+
+
+def test_prewarm_producer(stream_engine: StreamEngine):
+    with mock.patch.multiple(
+        aiokafka.AIOKafkaProducer,
+        start=mock.DEFAULT,
+        partitions_for=mock.DEFAULT,
+    ) as mocks:
+        stream_engine.prewarm_producer(["topic-1", "topic-2"])
+
+    mocks["start"].assert_awaited_once()
+    mocks["partitions_for"].assert_has_awaits(
+        [mock.call("topic-1"), mock.call("topic-2")]
+    )
+
+
+def test_ready_prewarm_producer(settings, stream_engine: StreamEngine, caplog):
+    app_config = apps.get_app_config("django_streams")
+    settings.DJANGO_STREAMS = {"PREWARM_PRODUCER": True, "TOPICS": ["topic-1"]}
+
+    with mock.patch.object(StreamEngine, "prewarm_producer") as prewarm_producer:
+        app_config.ready()
+        prewarm_producer.assert_called_once_with(["topic-1"])
+
+        prewarm_producer.side_effect = ConnectionError("Broker not available")
+        app_config.ready()
+
+    assert "Producer could not be prewarmed" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_ready_prewarm_producer_running_loop(
+    settings, stream_engine: StreamEngine, caplog
+):
+    app_config = apps.get_app_config("django_streams")
+    settings.DJANGO_STREAMS = {"PREWARM_PRODUCER": True, "TOPICS": ["topic-1"]}
+
+    # under ASGI `ready` runs inside the server loop
+    with mock.patch.object(StreamEngine, "_prewarm_producer") as prewarm_producer:
+        app_config.ready()
+        await app_config.prewarm_task
+        prewarm_producer.assert_awaited_once_with(["topic-1"])
+
+        prewarm_producer.side_effect = ConnectionError("Broker not available")
+        app_config.ready()
+        await app_config.prewarm_task
+
+    assert "Producer could not be prewarmed" in caplog.text
+
+
+@pytest.mark.parametrize(
+    "argv, serving",
+    [
+        (["manage.py", "migrate"], False),
+        (["django-admin", "makemigrations"], False),
+        (["/venv/lib/django/__main__.py", "shell"], False),
+        (["/venv/lib/pytest/__main__.py"], True),
+        (["manage.py", "runserver"], True),
+        (["gunicorn", "my_project.wsgi"], True),
+        ([], True),
+    ],
+)
+def test_ready_management_commands(
+    settings, stream_engine: StreamEngine, argv, serving
+):
+    app_config = apps.get_app_config("django_streams")
+    settings.DJANGO_STREAMS = {"PREWARM_PRODUCER": True, "TOPICS": ["topic-1"]}
+
+    with (
+        mock.patch.object(sys, "argv", argv),
+        mock.patch.object(StreamEngine, "prewarm_producer") as prewarm_producer,
+    ):
+        app_config.ready()
+
+    assert prewarm_producer.called is serving
+
+
+def test_after_fork(stream_engine: StreamEngine):
+    with mock.patch.object(aiokafka.AIOKafkaProducer, "start"):
+        stream_engine.start_producer_thread()
+    loop, thread = stream_engine.loop, stream_engine._producer_thread
+
+    stream_engine._after_fork()
+
+    assert stream_engine._producer is None
+    assert stream_engine._producer_thread is None
+    assert stream_engine._loop is None
+
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
@@ -0,0 +1,134 @@
+import asyncio
+import datetime
+import threading
+from typing import List
+from unittest import mock
+
+import pytest
+from django.db import connection
+from django.utils import timezone
+from kstreams import ConsumerRecord
+from prometheus_client import REGISTRY
+
+from django_streams.db import DatabaseExecutor, bulk_upsert
+from django_streams.engine import StreamEngine
+from django_streams.models import ProcessedRecord
+
+
+def sample(name: str, executor: str) -> float:
+    return REGISTRY.get_sample_value(name, {"executor": executor}) or 0
+
+
+@pytest.mark.asyncio
+async def test_run():
+    executor = DatabaseExecutor(max_workers=1, name="test-run")
+    waits = sample("django_streams_db_executor_wait_seconds_count", "test-run")
+
+    with mock.patch("django_streams.db.close_old_connections") as close:
+        thread_name = await executor.run(lambda: threading.current_thread().name)
+
+    executor.shutdown()
+    assert thread_name.startswith("django-streams-db-test-run")
+    assert close.call_count == 2
+    assert sample("django_streams_db_executor_queue_depth", "test-run") == 0
+    assert (
+        sample("django_streams_db_executor_wait_seconds_count", "test-run") == waits + 1
+    )
+
+
+@pytest.mark.asyncio
+async def test_sync_to_async_in_parallel():
+    executor = DatabaseExecutor(max_workers=2, name="test-parallel")
+    barrier = threading.Barrier(2, timeout=1)
+
+    @executor.sync_to_async
+    def wait_for_each_other(value: int) -> int:
+        # only returns if both calls run at the same time
+        barrier.wait()
+        return value
+
+    results = await asyncio.gather(wait_for_each_other(1), wait_for_each_other(2))
+    executor.shutdown()
+    assert results == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_close_old_connections_on_error():
+    executor = DatabaseExecutor(max_workers=1, name="test-error")
+
+    def fail():
+        raise ValueError("Database not available")
+
+    with mock.patch("django_streams.db.close_old_connections") as close:
+        with pytest.raises(ValueError):
+            await executor.run(fail)
+
+    executor.shutdown()
+    assert close.call_count == 2
+
+
+def test_queue_depth_after_shutdown():
+    executor = DatabaseExecutor(max_workers=1, name="test-shutdown")
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(1)
+
+    executor.submit(block)
+    started.wait(1)
+    waiting = executor.submit(lambda: None)
+    assert sample("django_streams_db_executor_queue_depth", "test-shutdown") == 1
+
+    executor.shutdown(wait=False, cancel_futures=True)
+    release.set()
+    with pytest.raises(RuntimeError):
+        executor.submit(lambda: None)
+
+    # the cancelled and the rejected functions are not waiting anymore
+    assert waiting.cancelled()
+    assert sample("django_streams_db_executor_queue_depth", "test-shutdown") == 0
+
+
+def test_batch_stream_executor(stream_engine: StreamEngine):
+    stream_engine.db_executor = DatabaseExecutor(name="test-engine")
+    executor = DatabaseExecutor(name="test-stream")
+
+    @stream_engine.batch_stream("dev-kpn-des--hello-db")
+    def consume_batch(records: List[ConsumerRecord]): ...
+
+    @stream_engine.batch_stream("dev-kpn-des--hello-db", executor=executor)
+    def consume_other_batch(records: List[ConsumerRecord]): ...
+
+    assert consume_batch.executor is stream_engine.db_executor
+    assert consume_other_batch.executor is executor
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("supports_update_conflicts", [True, False])
+def test_bulk_upsert(supports_update_conflicts: bool):
+    now = timezone.now()
+    ProcessedRecord.objects.create(key="a", expires_at=now)
+    records = [
+        ProcessedRecord(key=key, expires_at=now + datetime.timedelta(hours=1))
+        for key in ("a", "b")
+    ]
+
+    # without the conflict target, like django < 4.1, the existing rows are updated
+    with mock.patch.object(
+        connection.features,
+        "supports_update_conflicts",
+        supports_update_conflicts,
+        create=True,
+    ):
+        bulk_upsert(
+            ProcessedRecord.objects.all(),
+            records,
+            unique_field="key",
+            update_fields=["expires_at"],
+        )
+
+    assert list(
+        ProcessedRecord.objects.order_by("key").values_list("key", "expires_at")
+    ) == [(record.key, record.expires_at) for record in records]
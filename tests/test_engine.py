@@ -1,14 +1,18 @@
+import asyncio
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, Optional
 from unittest import mock
 
 import aiokafka
 import pytest
+from django.db import transaction
 from kstreams import ConsumerRecord, Stream, clients, consts, types
 from kstreams.streams_utils import UDFType
 from kstreams.test_utils.structs import RecordMetadata
 
-from django_streams.engine import StreamEngine
+from django_streams.engine import Record, StreamEngine, _has_commit_hooks
 from django_streams.factories import create_engine
 from django_streams.test_utils.test_client import TestStreamClient
 
@@ -211,6 +215,307 @@ def test_sync_send_event(stream_engine: StreamEngine, record_metadata: RecordMet
         )
 
 
+def test_sync_send_producer_thread(
+    stream_engine: StreamEngine, record_metadata: RecordMetadata
+):
+    async def send(*args, **kwargs):
+        await asyncio.sleep(0.01)
+        return asyncio.ensure_future(asyncio.sleep(0.01, result=record_metadata))
+
+    send_mock = mock.AsyncMock(side_effect=send)
+
+    with mock.patch.multiple(
+        aiokafka.AIOKafkaProducer,
+        start=mock.DEFAULT,
+        stop=mock.DEFAULT,
+        send=send_mock,
+    ) as mocks:
+        stream_engine.start_producer_thread()
+        try:
+            assert stream_engine._producer is not None
+            mocks["start"].assert_awaited_once()
+
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(
+                    executor.map(
+                        lambda i: stream_engine.sync_send(
+                            topic, value=value, key=str(i)
+                        ),
+                        range(8),
+                    )
+                )
+
+            assert results == [record_metadata] * 8
+            assert send_mock.await_count == 8
+        finally:
+            stream_engine.stop_producer_thread()
+
+        mocks["stop"].assert_awaited_once()
+        assert stream_engine._producer is None
+        assert stream_engine._producer_thread is None
+        assert not stream_engine.loop.is_running()
+
+        # after stopping the thread the blocking mode is used again
+        assert stream_engine.sync_send(topic, value=value) == record_metadata
+
+
+def test_stop_producer_thread_while_sending(
+    stream_engine: StreamEngine, record_metadata: RecordMetadata
+):
+    sending = threading.Event()
+
+    async def send(*args, **kwargs):
+        sending.set()
+        await asyncio.sleep(0.05)
+        return asyncio.ensure_future(asyncio.sleep(0, result=record_metadata))
+
+    with mock.patch.multiple(
+        aiokafka.AIOKafkaProducer,
+        start=mock.DEFAULT,
+        stop=mock.DEFAULT,
+        send=mock.AsyncMock(side_effect=send),
+    ):
+        stream_engine.start_producer_thread()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            result = executor.submit(stream_engine.sync_send, topic, value=value)
+            sending.wait(1)
+            # the send in flight is finished before the loop stops
+            stream_engine.stop_producer_thread()
+            assert result.result(timeout=1) == record_metadata
+
+        assert not stream_engine._handoffs
+
+
+def test_send_from_another_event_loop(
+    stream_engine: StreamEngine, record_metadata: RecordMetadata
+):
+    async def send(*args, **kwargs):
+        return asyncio.ensure_future(asyncio.sleep(0, result=record_metadata))
+
+    async def asgi_view():
+        # the loop of the server is not the engine loop
+        assert await stream_engine.send(topic, value=value) == record_metadata
+        assert await stream_engine.send(topic, value=value) == record_metadata
+        producer = await stream_engine.get_producer()
+        await stream_engine.stop_producer()
+        return producer
+
+    with mock.patch.multiple(
+        aiokafka.AIOKafkaProducer,
+        start=mock.DEFAULT,
+        stop=mock.DEFAULT,
+        send=send,
+    ) as mocks:
+        assert stream_engine.sync_send(topic, value=value) == record_metadata
+        loop_producer = asyncio.run(asgi_view())
+
+        # one producer per event loop
+        assert loop_producer is not stream_engine._producer
+        assert mocks["start"].await_count == 2
+        mocks["stop"].assert_awaited_once()
+        assert stream_engine._producer is not None
+        assert stream_engine._producer_loop is stream_engine.loop
+
+
+def test_loop_producer_stopped_when_loop_closes(
+    stream_engine: StreamEngine, record_metadata: RecordMetadata
+):
+    async def send(*args, **kwargs):
+        return asyncio.ensure_future(asyncio.sleep(0, result=record_metadata))
+
+    with mock.patch.multiple(
+        aiokafka.AIOKafkaProducer,
+        start=mock.DEFAULT,
+        stop=mock.DEFAULT,
+        send=send,
+    ) as mocks:
+        stream_engine.sync_send(topic, value=value)
+
+        # `asyncio.run` cancels the pending tasks before closing the loop
+        asyncio.run(stream_engine.send(topic, value=value))
+        mocks["stop"].assert_awaited_once()
+        assert not stream_engine._loop_producers
+        assert list(stream_engine._loop_locks) == [id(stream_engine.loop)]
+
+        # a loop closed without shutting down is forgotten
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(stream_engine.send(topic, value=value))
+        loop.close()
+        asyncio.run(stream_engine.send(topic, value=value))
+        assert not stream_engine._loop_producers
+        assert list(stream_engine._loop_locks) == [id(stream_engine.loop)]
+
+
+@pytest.mark.asyncio
+async def test_sync_send_in_running_event_loop(stream_engine: StreamEngine):
+    with pytest.raises(RuntimeError, match="running event loop"):
+        stream_engine.sync_send(topic, value=value)
+
+
+def test_sync_send_nowait(stream_engine: StreamEngine, record_metadata: RecordMetadata):
+    acked = threading.Event()
+
+    async def send(*args, **kwargs):
+        async def wait_for_ack():
+            await asyncio.get_running_loop().run_in_executor(None, acked.wait)
+            return record_metadata
+
+        return asyncio.ensure_future(wait_for_ack())
+
+    on_success = mock.Mock()
+    on_error = mock.Mock()
+
+    with mock.patch.multiple(
+        aiokafka.AIOKafkaProducer, start=mock.DEFAULT, stop=mock.DEFAULT, send=send
+    ):
+        try:
+            future = stream_engine.sync_send_nowait(
+                topic,
+                value=value,
+                key=key,
+                on_success=on_success,
+                on_error=on_error,
+            )
+
+            # the record is queued but not acked yet
+            assert not future.done()
+            on_success.assert_not_called()
+
+            acked.set()
+            assert future.result(timeout=1) == record_metadata
+        finally:
+            stream_engine.stop_producer_thread()
+
+    on_success.assert_called_once_with(record_metadata)
+    on_error.assert_not_called()
+
+
+def test_sync_send_nowait_delivery_error(stream_engine: StreamEngine):
+    error = aiokafka.errors.KafkaTimeoutError()
+
+    async def send(*args, **kwargs):
+        delivery = asyncio.get_running_loop().create_future()
+        delivery.set_exception(error)
+        return delivery
+
+    on_success = mock.Mock()
+    on_error = mock.Mock()
+
+    with mock.patch.multiple(
+        aiokafka.AIOKafkaProducer, start=mock.DEFAULT, stop=mock.DEFAULT, send=send
+    ):
+        try:
+            future = stream_engine.sync_send_nowait(
+                topic, value=value, on_success=on_success, on_error=on_error
+            )
+            assert future.exception(timeout=1) is error
+        finally:
+            stream_engine.stop_producer_thread()
+
+    on_success.assert_not_called()
+    on_error.assert_called_once_with(error)
+
+
+@pytest.mark.asyncio
+async def test_sync_send_nowait_in_running_event_loop(stream_engine: StreamEngine):
+    with pytest.raises(RuntimeError, match="running event loop"):
+        stream_engine.sync_send_nowait(topic, value=value)
+
+    # the producer thread is not started
+    assert stream_engine._producer_thread is None
+
+
+def test_sync_send_nowait_from_callback(
+    stream_engine: StreamEngine, record_metadata: RecordMetadata
+):
+    errors = []
+
+    async def send(*args, **kwargs):
+        delivery = asyncio.get_running_loop().create_future()
+        delivery.set_result(record_metadata)
+        return delivery
+
+    def on_success(metadata):
+        # the callbacks run in the producer loop, waiting for it would deadlock
+        try:
+            stream_engine.sync_send_nowait(topic, value=value)
+        except RuntimeError as exc:
+            errors.append(exc)
+
+    with mock.patch.multiple(
+        aiokafka.AIOKafkaProducer, start=mock.DEFAULT, stop=mock.DEFAULT, send=send
+    ):
+        try:
+            future = stream_engine.sync_send_nowait(
+                topic, value=value, on_success=on_success
+            )
+            assert future.result(timeout=1) == record_metadata
+        finally:
+            stream_engine.stop_producer_thread()
+
+    assert len(errors) == 1
+    assert stream_engine._handoffs == set()
+
+
+@pytest.mark.asyncio
+async def test_send_many(stream_engine: StreamEngine, record_metadata: RecordMetadata):
+    error = aiokafka.errors.KafkaTimeoutError()
+    queued = []
+
+    async def send(producer, topic, **kwargs):
+        queued.append(topic)
+        delivery = asyncio.get_running_loop().create_future()
+        if topic == "failing-topic":
+            delivery.set_exception(error)
+        else:
+            # acks arrive after all the records were queued
+            asyncio.get_running_loop().call_soon(delivery.set_result, record_metadata)
+        return delivery
+
+    with mock.patch.multiple(
+        aiokafka.AIOKafkaProducer, start=mock.DEFAULT, stop=mock.DEFAULT, send=send
+    ):
+        results = await stream_engine.send_many(
+            [
+                Record(topic, value=value, key="1"),
+                ("failing-topic", value),
+                (topic, None, "1", {"kpn-event-type": event_type}),
+            ]
+        )
+
+    assert queued == [topic, "failing-topic", topic]
+    assert results == [record_metadata, error, record_metadata]
+
+
+def test_sync_send_many(stream_engine: StreamEngine, record_metadata: RecordMetadata):
+    send = mock.AsyncMock(
+        side_effect=lambda *args, **kwargs: asyncio.sleep(0, result=record_metadata)
+    )
+    stream_engine.serializer = MySerializer()
+
+    with mock.patch.multiple(
+        aiokafka.AIOKafkaProducer, start=mock.DEFAULT, stop=mock.DEFAULT, send=send
+    ):
+        results = stream_engine.sync_send_many(
+            (topic, {"message": str(i)}, str(i)) for i in range(3)
+        )
+
+    assert results == [record_metadata] * 3
+    send.assert_has_awaits(
+        [
+            mock.call(
+                topic,
+                value=f'{{"message": "{i}"}}'.encode(),
+                key=str(i),
+                partition=None,
+                timestamp_ms=None,
+                headers=None,
+            )
+            for i in range(3)
+        ]
+    )
+
+
 def test_sync_send_tombstone(
     stream_engine: StreamEngine, record_metadata: RecordMetadata
 ):
@@ -436,3 +741,220 @@ async def test_e2e_with_sync_send_no_stream(stream_engine: StreamEngine):
 
         cr = await client.get_event(topic_name=topic)
         assert cr.value == event
+
+
+@pytest.mark.asyncio
+async def test_e2e_with_sync_send_nowait(stream_engine: StreamEngine):
+    event = b'{"message": "Hello world!"}'
+    on_success = mock.Mock()
+
+    async with TestStreamClient(stream_engine=stream_engine) as client:
+        future = stream_engine.sync_send_nowait(
+            topic, value=event, key="1", on_success=on_success
+        )
+        metadata = future.result()
+        assert metadata.topic == topic
+        on_success.assert_called_once_with(metadata)
+
+        cr = await client.get_event(topic_name=topic)
+        assert cr.value == event
+
+
+@pytest.mark.asyncio
+async def test_e2e_with_sync_send_nowait_error(stream_engine: StreamEngine):
+    error = ValueError("can not produce")
+    on_success = mock.Mock()
+    on_error = mock.Mock()
+
+    async with TestStreamClient(stream_engine=stream_engine) as client:
+        with mock.patch.object(client, "sync_send", side_effect=error):
+            future = stream_engine.sync_send_nowait(
+                topic, value=b"{}", on_success=on_success, on_error=on_error
+            )
+
+    assert future.exception() is error
+    on_success.assert_not_called()
+    on_error.assert_called_once_with(error)
+
+
+@pytest.mark.asyncio
+async def test_e2e_with_sync_send_many(stream_engine: StreamEngine):
+    events = [b'{"message": "Hello world!"}', b'{"message": "Hello again!"}']
+
+    async with TestStreamClient(stream_engine=stream_engine) as client:
+        results = stream_engine.sync_send_many((topic, event) for event in events)
+        assert [metadata.offset for metadata in results] == [0, 1]
+
+        for event in events:
+            cr = await client.get_event(topic_name=topic)
+            assert cr.value == event
+
+
+@pytest.mark.django_db(transaction=True)
+def test_send_on_commit(stream_engine: StreamEngine):
+    with mock.patch.object(
+        StreamEngine, "sync_send_many", return_value=[]
+    ) as sync_send_many:
+        with transaction.atomic():
+            stream_engine.send_on_commit(topic, value=b"1", key="1")
+            stream_engine.send_on_commit(topic, value=b"2", key="2")
+            sync_send_many.assert_not_called()
+
+        # all the events are produced as one batch after the commit
+        sync_send_many.assert_called_once_with(
+            [Record(topic, b"1", "1"), Record(topic, b"2", "2")]
+        )
+        sync_send_many.reset_mock()
+
+        with pytest.raises(RuntimeError):
+            with transaction.atomic():
+                stream_engine.send_on_commit(topic, value=b"phantom")
+                raise RuntimeError("Rollback")
+
+        sync_send_many.assert_not_called()
+
+        # outside a transaction the event is produced right away
+        stream_engine.send_on_commit(topic, value=b"3")
+        sync_send_many.assert_called_once_with([Record(topic, b"3")])
+
+
+@pytest.mark.django_db(transaction=True)
+def test_send_on_commit_savepoint_rollback(stream_engine: StreamEngine):
+    with mock.patch.object(
+        StreamEngine, "sync_send_many", return_value=[]
+    ) as sync_send_many:
+        with transaction.atomic():
+            stream_engine.send_on_commit(topic, value=b"1")
+
+            with pytest.raises(RuntimeError):
+                with transaction.atomic():
+                    stream_engine.send_on_commit(topic, value=b"phantom")
+                    raise RuntimeError("Rollback savepoint")
+
+            stream_engine.send_on_commit(topic, value=b"2")
+
+    sync_send_many.assert_called_once_with([Record(topic, b"1"), Record(topic, b"2")])
+
+
+@pytest.mark.django_db(transaction=True)
+def test_send_on_commit_savepoint_order(stream_engine: StreamEngine):
+    with mock.patch.object(
+        StreamEngine, "sync_send_many", return_value=[]
+    ) as sync_send_many:
+        with transaction.atomic():
+            stream_engine.send_on_commit(topic, value=b"A")
+            with transaction.atomic():
+                stream_engine.send_on_commit(topic, value=b"B")
+                with pytest.raises(RuntimeError):
+                    with transaction.atomic():
+                        stream_engine.send_on_commit(topic, value=b"phantom")
+                        raise RuntimeError("Rollback savepoint")
+            stream_engine.send_on_commit(topic, value=b"C")
+            sync_send_many.assert_not_called()
+
+    # the released savepoints are produced with their transaction, in order
+    sync_send_many.assert_called_once_with(
+        [Record(topic, b"A"), Record(topic, b"B"), Record(topic, b"C")]
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+def test_send_on_commit_coalesce_savepoints(stream_engine: StreamEngine):
+    with mock.patch.object(
+        StreamEngine, "sync_send_many", return_value=[]
+    ) as sync_send_many:
+        with transaction.atomic():
+            stream_engine.send_on_commit(topic, value=b"1", key="1", coalesce=True)
+            with transaction.atomic():
+                stream_engine.send_on_commit(topic, value=b"2", key="1", coalesce=True)
+            with pytest.raises(RuntimeError):
+                with transaction.atomic():
+                    stream_engine.send_on_commit(
+                        topic, value=b"phantom", key="1", coalesce=True
+                    )
+                    raise RuntimeError("Rollback savepoint")
+
+        sync_send_many.assert_called_once_with([Record(topic, b"2", "1")])
+        sync_send_many.reset_mock()
+
+        # a rolled back transaction does not leak into the next one
+        with pytest.raises(RuntimeError):
+            with transaction.atomic():
+                stream_engine.send_on_commit(topic, value=b"phantom")
+                raise RuntimeError("Rollback")
+
+        with transaction.atomic():
+            stream_engine.send_on_commit(topic, value=b"3")
+
+    sync_send_many.assert_called_once_with([Record(topic, b"3")])
+
+
+@pytest.mark.django_db(transaction=True)
+def test_send_on_commit_without_commit_hooks(stream_engine: StreamEngine):
+    with mock.patch.object(
+        StreamEngine, "sync_send_many", return_value=[]
+    ) as sync_send_many, mock.patch(
+        "django_streams.engine._has_commit_hooks", return_value=False
+    ):
+        with transaction.atomic():
+            stream_engine.send_on_commit(topic, value=b"A")
+            with pytest.raises(RuntimeError):
+                with transaction.atomic():
+                    stream_engine.send_on_commit(topic, value=b"phantom")
+                    raise RuntimeError("Rollback savepoint")
+            stream_engine.send_on_commit(topic, value=b"B")
+            sync_send_many.assert_not_called()
+
+    # each event is produced on commit as its own batch
+    assert sync_send_many.call_args_list == [
+        mock.call([Record(topic, b"A")]),
+        mock.call([Record(topic, b"B")]),
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_has_commit_hooks():
+    connection = transaction.get_connection()
+    with transaction.atomic():
+        transaction.on_commit(lambda: None)
+        assert _has_commit_hooks(connection)
+
+    assert not _has_commit_hooks(mock.Mock(run_on_commit=[(None, None)]))
+    assert not _has_commit_hooks(object())
+
+
+@pytest.mark.django_db(transaction=True)
+def test_send_on_commit_delivery_error(stream_engine: StreamEngine, caplog):
+    error = RuntimeError("Broker not available")
+
+    with mock.patch.object(StreamEngine, "sync_send_many", return_value=[error]):
+        with transaction.atomic():
+            stream_engine.send_on_commit(topic, value=b"1", key="1")
+
+    assert "could not be produced after commit" in caplog.text
+
+
+@pytest.mark.django_db(transaction=True)
+def test_send_on_commit_coalesce(stream_engine: StreamEngine):
+    with mock.patch.object(
+        StreamEngine, "sync_send_many", return_value=[]
+    ) as sync_send_many:
+        with transaction.atomic():
+            stream_engine.send_on_commit(topic, value=b"1", key="1", coalesce=True)
+            stream_engine.send_many_on_commit(
+                [(topic, b"2", "2"), (topic, b"3", None), (topic, b"4", None)],
+                coalesce=True,
+            )
+            with transaction.atomic(savepoint=False):
+                stream_engine.send_on_commit(topic, value=b"5", key="1", coalesce=True)
+
+    # the last event per key, in the position of the first one,
+    # and all the events without key
+    sync_send_many.assert_called_once_with(
+        [
+            Record(topic, b"5", "1"),
+            Record(topic, b"2", "2"),
+            Record(topic, b"3"),
+            Record(topic, b"4"),
+        ]
+    )
@@ -0,0 +1,209 @@
+import asyncio
+import datetime
+from typing import List
+from unittest import mock
+
+import pytest
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.management import call_command
+from django.utils import timezone
+from kstreams import ConsumerRecord, TopicPartition, middleware
+from prometheus_client import REGISTRY
+
+from django_streams import idempotency
+from django_streams.engine import StreamEngine
+from django_streams.idempotency import (
+    CacheStore,
+    DatabaseStore,
+    IdempotencyMiddleware,
+    LRUSet,
+)
+from django_streams.models import ProcessedRecord
+from django_streams.test_utils.test_client import TestStreamClient
+
+topic = "dev-kpn-des--hello-idempotency"
+
+
+def consumer_record(offset: int, headers=()) -> ConsumerRecord:
+    return ConsumerRecord(topic, 0, offset, 0, 0, None, b"Hi", None, 0, 2, headers)
+
+
+def create_middleware(store, **kwargs) -> IdempotencyMiddleware:
+    stream = mock.Mock(config={"group_id": "hello-group"}, rebalance_listener=None)
+    stream.name = "hello-idempotency"
+    return IdempotencyMiddleware(
+        store=store,
+        next_call=mock.AsyncMock(),
+        send=mock.AsyncMock(),
+        stream=stream,
+        **kwargs,
+    )
+
+
+def processed_offsets(idempotent: IdempotencyMiddleware) -> List[int]:
+    return [call.args[0].offset for call in idempotent.next_call.await_args_list]
+
+
+def test_lru_set():
+    keys = LRUSet(maxsize=2)
+    keys.add("a")
+    keys.add("b")
+    assert "a" in keys
+    keys.add("c")
+
+    # `b` was the least recently used
+    assert "b" not in keys
+    assert "a" in keys and "c" in keys
+    assert len(keys) == 2
+
+
+def test_header_key():
+    key = idempotency.header_key("event-id")
+
+    assert key(consumer_record(5, [("event-id", b"a1")])) == "a1"
+    assert key(consumer_record(5)) == f"{topic}:0:5"
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.asyncio
+async def test_database_store_after_rebalance():
+    store = DatabaseStore()
+    with mock.patch.object(store, "get_processed", wraps=store.get_processed) as get:
+        idempotent = create_middleware(store, prefetch=10, flush_size=100)
+        for offset in range(3):
+            await idempotent(consumer_record(offset))
+
+        # one lookup for the next 10 offsets
+        assert get.call_count == 1
+        assert not await sync_to_async(ProcessedRecord.objects.exists)()
+
+        listener = idempotent.stream.rebalance_listener
+        await listener.on_partitions_revoked({TopicPartition(topic, 0)})
+        assert await sync_to_async(ProcessedRecord.objects.count)() == 3
+
+    # the partition is assigned to another worker, which did not commit
+    other = create_middleware(DatabaseStore(), prefetch=10)
+    for offset in range(1, 5):
+        await other(consumer_record(offset))
+
+    assert processed_offsets(other) == [3, 4]
+    assert REGISTRY.get_sample_value(
+        "django_streams_records_duplicated_total", {"stream": "hello-idempotency"}
+    )
+
+
+@pytest.mark.asyncio
+async def test_cache_store_header_key():
+    cache.clear()
+    idempotent = create_middleware(
+        CacheStore(), key=idempotency.header_key("event-id"), flush_size=2
+    )
+    # the same event produced twice
+    await idempotent(consumer_record(0, [("event-id", b"a1")]))
+    await idempotent(consumer_record(1, [("event-id", b"a1")]))
+    await idempotent(consumer_record(2, [("event-id", b"b2")]))
+    assert processed_offsets(idempotent) == [0, 2]
+
+    # a failure is not remembered, so the record is processed again
+    idempotent.next_call.side_effect = ValueError
+    with pytest.raises(ValueError):
+        await idempotent(consumer_record(3, [("event-id", b"c3")]))
+    idempotent.next_call.side_effect = None
+
+    other = create_middleware(CacheStore(), key=idempotency.header_key("event-id"))
+    for offset, event_id in enumerate((b"a1", b"b2", b"c3")):
+        await other(consumer_record(offset, [("event-id", event_id)]))
+    assert processed_offsets(other) == [2]
+
+
+@pytest.mark.asyncio
+async def test_flush_interval():
+    store = mock.Mock(spec=idempotency.IdempotencyStore)
+    store.get_processed.return_value = set()
+    store.add.side_effect = [ConnectionError, None]
+    idempotent = create_middleware(store, flush_interval=0.01)
+
+    await idempotent(consumer_record(0))
+    store.add.assert_not_called()
+    await asyncio.sleep(0.05)
+
+    # the keys that could not be added are added in the next flush
+    await idempotent(consumer_record(1))
+    await asyncio.sleep(0.05)
+    keys = [f"hello-group:{topic}:0:{offset}" for offset in range(2)]
+    assert store.add.call_args_list == [mock.call(keys[:1]), mock.call(keys)]
+
+
+@pytest.mark.asyncio
+async def test_idempotent_stream(stream_engine: StreamEngine):
+    cache.clear()
+    consumed = []
+
+    @stream_engine.stream(
+        topic,
+        name="hello-idempotency",
+        middlewares=[
+            middleware.Middleware(
+                IdempotencyMiddleware,
+                store=CacheStore(),
+                key=idempotency.header_key("event-id"),
+            )
+        ],
+    )
+    async def consume(cr: ConsumerRecord):
+        consumed.append(cr.value)
+
+    async with TestStreamClient(stream_engine=stream_engine) as client:
+        for value, event_id in ((b"1", "a1"), (b"2", "a1"), (b"3", "b2")):
+            await client.send(topic, value=value, headers={"event-id": event_id})
+
+    assert consumed == [b"1", b"3"]
+
+
+@pytest.mark.asyncio
+async def test_flush_on_stop(stream_engine: StreamEngine):
+    cache.clear()
+
+    @stream_engine.stream(
+        topic,
+        name="hello-idempotency",
+        middlewares=[
+            middleware.Middleware(
+                IdempotencyMiddleware, store=CacheStore(), flush_interval=60
+            )
+        ],
+    )
+    async def consume(cr: ConsumerRecord):
+        pass
+
+    async with TestStreamClient(stream_engine=stream_engine) as client:
+        await client.send(topic, value=b"1", partition=0)
+        keys = [f"hello-idempotency:{topic}:0:0"]
+        assert CacheStore().get_processed(keys) == set()
+
+    # the pending keys are written when the stream stops
+    assert CacheStore().get_processed(keys) == set(keys)
+
+
+def test_store_is_abstract():
+    with pytest.raises(TypeError):
+        idempotency.IdempotencyStore()
+
+
+@pytest.mark.django_db
+def test_expire_processed_records():
+    now = timezone.now()
+    ProcessedRecord.objects.bulk_create(
+        [
+            ProcessedRecord(key="a", expires_at=now - datetime.timedelta(minutes=1)),
+            ProcessedRecord(key="b", expires_at=now - datetime.timedelta(days=1)),
+            ProcessedRecord(key="c", expires_at=now + datetime.timedelta(days=1)),
+        ]
+    )
+
+    with mock.patch("sys.stdout.write") as write:
+        call_command("expire_processed_records", "--batch-size", "1")
+
+    write.assert_called_once_with("Expired 2 processed records\n")
+    assert list(ProcessedRecord.objects.values_list("key", flat=True)) == ["c"]
@@ -0,0 +1,288 @@
+import asyncio
+import json
+from typing import Dict, Iterable, List, Optional, Set
+from unittest import mock
+
+import pytest
+from aiokafka.admin import AIOKafkaAdminClient
+from aiokafka.structs import OffsetAndMetadata
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from kstreams import ConsumerRecord, Stream, TopicPartition
+from kstreams.exceptions import BackendNotSet
+from prometheus_client import REGISTRY
+
+from django_streams.engine import StreamEngine
+from django_streams.lag import LagExporter, PartitionLag, create_admin, get_lag
+
+topic = "dev-kpn-des--hello-lag"
+
+
+class FakeConsumer:
+    """
+    Consumer with the offsets of a cluster in memory
+    """
+
+    def __init__(
+        self,
+        end_offsets: Dict[TopicPartition, int],
+        *,
+        assignment: Set[TopicPartition] = frozenset(),
+    ) -> None:
+        self._end_offsets = end_offsets
+        self._assignment = set(assignment)
+        self.started = self.stopped = False
+
+    async def start(self):
+        self.started = True
+
+    async def stop(self):
+        self.stopped = True
+
+    def assignment(self) -> Set[TopicPartition]:
+        return self._assignment
+
+    async def end_offsets(self, partitions):
+        return {tp: self._end_offsets[tp] for tp in partitions}
+
+    async def beginning_offsets(self, partitions):
+        return {tp: 2 for tp in partitions}
+
+
+class FakeAdmin:
+    """
+    Admin client of a cluster with the topics and the committed offsets
+    of the consumer groups in memory
+    """
+
+    def __init__(
+        self,
+        partitions: Iterable[TopicPartition],
+        committed: Dict[str, Dict[TopicPartition, int]],
+    ) -> None:
+        self._partitions = sorted(partitions)
+        self._committed = committed
+        self.offset_requests = 0
+        self.started = self.closed = False
+
+    async def start(self):
+        self.started = True
+
+    async def close(self):
+        self.closed = True
+
+    async def list_topics(self) -> List[str]:
+        return sorted({tp.topic for tp in self._partitions})
+
+    async def describe_topics(self, topics: List[str]) -> List[Dict]:
+        return [
+            {
+                "topic": topic,
+                "partitions": [
+                    {"partition": tp.partition}
+                    for tp in self._partitions
+                    if tp.topic == topic
+                ],
+            }
+            for topic in topics
+        ]
+
+    async def list_consumer_group_offsets(self, group_id: str, partitions):
+        self.offset_requests += 1
+        committed = self._committed.get(group_id, {})
+        return {tp: OffsetAndMetadata(committed.get(tp, -1), "") for tp in partitions}
+
+
+def sample(partition: int, consumer_group: str = "hello-group") -> Optional[float]:
+    return REGISTRY.get_sample_value(
+        "django_streams_consumer_lag",
+        {"consumer_group": consumer_group, "topic": topic, "partition": str(partition)},
+    )
+
+
+@pytest.fixture
+def consumer() -> FakeConsumer:
+    return FakeConsumer(
+        end_offsets={
+            TopicPartition(topic, 0): 20,
+            TopicPartition(topic, 1): 10,
+            TopicPartition(topic, 2): 5,
+            TopicPartition("dev-kpn-des--bye-kpn", 0): 4,
+        },
+        assignment={TopicPartition(topic, 0), TopicPartition(topic, 2)},
+    )
+
+
+@pytest.fixture
+def admin(consumer: FakeConsumer) -> FakeAdmin:
+    return FakeAdmin(
+        consumer._end_offsets,
+        committed={
+            "hello-group": {TopicPartition(topic, 0): 5, TopicPartition(topic, 1): 10}
+        },
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_lag(consumer: FakeConsumer, admin: FakeAdmin):
+    assert await get_lag(consumer, admin, "hello-group") == [
+        PartitionLag("hello-group", topic, 0, end_offset=20, committed=5, lag=15),
+        # not committed yet, the lag starts from the beginning of the partition
+        PartitionLag("hello-group", topic, 2, end_offset=5, committed=None, lag=3),
+    ]
+    # the committed offsets of all the partitions are fetched at once
+    assert admin.offset_requests == 1
+
+    assert await get_lag(
+        consumer, admin, "hello-group", [TopicPartition(topic, 1)]
+    ) == [
+        PartitionLag("hello-group", topic, 1, end_offset=10, committed=10, lag=0),
+    ]
+    assert await get_lag(consumer, admin, None, [TopicPartition(topic, 1)]) == [
+        PartitionLag(None, topic, 1, end_offset=10, committed=None, lag=8),
+    ]
+
+    consumer._assignment = set()
+    assert await get_lag(consumer, admin, "hello-group") == []
+
+
+@pytest.mark.asyncio
+async def test_lag_exporter(
+    stream_engine: StreamEngine, consumer: FakeConsumer, admin: FakeAdmin
+):
+    @stream_engine.stream(topic, name="hello-lag", group_id="hello-group")
+    async def consume(cr: ConsumerRecord):
+        pass
+
+    exporter = LagExporter(interval=0.01)
+    create_admin = mock.patch("django_streams.lag.create_admin", return_value=admin)
+    create_admin.start()
+    exporter.start(stream_engine._streams)
+    await asyncio.sleep(0.02)
+    # the stream is not running
+    assert sample(0) is None
+
+    consume.consumer = consumer
+    consume.running = True
+    await asyncio.sleep(0.05)
+    assert sample(0) == 15
+    assert sample(2) == 3
+
+    # the partition 0 is assigned to another worker after a rebalance
+    consumer._assignment = {TopicPartition(topic, 2)}
+    await exporter.export()
+    assert sample(0) is None
+    assert sample(2) == 3
+
+    await exporter.stop()
+    create_admin.stop()
+    assert sample(2) is None
+    assert admin.closed
+    consume.consumer = None
+    consume.running = False
+
+
+@pytest.mark.asyncio
+async def test_engine_starts_lag_exporter(stream_engine: StreamEngine):
+    exporter = LagExporter()
+    stream_engine.lag_exporter = exporter
+
+    with (
+        mock.patch.object(exporter, "start") as start,
+        mock.patch.object(exporter, "stop") as stop,
+    ):
+        await stream_engine.start_streams()
+
+    start.assert_called_once_with(stream_engine._streams)
+    stop.assert_awaited_once()
+
+
+def test_stream_lag_command(
+    stream_engine: StreamEngine, consumer: FakeConsumer, admin: FakeAdmin, capsys
+):
+    @stream_engine.stream(topic, name="hello-lag", group_id="hello-group")
+    async def consume(cr: ConsumerRecord):
+        pass
+
+    @stream_engine.stream(
+        "dev-kpn-des--bye-.*",
+        name="bye-lag",
+        group_id="bye-group",
+        subscribe_by_pattern=True,
+    )
+    async def consume_bye(cr: ConsumerRecord):
+        pass
+
+    with (
+        mock.patch.object(Stream, "_create_consumer", return_value=consumer),
+        mock.patch("django_streams.lag.create_admin", return_value=admin),
+    ):
+        call_command("stream_lag")
+
+    assert json.loads(capsys.readouterr().out) == {
+        "lag": 20,
+        "groups": [
+            {
+                "consumer_group": "hello-group",
+                "topic": topic,
+                "lag": 18,
+                "partitions": [
+                    {"partition": 0, "end_offset": 20, "committed": 5, "lag": 15},
+                    {"partition": 1, "end_offset": 10, "committed": 10, "lag": 0},
+                    {"partition": 2, "end_offset": 5, "committed": None, "lag": 3},
+                ],
+            },
+            {
+                "consumer_group": "bye-group",
+                "topic": "dev-kpn-des--bye-kpn",
+                "lag": 2,
+                "partitions": [
+                    {"partition": 0, "end_offset": 4, "committed": None, "lag": 2},
+                ],
+            },
+        ],
+    }
+    assert consumer.stopped and admin.closed
+
+
+def test_stream_lag_select_streams(
+    stream_engine: StreamEngine, consumer: FakeConsumer, capsys
+):
+    @stream_engine.stream(topic, name="hello-lag", group_id="hello-group")
+    async def consume(cr: ConsumerRecord):
+        pass
+
+    @stream_engine.stream("dev-kpn-des--bye-kpn", name="bye-lag")
+    async def consume_bye(cr: ConsumerRecord):
+        pass
+
+    admin = FakeAdmin(
+        [TopicPartition(topic, 0)],
+        committed={"hello-group": {TopicPartition(topic, 0): 5}},
+    )
+    with (
+        mock.patch.object(
+            Stream, "_create_consumer", return_value=consumer
+        ) as create_consumer,
+        mock.patch("django_streams.lag.create_admin", return_value=admin),
+    ):
+        call_command("stream_lag", "--streams", "hello-lag", "--indent", "2")
+
+    create_consumer.assert_called_once()
+    assert json.loads(capsys.readouterr().out)["lag"] == 15
+
+    with pytest.raises(CommandError):
+        call_command("stream_lag", "--streams", "unknown")
+
+
+@pytest.mark.asyncio
+async def test_create_admin(stream_engine: StreamEngine):
+    @stream_engine.stream(topic, name="hello-lag")
+    async def consume(cr: ConsumerRecord):
+        pass
+
+    assert isinstance(create_admin(consume), AIOKafkaAdminClient)
+
+    consume.backend = None
+    with pytest.raises(BackendNotSet):
+        create_admin(consume)
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import time
+from unittest import mock
+
+import pytest
+from django.core.management import call_command
+from prometheus_client import REGISTRY
+
+from django_streams.engine import StreamEngine
+from django_streams.loop_monitor import LoopMonitor
+
+
+def sample(name: str) -> float:
+    return REGISTRY.get_sample_value(name) or 0
+
+
+def blocking_orm_call():
+    time.sleep(0.2)
+
+
+@pytest.mark.asyncio
+async def test_detect_blocking_call(caplog):
+    caplog.set_level(logging.WARNING)
+    blocked = sample("django_streams_event_loop_blocked_total")
+    lags = sample("django_streams_event_loop_lag_seconds_count")
+    monitor = LoopMonitor(threshold=0.05, interval=0.01)
+
+    async def consume():
+        blocking_orm_call()
+
+    monitor.start()
+    await asyncio.sleep(0.05)
+    await asyncio.ensure_future(consume())
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+
+    # logged once, with the stack of the blocking code
+    assert sample("django_streams_event_loop_blocked_total") == blocked + 1
+    assert "Event loop blocked for more than" in caplog.text
+    assert "consume" in caplog.text
+    assert "blocking_orm_call" in caplog.text
+    assert sample("django_streams_event_loop_lag_seconds_count") > lags
+    assert asyncio.get_running_loop().slow_callback_duration == 0.05
+
+
+@pytest.mark.asyncio
+async def test_not_blocking(caplog):
+    blocked = sample("django_streams_event_loop_blocked_total")
+    monitor = LoopMonitor(threshold=0.5, interval=0.01)
+
+    monitor.start()
+    # started only once
+    monitor.start()
+    for _ in range(10):
+        await asyncio.sleep(0.01)
+    await monitor.stop()
+    await monitor.stop()
+
+    assert sample("django_streams_event_loop_blocked_total") == blocked
+    assert "Event loop blocked" not in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_engine_starts_loop_monitor(stream_engine: StreamEngine):
+    monitor = LoopMonitor()
+    stream_engine.loop_monitor = monitor
+
+    with (
+        mock.patch.object(monitor, "start") as start,
+        mock.patch.object(monitor, "stop") as stop,
+    ):
+        await stream_engine.start_streams()
+
+    start.assert_called_once()
+    stop.assert_awaited_once()
+
+
+def test_worker_detect_blocking(stream_engine: StreamEngine):
+    with mock.patch.object(StreamEngine, "sync_start"):
+        call_command("worker", "--detect-blocking")
+        assert stream_engine.loop_monitor is not None
+        assert stream_engine.loop_monitor.threshold == 0.1
+
+        call_command("worker", "--detect-blocking", "0.5")
+        assert stream_engine.loop_monitor.threshold == 0.5
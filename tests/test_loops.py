@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import sys
+from unittest import mock
+
+import aiokafka
+import pytest
+from django.core.management import call_command
+from kstreams.test_utils.structs import RecordMetadata
+
+from django_streams import loops
+from django_streams.engine import Singleton, StreamEngine
+from django_streams.factories import create_engine_from_settings
+
+try:
+    import uvloop
+except ImportError:  # pragma: no cover
+    uvloop = None
+
+requires_uvloop = pytest.mark.skipif(uvloop is None, reason="uvloop is not installed")
+
+
+def test_get_loop_factory():
+    assert loops.get_loop_factory() is asyncio.new_event_loop
+    assert loops.get_loop_factory("asyncio") is asyncio.new_event_loop
+
+    with pytest.raises(ValueError, match="Unknown event loop trio"):
+        loops.get_loop_factory("trio")
+
+
+@requires_uvloop
+def test_get_uvloop_factory():
+    assert loops.get_loop_factory("uvloop") is uvloop.new_event_loop
+
+
+def test_uvloop_not_installed(caplog):
+    caplog.set_level(logging.WARNING)
+
+    with mock.patch.dict(sys.modules, {"uvloop": None}):
+        assert loops.get_loop_factory("uvloop") is asyncio.new_event_loop
+
+    assert "uvloop is not installed" in caplog.text
+
+
+@requires_uvloop
+def test_run():
+    async def main():
+        pending = asyncio.ensure_future(asyncio.sleep(10))
+        return asyncio.get_running_loop(), pending
+
+    loop, pending = loops.run(main(), loop_factory=uvloop.new_event_loop)
+
+    assert isinstance(loop, uvloop.Loop)
+    assert loop.is_closed()
+    assert pending.cancelled()
+
+    loop, _ = loops.run(main())
+    assert not isinstance(loop, uvloop.Loop)
+
+
+@requires_uvloop
+def test_sync_send_loop(stream_engine: StreamEngine, record_metadata: RecordMetadata):
+    stream_engine._loop = None
+    stream_engine.loop_factory = uvloop.new_event_loop
+
+    async def send(*args, **kwargs):
+        assert isinstance(asyncio.get_running_loop(), uvloop.Loop)
+        return asyncio.ensure_future(asyncio.sleep(0, result=record_metadata))
+
+    try:
+        with mock.patch.multiple(
+            aiokafka.AIOKafkaProducer, start=mock.DEFAULT, stop=mock.DEFAULT, send=send
+        ):
+            assert stream_engine.sync_send("local--hello-world", value=b"Hi") == (
+                record_metadata
+            )
+    finally:
+        stream_engine.loop.close()
+        stream_engine._loop = None
+
+
+@requires_uvloop
+def test_sync_start_loop(stream_engine: StreamEngine):
+    stream_engine.loop_factory = uvloop.new_event_loop
+
+    async def start():
+        assert isinstance(asyncio.get_running_loop(), uvloop.Loop)
+
+    with mock.patch.object(stream_engine, "start", start):
+        stream_engine.sync_start()
+
+
+@requires_uvloop
+def test_event_loop_setting(settings):
+    settings.DJANGO_STREAMS = {"TITLE": "settings-engine", "EVENT_LOOP": "uvloop"}
+
+    with mock.patch.dict(Singleton._instances, clear=True):
+        engine = create_engine_from_settings()
+
+    assert engine.loop_factory is uvloop.new_event_loop
+
+
+@requires_uvloop
+def test_worker_loop(stream_engine: StreamEngine):
+    with mock.patch.object(StreamEngine, "sync_start"):
+        call_command("worker")
+        assert stream_engine.loop_factory is asyncio.new_event_loop
+
+        call_command("worker", "--loop", "uvloop")
+        assert stream_engine.loop_factory is uvloop.new_event_loop
@@ -0,0 +1,114 @@
+import signal
+from unittest import mock
+
+import pytest
+from aiokafka.coordinator.assignors.roundrobin import RoundRobinPartitionAssignor
+from aiokafka.coordinator.assignors.sticky.sticky_assignor import (
+    StickyPartitionAssignor,
+)
+from django.core.management import call_command
+from kstreams import ConsumerRecord, Stream
+
+from django_streams import membership
+from django_streams.engine import Singleton, StreamEngine
+from django_streams.factories import create_engine_from_settings
+
+
+def test_get_assignors():
+    assert membership.get_assignors("sticky") == (
+        StickyPartitionAssignor,
+        RoundRobinPartitionAssignor,
+    )
+    with pytest.raises(ValueError, match="Unknown partition assignor cooperative"):
+        membership.get_assignors("cooperative")
+
+
+def test_get_instance_name(monkeypatch):
+    monkeypatch.setenv("POD_NAME", "worker-0")
+    assert membership.get_instance_name() == "worker-0"
+
+    monkeypatch.delenv("POD_NAME")
+    with mock.patch("socket.gethostname", return_value="worker-7d9f"):
+        assert membership.get_instance_name() == "worker-7d9f"
+
+
+@pytest.mark.asyncio
+async def test_static_membership(stream_engine: StreamEngine):
+    @stream_engine.stream("dev-kpn-des--hello-kpn", group_id="hello-group")
+    async def hello(cr: ConsumerRecord):
+        pass
+
+    # without group there is no membership
+    @stream_engine.stream("dev-kpn-des--bye-kpn")
+    async def bye(cr: ConsumerRecord):
+        pass
+
+    @stream_engine.stream(
+        "dev-kpn-des--order-kpn", group_id="order-group", group_instance_id="orders"
+    )
+    async def orders(cr: ConsumerRecord):
+        pass
+
+    stream_engine.group_instance_id = "worker-0"
+    stream_engine.partition_assignor = "sticky"
+
+    with mock.patch.object(Stream, "start"):
+        await stream_engine.start_streams()
+
+    consumers = [stream._create_consumer() for stream in (hello, bye, orders)]
+    assert consumers[0]._group_instance_id == "worker-0-0"
+    assert consumers[1]._group_instance_id is None
+    # the options of the stream are kept
+    assert consumers[2]._group_instance_id == "orders"
+    for consumer in consumers:
+        assert consumer._partition_assignment_strategy == (
+            StickyPartitionAssignor,
+            RoundRobinPartitionAssignor,
+        )
+
+
+def test_membership_settings(settings, monkeypatch):
+    monkeypatch.setenv("POD_NAME", "worker-0")
+    settings.DJANGO_STREAMS = {
+        "TITLE": "settings-engine",
+        "STATIC_MEMBERSHIP": True,
+        "PARTITION_ASSIGNOR": "sticky",
+    }
+
+    with mock.patch.dict(Singleton._instances, clear=True):
+        engine = create_engine_from_settings()
+
+    assert engine.group_instance_id == "worker-0"
+    assert engine.partition_assignor == "sticky"
+
+
+def test_worker_static_membership(stream_engine: StreamEngine, monkeypatch):
+    monkeypatch.setenv("POD_NAME", "worker-0")
+
+    with mock.patch.object(StreamEngine, "sync_start"):
+        call_command("worker", "--static-membership", "--assignor", "sticky")
+        assert stream_engine.group_instance_id == "worker-0"
+        assert stream_engine.partition_assignor == "sticky"
+
+        call_command("worker", "--static-membership", "orders-worker")
+        assert stream_engine.group_instance_id == "orders-worker"
+
+
+def test_worker_processes_static_membership(stream_engine: StreamEngine):
+    with (
+        mock.patch(
+            "django_streams.management.commands.worker.Supervisor"
+        ) as supervisor_class,
+        mock.patch.object(StreamEngine, "sync_start"),
+    ):
+        call_command("worker", "--processes", "2", "--static-membership", "worker-0")
+
+        target, _ = supervisor_class.call_args[0]
+        previous_handler = signal.getsignal(signal.SIGTERM)
+        try:
+            target(1)
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
+
+    # each process is another member
+    assert stream_engine.group_instance_id == "worker-0-1"
@@ -0,0 +1,149 @@
+import asyncio
+from typing import List
+from unittest import mock
+
+import aiokafka
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from kstreams import ConsumerRecord
+from kstreams.test_utils.structs import RecordMetadata
+from prometheus_client import REGISTRY
+
+from django_streams import metrics
+from django_streams.engine import StreamEngine
+from django_streams.serializers import JsonSerializer
+from django_streams.test_utils.test_client import TestStreamClient
+
+topic = "dev-kpn-des--hello-metrics"
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_sync_send_metrics(
+    stream_engine: StreamEngine, record_metadata: RecordMetadata
+):
+    stream_engine.serializer = JsonSerializer()
+
+    async def send(*args, **kwargs):
+        return asyncio.ensure_future(asyncio.sleep(0, result=record_metadata))
+
+    sends = sample("django_streams_sync_send_seconds_count", method="sync_send")
+    lock_waits = sample("django_streams_sync_lock_wait_seconds_count")
+    serializations = sample(
+        "django_streams_serialization_seconds_count", operation="serialize"
+    )
+
+    with mock.patch.multiple(
+        aiokafka.AIOKafkaProducer, start=mock.DEFAULT, stop=mock.DEFAULT, send=send
+    ):
+        stream_engine.sync_send(topic, value={"message": "Hi KPN"})
+        stream_engine.sync_send_many([(topic, {"message": "Hi KPN"})])
+
+    assert sample("django_streams_sync_send_seconds_count", method="sync_send") == (
+        sends + 1
+    )
+    assert sample("django_streams_sync_send_seconds_count", method="sync_send_many")
+    assert sample("django_streams_sync_lock_wait_seconds_count") == lock_waits + 2
+    assert (
+        sample("django_streams_serialization_seconds_count", operation="serialize")
+        == serializations + 2
+    )
+    assert sample("django_streams_producer_in_flight_requests") == 0
+
+
+@pytest.mark.asyncio
+async def test_producer_in_flight_requests(
+    stream_engine: StreamEngine, record_metadata: RecordMetadata
+):
+    delivery: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    async def send(*args, **kwargs):
+        return delivery
+
+    with mock.patch.multiple(
+        aiokafka.AIOKafkaProducer, start=mock.DEFAULT, stop=mock.DEFAULT, send=send
+    ):
+        task = asyncio.ensure_future(stream_engine.send(topic, value=b"Hi KPN"))
+        await asyncio.sleep(0)
+        assert sample("django_streams_producer_in_flight_requests") == 1
+
+        delivery.set_result(record_metadata)
+        assert await task == record_metadata
+        assert sample("django_streams_producer_in_flight_requests") == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_metrics(stream_engine: StreamEngine):
+    processed = asyncio.Event()
+
+    @stream_engine.stream(topic, name="hello-metrics")
+    async def consume(cr: ConsumerRecord):
+        if cr.offset == 1:
+            processed.set()
+
+    async with TestStreamClient(stream_engine=stream_engine) as client:
+        await client.send(topic, value=b"Hi", partition=0)
+        await client.send(topic, value=b"KPN", partition=0)
+        await asyncio.wait_for(processed.wait(), timeout=1)
+
+    assert sample("django_streams_records_processed_total", stream="hello-metrics") == 2
+    assert sample("django_streams_handler_seconds_count", stream="hello-metrics") == 2
+
+
+@pytest.mark.asyncio
+async def test_batch_stream_metrics(stream_engine: StreamEngine):
+    @stream_engine.batch_stream(topic, name="hello-batch-metrics")
+    def consume_batch(records: List[ConsumerRecord]):
+        pass
+
+    await consume_batch.func([mock.Mock(), mock.Mock(), mock.Mock()])
+
+    labels = {"stream": "hello-batch-metrics"}
+    assert sample("django_streams_records_processed_total", **labels) == 3
+    assert sample("django_streams_handler_seconds_count", **labels) == 1
+    assert sample(
+        "django_streams_sync_to_async_wait_seconds_count",
+        function="test_batch_stream_metrics.<locals>.consume_batch",
+    )
+
+
+@pytest.mark.asyncio
+async def test_sync_to_async():
+    def add(a: int, b: int) -> int:
+        return a + b
+
+    assert await metrics.sync_to_async(add, name="add")(1, b=2) == 3
+    assert sample("django_streams_sync_to_async_wait_seconds_count", function="add")
+
+
+def test_metrics_view(rf):
+    response = metrics.metrics_view(rf.get("/metrics"))
+
+    assert response.status_code == 200
+    assert b"django_streams_sync_send_seconds" in response.content
+
+
+def test_multiprocess_registry(tmp_path, monkeypatch):
+    assert metrics.get_registry() is REGISTRY
+
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    assert metrics.get_registry() is not REGISTRY
+
+    with mock.patch("prometheus_client.multiprocess.mark_process_dead") as dead:
+        metrics.child_exit(mock.Mock(), mock.Mock(pid=1234))
+        dead.assert_called_once_with(1234)
+
+
+def test_worker_metrics_port(stream_engine: StreamEngine, monkeypatch):
+    with mock.patch.object(metrics, "start_http_server") as start_http_server:
+        with mock.patch.object(StreamEngine, "sync_start"):
+            call_command("worker", "--metrics-port", "9100")
+        start_http_server.assert_called_once_with(9100, addr="0.0.0.0")
+
+        # the parent can only expose the metrics of the children in multiprocess mode
+        monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR", raising=False)
+        with pytest.raises(CommandError, match="PROMETHEUS_MULTIPROC_DIR"):
+            call_command("worker", "--metrics-port", "9100", "--processes", "2")
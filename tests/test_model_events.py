@@ -0,0 +1,115 @@
+import datetime
+import uuid
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+
+from django_streams.engine import Record, StreamEngine
+from django_streams.model_events import ModelEventSerializer
+from tests.testing_app.models import HelloWorld, Order
+
+topic = "dev-kpn-des--orders"
+reference = uuid.UUID("3f1c5e2a-8f4b-4c1e-9a55-7d1e5b8f0c11")
+created_at = datetime.datetime(2024, 1, 2, 3, 4, 5)
+
+
+def create_order(**kwargs) -> Order:
+    return Order.objects.create(
+        **{
+            "reference": reference,
+            "total": Decimal("10.50"),
+            "created_at": created_at,
+            **kwargs,
+        }
+    )
+
+
+@pytest.mark.django_db
+def test_to_dict():
+    hello = HelloWorld.objects.create(message="Hi KPN")
+    order = create_order(delivery_time=datetime.timedelta(days=1), hello=hello)
+    order_events = ModelEventSerializer(Order, topic)
+
+    assert order_events.to_dict(order) == {
+        "id": order.pk,
+        "reference": "3f1c5e2a-8f4b-4c1e-9a55-7d1e5b8f0c11",
+        "total": "10.50",
+        "created_at": "2024-01-02T03:04:05",
+        "delivery_time": "P1DT00H00M00S",
+        "hello_id": hello.pk,
+    }
+
+
+@pytest.mark.django_db
+def test_to_dict_null_values():
+    order = create_order()
+    order_events = ModelEventSerializer(
+        Order, topic, fields=["reference", "delivery_time", "hello"]
+    )
+
+    assert order_events.to_dict(order) == {
+        "reference": "3f1c5e2a-8f4b-4c1e-9a55-7d1e5b8f0c11",
+        "delivery_time": None,
+        "hello_id": None,
+    }
+
+
+@pytest.mark.django_db
+def test_to_record():
+    order = create_order()
+    order_events = ModelEventSerializer(
+        Order,
+        topic,
+        fields=["total"],
+        key_field="reference",
+        headers={"event-type": "order"},
+    )
+
+    assert order_events.to_record(order) == Record(
+        topic,
+        value={"total": "10.50"},
+        key="3f1c5e2a-8f4b-4c1e-9a55-7d1e5b8f0c11",
+        headers={"event-type": "order"},
+    )
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("fields", [None, ["total", "created_at"]], ids=["all", "key"])
+def test_records_from_queryset(fields):
+    for total in range(5):
+        create_order(total=Decimal(total))
+    queryset = Order.objects.order_by("pk")
+    order_events = ModelEventSerializer(Order, topic, fields=fields)
+
+    records = order_events.records(queryset, chunk_size=2)
+
+    # the rows are serialized like the instances, without the key
+    # column when it is not one of the fields
+    assert list(records) == [order_events.to_record(order) for order in queryset]
+
+
+@pytest.mark.django_db
+def test_send_queryset(stream_engine: StreamEngine):
+    for total in range(5):
+        create_order(total=Decimal(total))
+    order_events = ModelEventSerializer(Order, topic, fields=["total"])
+
+    def sync_send_many(records):
+        # the first record of every batch fails
+        return [RuntimeError("Broker not available"), *records[1:]]
+
+    with mock.patch.object(
+        StreamEngine, "sync_send_many", side_effect=sync_send_many
+    ) as send_many:
+        produced = order_events.send_queryset(
+            stream_engine, Order.objects.order_by("pk"), batch_size=2
+        )
+
+    assert produced == 2
+    assert [len(call.args[0]) for call in send_many.call_args_list] == [2, 2, 1]
+    assert [
+        record.value["total"]
+        for call in send_many.call_args_list
+        for record in call.args[0]
+    ] == ["0.00", "1.00", "2.00", "3.00", "4.00"]
@@ -0,0 +1,175 @@
+from unittest import mock
+
+import pytest
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.db import transaction
+from django.utils import timezone
+
+from django_streams import Record, outbox
+from django_streams.engine import StreamEngine
+from django_streams.models import OutboxEvent
+from django_streams.test_utils.test_client import TestStreamClient
+
+topic = "dev-kpn-des--hello-outbox"
+
+
+@pytest.mark.django_db
+def test_send_in_transaction():
+    with transaction.atomic():
+        event = outbox.send(
+            topic, value=b"hello", key="1", headers={"kpn-event-type": "hello"}
+        )
+
+    assert event.as_record() == Record(
+        topic, b"hello", "1", {"kpn-event-type": "hello"}
+    )
+
+    with pytest.raises(RuntimeError):
+        with transaction.atomic():
+            outbox.send(topic, value={"message": "phantom"})
+            raise RuntimeError("Rollback")
+
+    assert list(OutboxEvent.objects.values_list("topic", flat=True)) == [topic]
+
+
+@pytest.mark.django_db
+def test_send_many():
+    outbox.send_many([(topic, b"1", "1"), (topic, {"message": "2"})])
+
+    records = [event.as_record() for event in OutboxEvent.objects.order_by("id")]
+    assert records == [Record(topic, b"1", "1"), Record(topic, {"message": "2"})]
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.asyncio
+async def test_relay(stream_engine: StreamEngine):
+    relay = sync_to_async(outbox.relay)
+    await sync_to_async(outbox.send_many)(
+        [(topic, b"1", "1"), (topic, b"2", "2"), (topic, b"3", "3")]
+    )
+
+    async with TestStreamClient(stream_engine=stream_engine) as client:
+        assert await relay(stream_engine, batch_size=2) == 2
+        assert await relay(stream_engine, batch_size=2) == 1
+        assert await relay(stream_engine, batch_size=2) == 0
+
+        for value in (b"1", b"2", b"3"):
+            cr = await client.get_event(topic_name=topic)
+            assert cr.value == value
+
+    assert not await sync_to_async(OutboxEvent.objects.exists)()
+
+
+@pytest.mark.django_db
+def test_relay_mark_published_and_failures(stream_engine: StreamEngine):
+    outbox.send_many([(topic, b"1"), (topic, b"2")])
+    error = RuntimeError("Broker not available")
+
+    with mock.patch.object(
+        StreamEngine, "sync_send_many", return_value=[mock.Mock(), error]
+    ):
+        assert outbox.relay(stream_engine, delete=False) == 1
+
+    published, failed = OutboxEvent.objects.order_by("id")
+    assert published.published_at is not None
+    assert published.available_at is None
+    assert failed.published_at is None
+    assert failed.attempts == 1
+    assert failed.last_error == "RuntimeError('Broker not available')"
+
+    # the failed event is retried after the backoff
+    assert not outbox.has_pending()
+    OutboxEvent.objects.filter(pk=failed.pk).update(available_at=timezone.now())
+    with mock.patch.object(
+        StreamEngine, "sync_send_many", return_value=[mock.Mock()]
+    ) as sync_send_many:
+        assert outbox.relay(stream_engine, delete=False) == 1
+
+    assert [record.value for record in sync_send_many.call_args[0][0]] == [b"2"]
+
+
+@pytest.mark.django_db
+def test_relay_failures_do_not_block(stream_engine: StreamEngine):
+    outbox.send_many([(topic, b"1"), (topic, b"2")])
+    error = RuntimeError("Message too large")
+
+    with mock.patch.object(StreamEngine, "sync_send_many", return_value=[error]):
+        assert outbox.relay(stream_engine, batch_size=1) == 0
+
+    with mock.patch.object(
+        StreamEngine, "sync_send_many", return_value=[mock.Mock()]
+    ) as sync_send_many:
+        assert outbox.relay(stream_engine, batch_size=1) == 1
+
+    assert [record.value for record in sync_send_many.call_args[0][0]] == [b"2"]
+    assert list(OutboxEvent.objects.values_list("value", flat=True)) == [b"1"]
+
+
+@pytest.mark.django_db
+def test_claim(stream_engine: StreamEngine):
+    outbox.send_many([(topic, b"1"), (topic, b"2")])
+
+    claimed = outbox.claim(batch_size=1, claim_timeout=60)
+
+    # the claimed events are not produced by other relays until the timeout
+    assert [bytes(event.value) for event in claimed] == [b"1"]
+    assert [bytes(event.value) for event in outbox.claim()] == [b"2"]
+    assert outbox.claim() == []
+    assert not outbox.has_pending()
+
+
+@pytest.mark.django_db
+def test_outbox_relay_command(stream_engine: StreamEngine):
+    outbox.send_many([(topic, b"1"), (topic, b"2"), (topic, b"3")])
+
+    with mock.patch.multiple(
+        StreamEngine,
+        start_producer_thread=mock.DEFAULT,
+        stop_producer_thread=mock.DEFAULT,
+        sync_send_many=mock.Mock(side_effect=lambda records: list(records)),
+    ) as mocks:
+        call_command("outbox_relay", "--once", "--batch-size", "2")
+
+    mocks["start_producer_thread"].assert_called_once()
+    mocks["stop_producer_thread"].assert_called_once()
+    assert not OutboxEvent.objects.exists()
+
+
+@pytest.mark.django_db
+def test_outbox_relay_command_claim_timeout(stream_engine: StreamEngine):
+    with (
+        mock.patch.multiple(
+            StreamEngine,
+            start_producer_thread=mock.DEFAULT,
+            stop_producer_thread=mock.DEFAULT,
+        ),
+        mock.patch.object(outbox, "relay", return_value=0) as relay,
+    ):
+        call_command("outbox_relay", "--once", "--claim-timeout", "30")
+
+    assert relay.call_args.kwargs["claim_timeout"] == 30
+
+
+@pytest.mark.django_db
+def test_outbox_relay_command_once_drains(stream_engine: StreamEngine):
+    outbox.send_many([(topic, b"1"), (topic, b"2"), (topic, b"3")])
+    error = RuntimeError("Broker not available")
+    results = iter([[error, error], [mock.Mock()]])
+
+    with mock.patch.multiple(
+        StreamEngine,
+        start_producer_thread=mock.DEFAULT,
+        stop_producer_thread=mock.DEFAULT,
+        sync_send_many=mock.Mock(side_effect=lambda records: next(results)),
+    ):
+        call_command("outbox_relay", "--once", "--batch-size", "2")
+
+    # the batch that failed does not stop the relay, the failed events
+    # are retried after the backoff
+    assert [
+        bytes(value) for value in OutboxEvent.objects.values_list("value", flat=True)
+    ] == [
+        b"1",
+        b"2",
+    ]
@@ -0,0 +1,201 @@
+import asyncio
+import itertools
+from typing import List
+from unittest import mock
+
+import pytest
+from kstreams import ConsumerRecord, TopicPartition
+from prometheus_client import REGISTRY
+
+from django_streams import retries
+from django_streams.engine import StreamEngine
+from django_streams.retries import RetryDelayMiddleware, RetryMiddleware, RetryPolicy
+from django_streams.test_utils.test_client import TestStreamClient
+
+topic = "dev-kpn-des--hello-retries"
+
+
+def headers(cr: ConsumerRecord) -> dict:
+    return {header: value.decode() for header, value in cr.headers}
+
+
+def test_retry_policy():
+    policy = RetryPolicy(delays=(30, 60, 600, 7200))
+
+    assert [retries.format_delay(delay) for delay in policy.delays] == [
+        "30s",
+        "1m",
+        "10m",
+        "2h",
+    ]
+    assert policy.retry_topics([topic]) == [
+        f"{topic}.retry.30s",
+        f"{topic}.retry.1m",
+        f"{topic}.retry.10m",
+        f"{topic}.retry.2h",
+    ]
+    assert policy.next_topic(topic, 0) == (f"{topic}.retry.30s", 30)
+    assert policy.next_topic(topic, 3) == (f"{topic}.retry.2h", 7200)
+    assert policy.next_topic(topic, 4) == (f"{topic}.dlq", None)
+    assert RetryPolicy(dlq_topic="dlq").next_topic(topic, 2) == ("dlq", None)
+
+
+@pytest.mark.asyncio
+async def test_retry_to_dlq(stream_engine: StreamEngine):
+    attempts: List[ConsumerRecord] = []
+    processed = asyncio.Event()
+
+    @stream_engine.stream(
+        topic, name="hello-retries", retry_policy=RetryPolicy(delays=(60,))
+    )
+    async def consume(cr: ConsumerRecord):
+        attempts.append(cr)
+        if cr.value == b"poison":
+            raise ValueError("poison message")
+        if cr.offset == 1:
+            processed.set()
+
+    assert [stream.name for stream in stream_engine._streams] == [
+        "hello-retries",
+        "hello-retries-retry",
+    ]
+    assert stream_engine._streams[1].topics == [f"{topic}.retry.1m"]
+
+    # every call is 10 minutes later, so the retries are due
+    clock = itertools.count(1_700_000_000, 600)
+    with mock.patch.object(retries.time, "time", side_effect=lambda: next(clock)):
+        async with TestStreamClient(stream_engine=stream_engine) as client:
+            await client.send(topic, value=b"poison", key="1", headers={"id": "a"})
+            # the next record is not blocked by the poison one
+            await client.send(topic, value=b"Hi", key="2")
+            await asyncio.wait_for(processed.wait(), timeout=1)
+
+            cr = await asyncio.wait_for(
+                client.get_event(topic_name=f"{topic}.dlq"), timeout=1
+            )
+
+    assert [cr.value for cr in attempts if cr.topic == topic] == [b"poison", b"Hi"]
+    retried = [cr for cr in attempts if cr.topic != topic]
+    assert [(cr.topic, cr.value) for cr in retried] == [
+        (f"{topic}.retry.1m", b"poison")
+    ]
+    assert headers(retried[0]) == {
+        "id": "a",
+        "retry-attempt": "1",
+        "retry-topic": topic,
+        "retry-partition": "0",
+        "retry-offset": "0",
+        "retry-error": "ValueError('poison message')",
+        "retry-due": "1700000060000",
+    }
+
+    assert cr.key == "1"
+    assert cr.value == b"poison"
+    dlq_headers = headers(cr)
+    assert dlq_headers["retry-attempt"] == "2"
+    assert dlq_headers["retry-topic"] == topic
+    assert dlq_headers["retry-offset"] == "0"
+    assert REGISTRY.get_sample_value(
+        "django_streams_records_retried_total",
+        {"stream": "hello-retries-retry", "topic": f"{topic}.dlq"},
+    )
+
+
+@pytest.mark.asyncio
+async def test_retry_not_matching_error():
+    send = mock.AsyncMock()
+    next_call = mock.AsyncMock(side_effect=KeyError("id"))
+    retry = RetryMiddleware(
+        retry_policy=RetryPolicy(retry_on=(ValueError,)),
+        next_call=next_call,
+        send=send,
+        stream=mock.Mock(),
+    )
+    cr = ConsumerRecord(topic, 0, 0, 0, 0, None, b"Hi", None, 0, 2, [])
+
+    with pytest.raises(KeyError):
+        await retry(cr)
+    send.assert_not_called()
+
+    # the original error is raised if the record can not be retried
+    next_call.side_effect = ValueError("invalid")
+    send.side_effect = ConnectionError
+    with pytest.raises(ValueError):
+        await retry(cr)
+
+
+@pytest.mark.asyncio
+async def test_retry_with_invalid_headers():
+    send = mock.AsyncMock()
+    next_call = mock.AsyncMock(side_effect=ValueError("invalid"))
+    retry = RetryMiddleware(
+        retry_policy=RetryPolicy(delays=(60, 600)),
+        next_call=next_call,
+        send=send,
+        stream=mock.Mock(),
+    )
+    cr_headers = [("retry-attempt", b"\xff"), ("trace", b"\xfe1"), ("empty", None)]
+    cr = ConsumerRecord(topic, 0, 0, 0, 0, None, b"Hi", None, 0, 2, cr_headers)
+
+    await retry(cr)
+
+    # the invalid attempt is ignored, the record is retried from the start
+    send.assert_awaited_once()
+    assert send.call_args.args == (f"{topic}.retry.1m",)
+    sent_headers = send.call_args.kwargs["headers"]
+    assert sent_headers["retry-attempt"] == "1"
+    assert sent_headers["trace"] == "\ufffd1"
+    assert "empty" not in sent_headers
+
+    # the invalid due date is ignored, the record is due
+    delay = RetryDelayMiddleware(
+        next_call=next_call, send=mock.Mock(), stream=mock.Mock()
+    )
+    cr.headers = [("retry-due", b"\xff")]
+    with pytest.raises(ValueError):
+        await delay(cr)
+    next_call.assert_awaited_with(cr)
+
+
+@pytest.mark.asyncio
+async def test_retry_delay():
+    consumer = mock.Mock()
+    topic_partition = TopicPartition(f"{topic}.retry.1m", 0)
+    consumer.assignment.return_value = {topic_partition}
+    next_call = mock.AsyncMock()
+    delay = RetryDelayMiddleware(
+        next_call=next_call, send=mock.Mock(), stream=mock.Mock(consumer=consumer)
+    )
+    due = b"%d" % (retries.time.time() * 1000 + 50)
+    cr = ConsumerRecord(
+        f"{topic}.retry.1m", 0, 5, 0, 0, None, b"Hi", None, 0, 2, [("retry-due", due)]
+    )
+
+    await delay(cr)
+
+    # the partition is paused and the record is consumed again when it is due
+    next_call.assert_not_called()
+    consumer.pause.assert_called_once_with(topic_partition)
+    consumer.seek.assert_called_once_with(topic_partition, 5)
+    consumer.resume.assert_not_called()
+    await asyncio.sleep(0.1)
+    consumer.resume.assert_called_once_with(topic_partition)
+
+    cr.headers = [("retry-due", b"%d" % (retries.time.time() * 1000))]
+    await delay(cr)
+    next_call.assert_awaited_once_with(cr)
+
+
+def test_retry_policy_errors(stream_engine: StreamEngine):
+    with pytest.raises(ValueError, match="pattern"):
+        stream_engine.stream(
+            "^dev-kpn-des--.*$", subscribe_by_pattern=True, retry_policy=RetryPolicy()
+        )
+
+    with pytest.raises(ValueError, match="without typing"):
+
+        @stream_engine.stream(topic, retry_policy=RetryPolicy())
+        async def consume(stream):
+            pass
+
+    assert stream_engine._streams == []
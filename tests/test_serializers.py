@@ -0,0 +1,118 @@
+import dataclasses
+import datetime
+import json
+import uuid
+from decimal import Decimal
+from typing import List
+
+import pydantic
+import pytest
+from django.utils.dateparse import parse_duration
+from django.utils.translation import gettext_lazy
+from kstreams import ConsumerRecord, middleware
+
+from django_streams import serializers
+from django_streams.engine import StreamEngine
+from django_streams.test_utils.test_client import TestStreamClient
+
+topic = "dev-kpn-des--hello-json"
+
+django_types = {
+    "id": uuid.UUID("3f1c5e2a-8f4b-4c1e-9a55-7d1e5b8f0c11"),
+    "price": Decimal("10.50"),
+    "created_at": datetime.datetime(2024, 1, 2, 3, 4, 5),
+    "day": datetime.date(2024, 1, 2),
+    "duration": datetime.timedelta(days=1, seconds=5),
+    "message": gettext_lazy("Hello"),
+}
+
+
+@dataclasses.dataclass
+class Order:
+    id: int
+    total: float
+
+
+class PydanticOrder(pydantic.BaseModel):
+    id: int
+    total: float
+
+
+class PlainOrder:
+    def __init__(self, id: int, total: float) -> None:
+        self.id = id
+        self.total = total
+
+
+@pytest.mark.parametrize(
+    "dumps", [serializers.dumps, serializers._json_dumps], ids=["backend", "json"]
+)
+def test_dumps_django_types(dumps):
+    value = json.loads(dumps(django_types))
+
+    # the format of the durations depends on the library
+    assert parse_duration(value.pop("duration")) == django_types["duration"]
+    assert value == {
+        "id": "3f1c5e2a-8f4b-4c1e-9a55-7d1e5b8f0c11",
+        "price": "10.50",
+        "created_at": "2024-01-02T03:04:05",
+        "day": "2024-01-02",
+        "message": "Hello",
+    }
+
+
+def test_dumps_not_serializable():
+    with pytest.raises(TypeError):
+        serializers.dumps({"value": object()})
+
+
+@pytest.mark.parametrize("value_type", [Order, PydanticOrder, PlainOrder])
+def test_loads_typed(value_type):
+    order = serializers.loads(b'{"id": 1, "total": 9.5}', value_type)
+
+    assert isinstance(order, value_type)
+    assert (order.id, order.total) == (1, 9.5)
+
+
+def test_loads_generic_type():
+    orders = serializers.loads(b'[{"id": 1, "total": 9.5}]', List[Order])
+
+    assert orders == [Order(id=1, total=9.5)]
+
+
+def test_loads_generic_type_without_msgspec(monkeypatch):
+    monkeypatch.setattr(serializers, "msgspec", None)
+
+    orders = serializers.loads(b'[{"id": 1, "total": 9.5}]', List[Order])
+
+    assert orders == [{"id": 1, "total": 9.5}]
+
+
+@pytest.mark.asyncio
+async def test_json_serializer():
+    serializer = serializers.JsonSerializer()
+
+    assert await serializer.serialize({"message": "Hi KPN"}) == b'{"message":"Hi KPN"}'
+    assert await serializer.serialize(b"raw") == b"raw"
+
+
+@pytest.mark.asyncio
+async def test_e2e_json_deserializer_middleware(stream_engine: StreamEngine):
+    stream_engine.serializer = serializers.JsonSerializer()
+    orders = []
+
+    @stream_engine.stream(
+        topic,
+        middlewares=[
+            middleware.Middleware(
+                serializers.JsonDeserializerMiddleware, value_type=Order
+            )
+        ],
+    )
+    async def consume(cr: ConsumerRecord):
+        orders.append(cr.value)
+
+    async with TestStreamClient(stream_engine=stream_engine):
+        await stream_engine.send(topic, value={"id": 1, "total": 9.5})
+
+    assert orders == [Order(id=1, total=9.5)]
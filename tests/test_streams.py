@@ -0,0 +1,189 @@
+import asyncio
+from typing import List, Optional
+from unittest import mock
+
+import pytest
+from asgiref.sync import sync_to_async
+from kstreams import ConsumerRecord, TopicPartition
+from kstreams.streams_utils import UDFType
+
+from django_streams.db import DatabaseExecutor
+from django_streams.engine import StreamEngine
+from django_streams.streams import BatchStream, ConcurrentStream, OffsetTracker
+from django_streams.test_utils.test_client import TestStreamClient
+from tests.testing_app.models import HelloWorld
+
+topic = "dev-kpn-des--hello-batch"
+
+
+def test_add_batch_stream(stream_engine: StreamEngine):
+    @stream_engine.batch_stream(
+        topic, max_records=10, max_wait_ms=50, enable_auto_commit=True
+    )
+    def consume_batch(records: List[ConsumerRecord]):
+        """Consume a batch"""
+
+    assert isinstance(consume_batch, BatchStream)
+    assert stream_engine._streams == [consume_batch]
+    assert consume_batch.__doc__ == "Consume a batch"
+    assert consume_batch.udf_handler.type == UDFType.NO_TYPING
+    assert consume_batch.max_records == 10
+    assert consume_batch.max_wait_ms == 50
+    assert consume_batch.config == {"enable_auto_commit": False}
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "executor", [None, DatabaseExecutor(name="test-batch")], ids=["default", "executor"]
+)
+async def test_e2e_batch_stream(
+    stream_engine: StreamEngine, executor: Optional[DatabaseExecutor]
+):
+    batches = []
+
+    @stream_engine.batch_stream(topic, max_records=2, executor=executor)
+    def consume_batch(records: List[ConsumerRecord]):
+        batches.append([cr.offset for cr in records])
+        HelloWorld.objects.bulk_create(
+            [HelloWorld(message=cr.value.decode()) for cr in records]
+        )
+
+    async with TestStreamClient(stream_engine=stream_engine) as client:
+        for message in ("one", "two", "three", "four"):
+            await client.send(topic, value=message.encode(), partition=0)
+        consumer = consume_batch.consumer
+
+    assert batches == [[0, 1], [2, 3]]
+    assert list(consumer.partitions_committed.values()) == [4]
+    messages = await sync_to_async(list)(
+        HelloWorld.objects.order_by("id").values_list("message", flat=True)
+    )
+    assert messages == ["one", "two", "three", "four"]
+
+
+@pytest.mark.asyncio
+async def test_batch_stream_error_does_not_commit(stream_engine: StreamEngine):
+    consume_batch = mock.Mock(side_effect=ValueError("Database not available"))
+    stream = stream_engine.batch_stream(topic, max_records=1)(consume_batch)
+
+    async with TestStreamClient(stream_engine=stream_engine) as client:
+        consumer = stream.consumer
+        await client.send(topic, value=b"one", partition=0)
+
+    consume_batch.assert_called_once()
+    assert consumer.partitions_committed == {}
+    assert not stream.running
+
+
+def test_offset_tracker():
+    tracker = OffsetTracker()
+    tp0 = TopicPartition(topic=topic, partition=0)
+    tp1 = TopicPartition(topic=topic, partition=1)
+
+    for offset in range(3):
+        tracker.add(tp0, offset)
+    tracker.add(tp1, 7)
+
+    tracker.done(tp0, 1)
+    tracker.done(tp1, 7)
+    assert tracker.committable([tp0, tp1]) == {tp0: 0, tp1: 8}
+    assert tracker.committable([tp0]) == {tp0: 0}
+
+    tracker.done(tp0, 0)
+    tracker.committed({tp0: 2, tp1: 8})
+    assert tracker.committable([tp0, tp1]) == {}
+
+    tracker.done(tp0, 2)
+    assert tracker.committable([tp0, tp1]) == {tp0: 3}
+
+
+def test_concurrency_without_typing(stream_engine: StreamEngine):
+    with pytest.raises(ValueError):
+
+        @stream_engine.stream(topic, concurrency=2)
+        async def stream(stream): ...
+
+    assert stream_engine._streams == []
+
+
+@pytest.mark.asyncio
+async def test_e2e_concurrent_stream(stream_engine: StreamEngine):
+    processed = []
+    running = 0
+    max_running = 0
+
+    @stream_engine.stream(topic, concurrency=3)
+    async def consume(cr: ConsumerRecord):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(running, max_running)
+        # the first records of each key are the slowest
+        await asyncio.sleep(0.05 if cr.value == b"1" else 0.01)
+        processed.append((cr.key, cr.value))
+        running -= 1
+
+    assert isinstance(consume, ConcurrentStream)
+    assert consume.config["enable_auto_commit"] is False
+
+    async with TestStreamClient(stream_engine=stream_engine) as client:
+        for key in ("a", "b", "c"):
+            await client.send(topic, value=b"1", key=key, partition=0)
+        for key in ("a", "b"):
+            await client.send(topic, value=b"2", key=key, partition=0)
+        consumer = consume.consumer
+
+    assert max_running == 3
+    assert [value for key, value in processed if key == "a"] == [b"1", b"2"]
+    assert [value for key, value in processed if key == "b"] == [b"1", b"2"]
+    assert consumer.partitions_committed == {
+        TopicPartition(topic=topic, partition=0): 5
+    }
+
+
+@pytest.mark.asyncio
+async def test_concurrent_stream_error(stream_engine: StreamEngine):
+    processed = []
+
+    @stream_engine.stream(topic, concurrency=2)
+    async def consume(cr: ConsumerRecord):
+        if cr.value == b"fail":
+            raise ValueError("Database not available")
+        await asyncio.sleep(0.01)
+        processed.append(cr.value)
+
+    async with TestStreamClient(stream_engine=stream_engine) as client:
+        consumer = consume.consumer
+        await client.send(topic, value=b"1", key="a", partition=0)
+        await client.send(topic, value=b"fail", key="b", partition=0)
+        await client.send(topic, value=b"2", key="b", partition=0)
+        await asyncio.sleep(0.1)
+
+    assert not consume.running
+    # the record in flight finishes and the records after the failure
+    # are not processed, so only the offsets before it are committed
+    assert processed == [b"1"]
+    assert consumer.partitions_committed == {
+        TopicPartition(topic=topic, partition=0): 1
+    }
+
+
+@pytest.mark.asyncio
+async def test_stop_idle_concurrent_stream(stream_engine: StreamEngine):
+    @stream_engine.stream(topic, concurrency=2, auto_commit_interval_ms=60_000)
+    async def consume(cr: ConsumerRecord): ...
+
+    # there are no records, so the dispatcher waits in `getone`
+    consumer = mock.AsyncMock(getone=asyncio.Event().wait)
+    consumer.assignment = mock.Mock(return_value=set())
+    consumer.unsubscribe = mock.Mock()
+    consume.consumer = consumer
+    consume.running = True
+    dispatcher = asyncio.ensure_future(consume.func_wrapper_with_concurrency())
+    await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(consume.stop(), timeout=1)
+    # the dispatcher does not wait for the commit interval
+    await asyncio.wait_for(dispatcher, timeout=1)
+    consumer.stop.assert_awaited_once()
+    consumer.unsubscribe.assert_called_once()
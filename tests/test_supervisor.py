@@ -0,0 +1,108 @@
+import os
+import signal
+import threading
+import time
+from unittest import mock
+
+from django_streams.supervisor import Supervisor
+
+
+def test_restart_crashed_children(tmp_path):
+    def target(index: int):
+        with open(tmp_path / f"started-{index}", "a") as f:
+            f.write("x")
+        raise RuntimeError("Worker crashed")
+
+    supervisor = Supervisor(target, 2, min_backoff=0.01, max_backoff=0.05)
+
+    def stop_after_restarts():
+        while not all(
+            (tmp_path / f"started-{index}").exists()
+            and len((tmp_path / f"started-{index}").read_text()) >= 3
+            for index in range(2)
+        ):
+            time.sleep(0.01)
+        supervisor.stop()
+
+    stopper = threading.Thread(target=stop_after_restarts)
+    stopper.start()
+    supervisor.run()
+    stopper.join()
+
+    assert supervisor._failures[0] >= 2
+    assert supervisor._failures[1] >= 2
+    assert not supervisor._alive_children()
+
+
+def test_forward_sigterm_to_children(tmp_path):
+    def target(index: int):
+        stopped = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: stopped.set())
+        (tmp_path / f"started-{index}").touch()
+
+        # graceful shutdown when the parent forwards the signal
+        stopped.wait(10)
+        (tmp_path / f"stopped-{index}").touch()
+
+    supervisor = Supervisor(target, 3)
+
+    def send_sigterm():
+        while len(list(tmp_path.glob("started-*"))) < 3:
+            time.sleep(0.01)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    previous_handler = signal.getsignal(signal.SIGTERM)
+    threading.Thread(target=send_sigterm).start()
+    supervisor.run()
+
+    assert supervisor.stopping
+    assert sorted(path.name for path in tmp_path.glob("stopped-*")) == [
+        "stopped-0",
+        "stopped-1",
+        "stopped-2",
+    ]
+    assert all(child.exitcode == 0 for child in supervisor._children.values())
+    assert signal.getsignal(signal.SIGTERM) == previous_handler
+
+
+def test_kill_children_after_shutdown_timeout():
+    def target(index: int):
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        time.sleep(10)
+
+    supervisor = Supervisor(target, 1, shutdown_timeout=0.2)
+    threading.Timer(0.2, supervisor.stop).start()
+    supervisor.run()
+
+    assert supervisor._children[0].exitcode == -signal.SIGKILL
+
+
+def test_mark_dead_children_in_multiprocess_mode(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+
+    def target(index: int):
+        (tmp_path / f"pid-{index}").write_text(str(os.getpid()))
+        if index == 0:
+            raise RuntimeError("Worker crashed")
+        time.sleep(10)
+
+    supervisor = Supervisor(target, 2, min_backoff=10)
+
+    def stop_after_crash():
+        while (
+            supervisor._children.get(0, True) is not None
+            or not (tmp_path / "pid-1").exists()
+        ):
+            time.sleep(0.01)
+        supervisor.stop()
+
+    threading.Thread(target=stop_after_crash).start()
+    with mock.patch("prometheus_client.multiprocess.mark_process_dead") as dead:
+        supervisor.run()
+
+    # the crashed child is marked dead when it is restarted,
+    # and the other one on shutdown
+    assert [call.args[0] for call in dead.call_args_list] == [
+        int((tmp_path / "pid-0").read_text()),
+        int((tmp_path / "pid-1").read_text()),
+    ]
@@ -0,0 +1,216 @@
+import asyncio
+from unittest import mock
+
+import pytest
+from asgiref.sync import sync_to_async
+from django.db import connection
+from kstreams import ConsumerRecord, TopicPartition
+from prometheus_client import REGISTRY
+
+from django_streams.engine import StreamEngine
+from django_streams.retries import RetryPolicy
+from django_streams.streams import ConcurrentStream, OffsetTracker
+from django_streams.tables import TablesRebalanceListener
+from django_streams.test_utils.test_client import TestStreamClient
+from tests.testing_app.models import Counter
+
+topic = "dev-kpn-des--hello-tables"
+
+
+def totals():
+    return dict(Counter.objects.values_list("name", "total"))
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.asyncio
+async def test_table(stream_engine: StreamEngine):
+    await sync_to_async(Counter.objects.create)(name="a", total=5)
+    counters = stream_engine.table("counters", model=Counter, key_field="name")
+
+    assert counters.fields == ["total"]
+    for name in ("a", "a", "b"):
+        counter = await counters.get(name)
+        counter.total += 1
+        await counters.save(counter)
+
+    # the changes are buffered
+    assert await sync_to_async(totals)() == {"a": 5}
+
+    await counters.flush()
+    assert await sync_to_async(totals)() == {"a": 7, "b": 1}
+    assert (
+        REGISTRY.get_sample_value(
+            "django_streams_table_rows_flushed_total", {"table": "counters"}
+        )
+        == 2
+    )
+
+    # the hot keys are not read again
+    with mock.patch.object(counters, "_load") as load:
+        assert (await counters.get("a")).total == 7
+    load.assert_not_called()
+
+    with pytest.raises(ValueError, match="Table counters already exists"):
+        stream_engine.table("counters", model=Counter)
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.asyncio
+async def test_table_without_update_conflicts(stream_engine: StreamEngine):
+    await sync_to_async(Counter.objects.create)(name="a", total=5)
+    counters = stream_engine.table("counters", model=Counter, key_field="name")
+    for name in ("a", "b"):
+        counter = await counters.get(name)
+        counter.total += 1
+        await counters.save(counter)
+
+    # like django < 4.1, the existing rows are updated and the others created
+    with mock.patch.object(
+        connection.features, "supports_update_conflicts", False, create=True
+    ):
+        await counters.flush()
+
+    assert await sync_to_async(totals)() == {"a": 6, "b": 1}
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.asyncio
+async def test_table_flush_triggers(stream_engine: StreamEngine):
+    counters = stream_engine.table(
+        "counters", model=Counter, key_field="name", flush_size=2, flush_interval=0.01
+    )
+
+    await counters.save(Counter(name="a", total=1))
+    await counters.save(Counter(name="b", total=1))
+    # the buffer is full
+    assert await sync_to_async(totals)() == {"a": 1, "b": 1}
+
+    await counters.save(Counter(name="a", total=2))
+    await asyncio.sleep(0.1)
+    assert await sync_to_async(totals)() == {"a": 2, "b": 1}
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.asyncio
+async def test_table_flush_error(stream_engine: StreamEngine):
+    counters = stream_engine.table("counters", model=Counter, key_field="name")
+    await counters.save(Counter(name="a", total=1))
+
+    with mock.patch.object(counters, "_upsert", side_effect=ConnectionError):
+        with pytest.raises(ConnectionError):
+            await counters.flush()
+
+    # the changes are written in the next flush
+    await counters.save(Counter(name="b", total=1))
+    await counters.flush()
+    assert await sync_to_async(totals)() == {"a": 1, "b": 1}
+
+
+@pytest.mark.asyncio
+async def test_table_evicts_unchanged_rows(stream_engine: StreamEngine):
+    counters = stream_engine.table("counters", model=Counter, key_field="name")
+    counters.maxsize = 1
+
+    with mock.patch.object(counters, "_upsert"):
+        await counters.save(Counter(name="a", total=1))
+        await counters.save(Counter(name="b", total=1))
+        # the changed rows are kept until they are flushed
+        assert len(counters) == 2
+
+        await counters.flush()
+        assert len(counters) == 1
+
+        counters.clear()
+        assert len(counters) == 0
+
+
+@pytest.mark.asyncio
+async def test_table_get_with_unflushed_rows(stream_engine: StreamEngine):
+    counters = stream_engine.table("counters", model=Counter, key_field="name")
+    counters.maxsize = 1
+
+    with mock.patch.object(
+        counters, "_load", side_effect=lambda key: Counter(name=key)
+    ):
+        await counters.save(Counter(name="a", total=1))
+        # all the rows in memory are changed, the row loaded is not evicted
+        assert (await counters.get("b")).name == "b"
+        assert (await counters.get("c")).name == "c"
+
+    assert list(counters._rows) == ["a", "c"]
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.asyncio
+async def test_e2e_stream_with_tables(stream_engine: StreamEngine):
+    counters = stream_engine.table("counters", model=Counter, key_field="name")
+
+    @stream_engine.stream(topic, tables=[counters])
+    async def count(cr: ConsumerRecord):
+        counter = await counters.get(cr.key)
+        counter.total += 1
+        await counters.save(counter)
+
+    assert isinstance(count, ConcurrentStream)
+    assert count.concurrency == 1
+    assert isinstance(count.rebalance_listener, TablesRebalanceListener)
+
+    async with TestStreamClient(stream_engine=stream_engine) as client:
+        for key in ("a", "a", "b"):
+            await client.send(topic, value=b"click", key=key, partition=0)
+        consumer = count.consumer
+
+    assert await sync_to_async(totals)() == {"a": 2, "b": 1}
+    assert consumer.partitions_committed == {
+        TopicPartition(topic=topic, partition=0): 3
+    }
+
+
+@pytest.mark.asyncio
+async def test_commit_after_flush(stream_engine: StreamEngine):
+    counters = stream_engine.table("counters", model=Counter)
+
+    @stream_engine.stream(topic, tables=[counters])
+    async def count(cr: ConsumerRecord): ...
+
+    topic_partition = TopicPartition(topic=topic, partition=0)
+    count.consumer = mock.Mock(
+        assignment=mock.Mock(return_value={topic_partition}), stop=mock.AsyncMock()
+    )
+    count.running = True
+    count._offsets = OffsetTracker()
+    count._offsets.add(topic_partition, 0)
+    count._offsets.done(topic_partition, 0)
+    calls = mock.AsyncMock()
+
+    with (
+        mock.patch.object(counters, "flush", calls.flush),
+        mock.patch.object(count, "commit", calls.commit),
+    ):
+        # the offsets are not committed if the tables are not flushed
+        calls.flush.side_effect = ConnectionError
+        await count.commit_processed()
+        calls.commit.assert_not_called()
+
+        calls.flush.side_effect = None
+        await count.commit_processed()
+        assert [call[0] for call in calls.mock_calls] == ["flush", "flush", "commit"]
+
+    consumer = count.consumer
+    await count.stop()
+    consumer.stop.assert_awaited_once()
+    assert not count.running
+
+
+def test_tables_errors(stream_engine: StreamEngine):
+    counters = stream_engine.table("counters", model=Counter)
+
+    with pytest.raises(ValueError, match="retry_policy can not use tables"):
+        stream_engine.stream(topic, tables=[counters], retry_policy=RetryPolicy())
+
+    with pytest.raises(ValueError, match="can not use tables without typing"):
+
+        @stream_engine.stream(topic, tables=[counters])
+        async def count(stream): ...
+
+    assert stream_engine._streams == []
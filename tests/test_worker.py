@@ -1,8 +1,17 @@
+import asyncio
+import os
+import signal
+from typing import List
 from unittest import mock
 
+import pytest
+from aiokafka.errors import ConsumerStoppedError
 from django.core.management import call_command
+from django.core.management.base import CommandError
+from kstreams import ConsumerRecord
 
 from django_streams.engine import StreamEngine
+from django_streams.retries import RetryPolicy
 
 
 def test_worker(stream_engine: StreamEngine):
@@ -24,3 +33,194 @@ def test_worker(stream_engine: StreamEngine):
         call_command("worker")
         assert stream_engine.loop
         assert stream_instance.running
+
+
+def test_worker_processes(stream_engine: StreamEngine):
+    with mock.patch(
+        "django_streams.management.commands.worker.Supervisor"
+    ) as supervisor_class, mock.patch.object(
+        StreamEngine, "sync_start"
+    ) as sync_start:
+        call_command("worker", "--processes", "4")
+
+        target, processes = supervisor_class.call_args[0]
+        assert processes == 4
+        supervisor_class.return_value.run.assert_called_once()
+        sync_start.assert_not_called()
+
+        # each child runs the engine
+        previous_handler = signal.getsignal(signal.SIGTERM)
+        try:
+            target(0)
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
+        sync_start.assert_called_once()
+
+
+def test_worker_select_streams(stream_engine: StreamEngine):
+    @stream_engine.stream("dev-kpn-des--hello-kpn", name="hello")
+    async def hello(_):
+        pass
+
+    @stream_engine.stream("dev-kpn-des--bye-kpn", name="bye")
+    async def bye(_):
+        pass
+
+    @stream_engine.stream(
+        "^dev-kpn-des--order-.*$", name="orders", subscribe_by_pattern=True
+    )
+    async def orders(_):
+        pass
+
+    with mock.patch("kstreams.clients.Consumer.start"), mock.patch(
+        "kstreams.clients.Producer.start"
+    ):
+        call_command(
+            "worker", "--streams", "hello,orders", "--exclude-streams", "orders"
+        )
+
+    assert stream_engine._streams == [hello]
+    assert hello.running
+    assert bye.consumer is None
+    assert orders.consumer is None
+
+
+@pytest.mark.parametrize(
+    "topics, selected",
+    [
+        (["dev-kpn-des--hello-kpn"], ["hello", "bye"]),
+        (["dev-kpn-des--order-created", "dev-kpn-des--bye-kpn"], ["bye", "orders"]),
+    ],
+)
+def test_select_streams_by_topic(stream_engine: StreamEngine, topics, selected):
+    @stream_engine.stream("dev-kpn-des--hello-kpn", name="hello")
+    async def hello(_):
+        pass
+
+    @stream_engine.stream(
+        ["dev-kpn-des--bye-kpn", "dev-kpn-des--hello-kpn"], name="bye"
+    )
+    async def bye(_):
+        pass
+
+    @stream_engine.stream(
+        "^dev-kpn-des--order-.*$", name="orders", subscribe_by_pattern=True
+    )
+    async def orders(_):
+        pass
+
+    streams = stream_engine.select_streams(topics=topics)
+    assert [stream.name for stream in streams] == selected
+    assert stream_engine._streams == streams
+
+
+@pytest.mark.parametrize(
+    "options, selected",
+    [
+        ({"names": ["orders"]}, ["orders", "orders-retry"]),
+        ({"topics": ["dev-kpn-des--orders"]}, ["orders", "orders-retry"]),
+        ({"names": ["orders"], "exclude": ["orders-retry"]}, ["orders"]),
+        ({"exclude": ["orders"]}, ["hello"]),
+        ({"names": ["orders-retry"]}, ["orders-retry"]),
+    ],
+)
+def test_select_streams_with_retries(stream_engine: StreamEngine, options, selected):
+    @stream_engine.stream("dev-kpn-des--hello-kpn", name="hello")
+    async def hello(_):
+        pass
+
+    @stream_engine.stream(
+        "dev-kpn-des--orders", name="orders", retry_policy=RetryPolicy(delays=(60,))
+    )
+    async def orders(cr: ConsumerRecord):
+        pass
+
+    # the retry stream is selected with its stream
+    streams = stream_engine.select_streams(**options)
+    assert [stream.name for stream in streams] == selected
+
+
+def test_worker_select_unknown_streams(stream_engine: StreamEngine):
+    @stream_engine.stream("dev-kpn-des--hello-kpn", name="hello")
+    async def hello(_):
+        pass
+
+    with pytest.raises(CommandError, match="do not exist"):
+        call_command("worker", "--streams", "hello,bye")
+
+    with pytest.raises(CommandError, match="No selected stream consumes from"):
+        call_command("worker", "--topics", "dev-kpn-des--bye-kpn")
+
+    assert stream_engine._streams == [hello]
+
+
+@pytest.mark.parametrize(
+    "drain_timeout, processed",
+    [
+        # the handler is cancelled in the middle
+        (None, []),
+        # the handler finishes and the next records are not fetched
+        ("1", [0]),
+        # the handler takes longer than the deadline
+        ("0.01", []),
+    ],
+)
+def test_worker_drain(stream_engine: StreamEngine, drain_timeout, processed):
+    topic = "dev-kpn-des--hello-kpn"
+    handled: List[int] = []
+    consumer_stopped = asyncio.Event()
+
+    async def getone(*args):
+        if not handled and not consumer_stopped.is_set():
+            return ConsumerRecord(topic, 0, 0, 0, 0, None, b"Hi", None, 0, 2, [])
+        await consumer_stopped.wait()
+        raise ConsumerStoppedError()
+
+    async def stop_consumer(*args):
+        consumer_stopped.set()
+
+    @stream_engine.stream(topic, name="hello")
+    async def hello(cr: ConsumerRecord):
+        # the worker is stopped while the record is processed
+        handled.append(-1)
+        os.kill(os.getpid(), signal.SIGTERM)
+        await asyncio.sleep(0.1)
+        handled[-1] = cr.offset
+
+    options = [] if drain_timeout is None else ["--drain-timeout", drain_timeout]
+    previous_handlers = signal.getsignal(signal.SIGINT), signal.getsignal(
+        signal.SIGTERM
+    )
+    try:
+        with (
+            mock.patch("kstreams.clients.Consumer.start"),
+            mock.patch("kstreams.clients.Consumer.getone", getone),
+            mock.patch("kstreams.clients.Consumer.stop", side_effect=stop_consumer),
+            mock.patch("kstreams.clients.Producer.start"),
+            mock.patch("kstreams.clients.Producer.flush") as flush,
+        ):
+            call_command("worker", *options)
+    finally:
+        signal.signal(signal.SIGINT, previous_handlers[0])
+        signal.signal(signal.SIGTERM, previous_handlers[1])
+
+    assert [offset for offset in handled if offset >= 0] == processed
+    assert not hello.running
+    # the consumer commits and leaves the group when it stops
+    assert consumer_stopped.is_set()
+    if processed:
+        # the pending sends are flushed before the producer stops
+        flush.assert_awaited_once()
+
+
+def test_worker_drain_timeout_processes(stream_engine: StreamEngine):
+    with pytest.raises(CommandError, match="--drain-timeout must be lower"):
+        call_command(
+            "worker",
+            "--processes",
+            "2",
+            "--drain-timeout",
+            "30",
+            "--shutdown-timeout",
+            "30",
+        )
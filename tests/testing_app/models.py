@@ -0,0 +1,22 @@
+from django.db import models
+
+from django_streams.cdc import StreamedQuerySet
+
+
+class HelloWorld(models.Model):
+    message = models.CharField(max_length=255)
+
+
+class Order(models.Model):
+    reference = models.UUIDField()
+    total = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField()
+    delivery_time = models.DurationField(null=True)
+    hello = models.ForeignKey(HelloWorld, null=True, on_delete=models.SET_NULL)
+
+    objects = StreamedQuerySet.as_manager()
+
+
+class Counter(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    total = models.IntegerField(default=0)
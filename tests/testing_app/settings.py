@@ -2,4 +2,14 @@ USE_TZ = False
 
 INSTALLED_APPS = [
     "django_streams",
+    "tests.testing_app",
 ]
+
+DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": ":memory:",
+    }
+}